@@ -0,0 +1,509 @@
+"""Offline benchmarks of the hot paths of this repo.
+
+SMCReader and unfold benchmarks run on synthetic .smc files (see synthetic_smc.py) generated in a temporary
+directory, or on the files of --data_root / --actor_id / --seq.
+
+Every timing is recorded as "<benchmark title> / <row>". --save_baseline writes them to a JSON file, --check
+compares a run against such a file and exits with status 1 when a timing regressed by more than --max_slowdown.
+
+Usage:
+    python benchmark.py                 # run every benchmark
+    python benchmark.py write_ply       # run selected benchmarks
+    python benchmark.py get_img unfold --num_cameras 60 --num_frames 50 --height 1024 --width 1224
+    python benchmark.py --save_baseline baseline.json
+    python benchmark.py --check baseline.json [--max_slowdown 1.5]
+"""
+
+import argparse
+import atexit
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+
+import cv2
+import numpy as np
+
+from dataset import CameraSubsetSampler, MultiViewDataset
+from flame_export import export_sequence
+from smc_index import build_index
+from smc_reader import SMCReader
+from synthetic_smc import make_dataset
+from unfold_data import unfold_sequence
+from utils import imdecode_mask, pack_mask, rle_encode_mask, write_obj, write_ply
+
+
+def timeit(fn, *args, repeat=1, **kwargs):
+    """Best wall time of fn(*args, **kwargs) over repeat runs, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        st = time.perf_counter()
+        fn(*args, **kwargs)
+        best = min(best, time.perf_counter() - st)
+    return best
+
+
+# seconds of every timing of this run, by "<title> / <row name>"
+RESULTS = dict()
+# options that change what is timed: a baseline only compares to runs with the same ones
+BASELINE_SETTINGS = [
+    "n_faces",
+    "num_workers",
+    "data_root",
+    "actor_id",
+    "seq",
+    "num_cameras",
+    "num_frames",
+    "height",
+    "width",
+]
+
+
+def report(title, rows):
+    """Print rows of (name, seconds, extra) with the speedup against the first row."""
+    print(f"\n== {title}")
+    base = rows[0][1]
+    for name, seconds, extra in rows:
+        RESULTS[f"{title} / {name}"] = seconds
+        print(f"{name:<32s} {seconds:10.3f} s {base / seconds:8.1f}x  {extra}")
+
+
+def save_baseline(path, args):
+    with open(path, "w") as fp:
+        json.dump(dict(settings={k: getattr(args, k) for k in BASELINE_SETTINGS}, seconds=RESULTS), fp, indent=1)
+    print(f"\n{len(RESULTS)} timings saved to {path}")
+
+
+def check_baseline(path, args, max_slowdown=1.5, min_seconds=0.01):
+    """Compare the timings of this run to a baseline saved by save_baseline().
+
+    A timing regressed when it is more than max_slowdown times its baseline. Baselines under min_seconds are
+    compared as min_seconds, so that the noise of sub-millisecond timings is not reported. Baseline timings this
+    run did not produce (benchmarks not selected, rows needing an optional package) are reported as skipped.
+
+    Returns:
+        names of the regressed timings
+    """
+    with open(path, "r") as fp:
+        baseline = json.load(fp)
+    settings = {k: getattr(args, k) for k in BASELINE_SETTINGS}
+    assert baseline["settings"] == settings, f"Baseline {path} was run with other settings: {baseline['settings']}"
+    print(f"\n== check against {path}, at most {max_slowdown:.2f}x slower")
+    regressed = []
+    for name, seconds in RESULTS.items():
+        if name not in baseline["seconds"]:
+            print(f"{'new':<10s} {name}")
+            continue
+        base = baseline["seconds"][name]
+        ratio = seconds / max(base, min_seconds)
+        state = "ok"
+        if ratio > max_slowdown:
+            state = "SLOWER"
+            regressed.append(name)
+        print(f"{state:<10s} {name}: {base:.3f} s -> {seconds:.3f} s ({ratio:.2f}x)")
+    skipped = [name for name in baseline["seconds"] if name not in RESULTS]
+    titles = set(name.rpartition(" / ")[0] for name in RESULTS)
+    for name in skipped:
+        # rows of the benchmarks that ran, those of the others are only counted
+        if name.rpartition(" / ")[0] in titles:
+            print(f"{'skipped':<10s} {name}")
+    compared = len(RESULTS) - sum(name not in baseline["seconds"] for name in RESULTS)
+    print(f"{len(regressed)} of {compared} timings regressed, {len(skipped)} baseline timings skipped")
+    return regressed
+
+
+_SMC_FILES = None
+
+
+def smc_files(args):
+    """(raw_file, anno_file) of the benchmarked sequence, generated once per run unless --data_root is given."""
+    global _SMC_FILES
+    if _SMC_FILES is None:
+        if args.data_root is not None:
+            _SMC_FILES = tuple(
+                os.path.join(args.data_root, kind, args.actor_id, f"{args.actor_id}_{args.seq}_{kind}.smc")
+                for kind in ["raw", "anno"]
+            )
+        else:
+            tmp = tempfile.mkdtemp(prefix="smc_bench_")
+            atexit.register(shutil.rmtree, tmp, ignore_errors=True)
+            st = time.perf_counter()
+            (_SMC_FILES,) = make_dataset(
+                tmp, args.actor_id, [args.seq], args.num_cameras, args.num_frames, args.height, args.width
+            )
+            print(
+                f"synthetic {args.seq}: {args.num_cameras} cameras x {args.num_frames} frames of "
+                f"{args.height}x{args.width}, made in {time.perf_counter() - st:.1f} s"
+            )
+    return _SMC_FILES
+
+
+def synthetic_mesh(n_faces, seed=0):
+    rng = np.random.default_rng(seed)
+    n_verts = n_faces // 2
+    return dict(
+        vertex=rng.random((n_verts, 3)),
+        vertex_indices=rng.integers(0, n_verts, (n_faces, 3)),
+    )
+
+
+def _write_ply_loop(scan, outpath):
+    """Per-element write_ply as it was before vectorization, kept as the reference."""
+    from plyfile import PlyData, PlyElement
+
+    vertex = np.empty(len(scan["vertex"]), dtype=[("x", "f4"), ("y", "f4"), ("z", "f4")])
+    for i in range(len(scan["vertex"])):
+        vertex[i] = np.array(
+            [(scan["vertex"][i, 0], scan["vertex"][i, 1], scan["vertex"][i, 2])],
+            dtype=[("x", "f4"), ("y", "f4"), ("z", "f4")],
+        )
+    triangles = scan["vertex_indices"]
+    face = np.empty(
+        len(triangles), dtype=[("vertex_indices", "i4", (3,)), ("red", "u1"), ("green", "u1"), ("blue", "u1")]
+    )
+    for i in range(len(triangles)):
+        face[i] = np.array(
+            [([triangles[i, 0], triangles[i, 1], triangles[i, 2]], 255, 255, 255)],
+            dtype=[("vertex_indices", "i4", (3,)), ("red", "u1"), ("green", "u1"), ("blue", "u1")],
+        )
+    PlyData([PlyElement.describe(vertex, "vertex"), PlyElement.describe(face, "face")], text=True).write(outpath)
+
+
+def _write_obj_loop(filepath, verts, tris=None):
+    """Per-line write_obj as it was before vectorization, kept as the reference."""
+    fw = open(filepath, "w")
+    for vert in verts:
+        fw.write(f"v {vert[0]} {vert[1]} {vert[2]}\n")
+    if not tris is None:
+        for tri in tris:
+            fw.write(f"f {tri[0]} {tri[1]} {tri[2]}\n")
+    fw.close()
+
+
+def synthetic_mask(h=2048, w=2448, channels=1):
+    """Png of a filled ellipse, like a foreground mask: gray, or replicated into bgr when channels is 3."""
+    mask = np.zeros((h, w), dtype=np.uint8)
+    cv2.ellipse(mask, (w // 2, h // 2), (w // 4, h // 3), 0, 0, 360, 255, -1)
+    if channels == 3:
+        mask = cv2.cvtColor(mask, cv2.COLOR_GRAY2BGR)
+    return cv2.imencode(".png", mask)[1]
+
+
+def _decode_mask_color(img_byte):
+    """Mask decode as it was before the dedicated path, kept as the reference."""
+    return np.max(cv2.imdecode(img_byte, cv2.IMREAD_COLOR), 2).astype(np.uint8)
+
+
+def bench_write_ply(args):
+    scan = synthetic_mesh(args.n_faces)
+    cases = [
+        ("loop, ascii (before)", _write_ply_loop, {}),
+        ("vectorized, ascii", write_ply, {}),
+        ("vectorized, binary", write_ply, dict(binary=True)),
+    ]
+    try:
+        import plyfile  # noqa: F401
+    except ImportError:
+        # the reference writes through plyfile, write_ply does not need it
+        print("\nwrite_ply: plyfile is not installed, the loop reference is skipped")
+        cases = cases[1:]
+    with tempfile.TemporaryDirectory() as tmp:
+        rows = []
+        for name, fn, kwargs in cases:
+            path = os.path.join(tmp, "scan.ply")
+            seconds = timeit(fn, scan, path, **kwargs)
+            rows.append((name, seconds, f"{os.path.getsize(path) / 2**20:.1f} MB"))
+    report(f"write_ply, {args.n_faces} faces", rows)
+
+
+def bench_write_obj(args):
+    scan = synthetic_mesh(args.n_faces)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "mesh.obj")
+        rows = [
+            ("f-string per line (before)", timeit(_write_obj_loop, path, scan["vertex"], scan["vertex_indices"]), ""),
+            ("bulk", timeit(write_obj, path, scan["vertex"], scan["vertex_indices"], log=False), ""),
+        ]
+    report(f"write_obj, {args.n_faces} faces", rows)
+
+
+def bench_mask_decode(args):
+    for channels in [1, 3]:
+        img_byte = synthetic_mask(channels=channels)
+        ref = _decode_mask_color(img_byte)
+        assert np.array_equal(imdecode_mask(img_byte), ref), "mask decode differs from the reference"
+        out = np.empty_like(ref)
+        rows = [
+            ("IMREAD_COLOR + np.max (before)", timeit(_decode_mask_color, img_byte, repeat=args.repeat), ""),
+            ("imdecode_mask", timeit(imdecode_mask, img_byte, repeat=args.repeat), "equal"),
+            ("imdecode_mask, into out", timeit(imdecode_mask, img_byte, out=out, repeat=args.repeat), "equal"),
+        ]
+        report(f"mask decode, {channels}-channel png {ref.shape}", rows)
+    size = ref.nbytes
+    rows = [
+        ("uint8 HW", 0.0, f"{size / 2**20:.2f} MB"),
+        ("pack_mask", timeit(pack_mask, ref, repeat=args.repeat), f"{pack_mask(ref).nbytes / 2**20:.2f} MB"),
+        ("rle_encode_mask", timeit(rle_encode_mask, ref, repeat=args.repeat), f"{rle_encode_mask(ref).nbytes} B"),
+    ]
+    print("\n== mask packing")
+    for name, seconds, extra in rows:
+        if seconds > 0:
+            RESULTS[f"mask packing / {name}"] = seconds
+        print(f"{name:<32s} {seconds:10.3f} s  {extra}")
+
+
+def bench_import(args):
+    """Start a fresh interpreter per run, like every data loader worker that is spawned."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    rows = []
+    for name, code in [
+        ("python", "pass"),
+        ("numpy, h5py, cv2", "import numpy, h5py, cv2"),
+        ("smc_reader", "import smc_reader"),
+        ("dataset", "import dataset"),
+        ("unfold_data", "import unfold_data"),
+    ]:
+        seconds = timeit(subprocess.run, [sys.executable, "-c", code], cwd=here, check=True, repeat=args.repeat)
+        rows.append((name, seconds, ""))
+    report("import in a new interpreter", rows)
+
+
+def bench_open(args):
+    raw_file, anno_file = smc_files(args)
+    with tempfile.TemporaryDirectory() as index_dir:
+        for path in [raw_file, anno_file]:
+            build_index(path, index_dir)
+        n = 100
+        rows = []
+        for prefix, kwargs in [("no index", dict(use_index=False)), ("with index", dict(index_dir=index_dir))]:
+            for name, fn in [
+                ("open", lambda: SMCReader(anno_file, **kwargs)),
+                ("open + Camera_info", lambda: SMCReader(anno_file, **kwargs).get_Camera_info()),
+                ("open + actor_info", lambda: SMCReader(anno_file, **kwargs).get_actor_info()),
+            ]:
+                seconds = timeit(lambda: [fn() for _ in range(n)], repeat=args.repeat) / n
+                rows.append((f"{prefix}, {name}", seconds, f"{seconds * 1000:.3f} ms/open"))
+        report(f"open {os.path.basename(anno_file)}, index and attrs read on first access", rows)
+        rows = []
+        for name, kwargs in [("no index", dict(use_index=False)), ("with index", dict(index_dir=index_dir))]:
+            # open and list every camera group, as batch loads do
+            def open_and_list():
+                rd = SMCReader(anno_file, **kwargs)
+                for ci in rd.__keys__("Camera")[0]:
+                    rd.__keys__(f"Camera/{ci}/mask")
+
+            rows.append((name, timeit(open_and_list, repeat=args.repeat), ""))
+    report(f"open {os.path.basename(anno_file)} + list frames", rows)
+
+
+def bench_get_img(args):
+    raw_file, _ = smc_files(args)
+    rd = SMCReader(raw_file)
+    n = int(rd.get_Camera_info()["num_frame"])
+
+    def one_by_one():
+        for fi in range(n):
+            rd.get_img("00", "color", fi)
+
+    rows = [("single frames", timeit(one_by_one, repeat=args.repeat), "")]
+    for num_threads in [0, args.num_workers]:
+        seconds = timeit(rd.get_img, "00", "color", num_threads=num_threads, repeat=args.repeat)
+        rows.append((f"batch, {num_threads} threads", seconds, ""))
+    rows = [(name, seconds, f"{n / seconds:.1f} frames/s") for name, seconds, _ in rows]
+    report(f"get_img color, camera 00, {n} frames", rows)
+
+
+def bench_keypoints_flame(args):
+    _, anno_file = smc_files(args)
+    rd = SMCReader(anno_file)
+    n = int(rd.get_Camera_info()["num_frame"])
+    cameras = sorted(rd.__keys__("Keypoints2d")[0], key=int)
+    if cameras:
+
+        def lmk2d_one_by_one():
+            for fi in range(n):
+                rd.get_Keypoints2d(cameras[0], fi)
+
+        rows = [
+            ("per frame get_Keypoints2d", timeit(lmk2d_one_by_one, repeat=args.repeat), ""),
+            ("load_Keypoints2d", timeit(rd.load_Keypoints2d, cameras[0], repeat=args.repeat), ""),
+        ]
+        report(f"keypoints2d, camera {cameras[0]}, {n} frames", rows)
+    if rd.__has__("", "FLAME"):
+
+        def flame_one_by_one():
+            for fi in range(n):
+                {k: v[()] for k, v in rd.get_FLAME(fi).items()}
+
+        rows = [
+            ("per frame get_FLAME", timeit(flame_one_by_one, repeat=args.repeat), ""),
+            ("load_FLAME", timeit(rd.load_FLAME, repeat=args.repeat), ""),
+        ]
+        report(f"FLAME, {n} frames", rows)
+
+
+def bench_unfold(args):
+    raw_file, anno_file = smc_files(args)
+    items = ["image", "masked_image", "mask"]
+    rows = []
+    with tempfile.TemporaryDirectory() as out_dir:
+        for num_workers, write_threads in [(0, 0), (0, 2), (args.num_workers, 0), (args.num_workers, 2)]:
+            pool = Pool(num_workers) if num_workers > 1 else None
+            try:
+                n_done, seconds = unfold_sequence(
+                    raw_file,
+                    anno_file,
+                    out_dir,
+                    items,
+                    pool=pool,
+                    num_frames=args.num_frames,
+                    restart=True,
+                    write_threads=write_threads,
+                )
+            finally:
+                if pool is not None:
+                    pool.close()
+                    pool.join()
+            name = f"{num_workers} workers, " + (f"{write_threads} write threads" if write_threads else "inline writes")
+            rows.append((name, seconds, f"{n_done / seconds:.1f} frames/s"))
+    report("unfold " + " ".join(items), rows)
+
+
+def bench_unfold_roi(args):
+    """Unfold every camera at full frame against the cameras with 2d landmarks cropped around them."""
+    raw_file, anno_file = smc_files(args)
+    items = ["image", "mask", "lmk_2d"]
+    size = (args.width // 2, args.height // 2)
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, kwargs in [
+            ("all cameras, full frames", {}),
+            ("lmk2d cameras, full frames", dict(cameras="lmk2d")),
+            (f"lmk2d cameras, {size[0]}x{size[1]} roi", dict(cameras="lmk2d", roi="lmk2d", roi_size=size)),
+        ]:
+            out_dir = os.path.join(tmp, str(len(rows)))
+            n_done, seconds = unfold_sequence(
+                raw_file, anno_file, out_dir, items, num_frames=args.num_frames, write_threads=0, **kwargs
+            )
+            nbytes = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(out_dir) for f in files)
+            rows.append((name, seconds, f"{n_done} images, {nbytes / 2**20:.1f} MB"))
+    report("unfold " + " ".join(items) + " with camera selection and roi", rows)
+
+
+def bench_flame_export(args):
+    _, anno_file = smc_files(args)
+    rd = SMCReader(anno_file)
+    if not rd.__has__("", "FLAME"):
+        print("\n== flame export skipped, no FLAME in", os.path.basename(anno_file))
+        return
+    n = int(rd.get_Camera_info()["num_frame"])
+    # FLAME has 9976 triangles, the .smc files do not store them
+    faces = np.random.default_rng(0).integers(0, 5023, (9976, 3)).astype(np.int32)
+    with tempfile.TemporaryDirectory() as tmp:
+
+        def per_frame_obj():
+            for fi in range(n):
+                _write_obj_loop(os.path.join(tmp, f"{fi}.obj"), rd.get_FLAME(fi)["verts"][()], faces + 1)
+
+        def size(path):
+            if os.path.isfile(path):
+                return os.path.getsize(path)
+            return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+        rows = [("get_FLAME + obj (before)", timeit(per_frame_obj), f"{size(tmp) / 2**20:.1f} MB")]
+        for name, fmt, out, kwargs in [
+            ("npz float32", "npz", "seq.npz", {}),
+            ("npz float16", "npz", "seq16.npz", dict(float16=True)),
+            (f"ply per frame, {args.num_workers} workers", "ply", "ply", dict(num_workers=args.num_workers)),
+            (f"obj per frame, {args.num_workers} workers", "obj", "obj", dict(num_workers=args.num_workers)),
+        ]:
+            out = os.path.join(tmp, out)
+            seconds = timeit(export_sequence, anno_file, out, faces, fmt, repeat=args.repeat, **kwargs)
+            rows.append((name, seconds, f"{size(out) / 2**20:.1f} MB"))
+    report(f"FLAME meshes, {n} frames", rows)
+
+
+_DATASET = None
+
+
+def _load_sample(index):
+    return _DATASET[index]["color"].shape
+
+
+def bench_dataset(args):
+    """Samples/s of MultiViewDataset, serially and on a process pool as DataLoader workers would load them."""
+    global _DATASET
+    raw_file, anno_file = smc_files(args)
+    data_root = os.path.dirname(os.path.dirname(os.path.dirname(raw_file)))
+    num_views = min(4, args.num_cameras)
+    _DATASET = MultiViewDataset(data_root, [args.actor_id], parts=[args.seq])
+    indices = list(CameraSubsetSampler(_DATASET, num_views))
+
+    def open_per_sample():
+        # the fork-safe way without a pool: readers opened by every sample
+        for index, cameras in indices:
+            raw, anno = SMCReader(raw_file), SMCReader(anno_file)
+            for ci in cameras:
+                raw.get_img(ci, "color", index)
+                anno.get_img(ci, "mask", index)
+                anno.get_Calibration(ci)
+                anno.load_Keypoints2d(ci, [index])
+            raw.close()
+            anno.close()
+
+    rows = [
+        ("SMCReader opened per sample", timeit(open_per_sample, repeat=args.repeat), ""),
+        ("dataset", timeit(lambda: [_DATASET[i] for i in indices], repeat=args.repeat), ""),
+    ]
+    if args.num_workers > 1:
+        with Pool(args.num_workers) as pool:
+            seconds = timeit(pool.map, _load_sample, indices, repeat=args.repeat)
+        rows.append((f"dataset, {args.num_workers} workers", seconds, ""))
+    rows = [(name, seconds, f"{len(indices) / seconds:.1f} samples/s") for name, seconds, _ in rows]
+    report(f"multi-view samples of {num_views} views, color mask calibration lmk_2d", rows)
+
+
+BENCHMARKS = {
+    "write_ply": bench_write_ply,
+    "write_obj": bench_write_obj,
+    "mask_decode": bench_mask_decode,
+    "import": bench_import,
+    "open": bench_open,
+    "get_img": bench_get_img,
+    "keypoints_flame": bench_keypoints_flame,
+    "unfold": bench_unfold,
+    "unfold_roi": bench_unfold_roi,
+    "dataset": bench_dataset,
+    "flame_export": bench_flame_export,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run benchmarks.")
+    parser.add_argument("names", nargs="*", help="any of: " + ", ".join(BENCHMARKS.keys()))
+    parser.add_argument("--n_faces", type=int, default=1000000, help="faces of the synthetic mesh")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of the shorter benchmarks, the best one counts")
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count(), help="threads/processes of parallel runs")
+    parser.add_argument("--data_root", default=None, help="benchmark real files instead of synthetic ones")
+    parser.add_argument("--actor_id", default="0026")
+    parser.add_argument("--seq", default="e_0", help="performance part, e.g. e_0 or s_1")
+    parser.add_argument("--num_cameras", type=int, default=24, help="size of the synthetic files")
+    parser.add_argument("--num_frames", type=int, default=20)
+    parser.add_argument("--height", type=int, default=256)
+    parser.add_argument("--width", type=int, default=306)
+    parser.add_argument("--save_baseline", default=None, help="save the timings of this run to a JSON file")
+    parser.add_argument("--check", default=None, help="fail if a timing regressed against this baseline JSON file")
+    parser.add_argument("--max_slowdown", type=float, default=1.5, help="slowdown ratio --check tolerates")
+    parser.add_argument("--min_seconds", type=float, default=0.01, help="--check compares faster baselines as this")
+    args = parser.parse_args()
+    for name in args.names or BENCHMARKS.keys():
+        assert name in BENCHMARKS, f"Unknown benchmark {name}"
+        BENCHMARKS[name](args)
+    if args.save_baseline is not None:
+        save_baseline(args.save_baseline, args)
+    if args.check is not None and check_baseline(args.check, args, args.max_slowdown, args.min_seconds):
+        sys.exit(1)
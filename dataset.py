@@ -0,0 +1,218 @@
+"""Map-style multi-view dataset of RenderMe360 sequences for training.
+
+A sample is one frame of one sequence seen by a subset of its cameras. MultiViewDataset implements __len__ and
+__getitem__, and CameraSubsetSampler __iter__, __len__ and set_epoch, so both plug into torch.utils.data.DataLoader
+without this module depending on torch:
+
+    dataset = MultiViewDataset("/path/to/RenderMe360", ["0026"], items=["color", "mask", "calibration"], scale=4)
+    sampler = CameraSubsetSampler(dataset, num_views=4)
+    loader = DataLoader(dataset, batch_size=8, sampler=sampler, num_workers=8, persistent_workers=True)
+
+Every worker opens its own SMCReaders on first use and keeps at most max_open of them open (see ReaderPool).
+"""
+
+import bisect
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from smc_reader import SMCReader
+from utils import find_sequences
+
+ITEMS = ["color", "mask", "calibration", "lmk_2d"]
+NUM_LMK2D = 106
+
+
+class ReaderPool:
+    """SMCReaders of the current process keyed by file path, opened on first use and at most max_open at a time.
+
+    h5py handles cannot be shared across forked processes, so after a fork (e.g. in a DataLoader worker) the
+    readers inherited from the parent are dropped and the worker opens its own. When the pool is full, the least
+    recently used reader is closed.
+    """
+
+    def __init__(self, max_open=16, **reader_kwargs):
+        assert max_open > 0, f"Invalid max_open {max_open}"
+        self.max_open = max_open
+        self.reader_kwargs = reader_kwargs
+        self.readers = OrderedDict()
+        self.pid = os.getpid()
+        self.opened = 0
+
+    def get(self, file_path):
+        if self.pid != os.getpid():
+            self.readers = OrderedDict()
+            self.pid = os.getpid()
+        rd = self.readers.get(file_path)
+        if rd is not None:
+            self.readers.move_to_end(file_path)
+            return rd
+        rd = SMCReader(file_path, **self.reader_kwargs)
+        self.opened += 1
+        self.readers[file_path] = rd
+        while len(self.readers) > self.max_open:
+            self.readers.popitem(last=False)[1].close()
+        return rd
+
+    def clear(self):
+        """Close every reader of the current process."""
+        if self.pid == os.getpid():
+            for rd in self.readers.values():
+                rd.close()
+        self.readers = OrderedDict()
+
+    def __getstate__(self):
+        # open handles are never pickled, e.g. to spawned workers
+        state = dict(self.__dict__)
+        state["readers"] = OrderedDict()
+        return state
+
+
+class MultiViewDataset:
+    def __init__(
+        self,
+        data_root,
+        actor_ids,
+        parts=None,
+        items=("color", "mask", "calibration", "lmk_2d"),
+        cameras=None,
+        scale=1,
+        frame_stride=1,
+        max_open=16,
+        num_threads=0,
+        cache_bytes=0,
+    ):
+        """Index the frames of every sequence of actor_ids under data_root (laid out as raw/ and anno/).
+
+        Args:
+            data_root (str): root of the dataset, with raw/<actor_id>/*_raw.smc and anno/<actor_id>/*_anno.smc.
+            actor_ids (list of str): actors, e.g. ['0026'].
+            parts (list of str, optional): performance parts to keep, e.g. ['e_0', 's_1'], all if None.
+            items (list of str): any of ITEMS, the arrays returned for every view.
+            cameras (list of str, optional): cameras to sample from, all calibrated cameras if None.
+            scale (int): decode images at 1/scale resolution, intrinsics and 2d landmarks are scaled to match.
+            frame_stride (int): keep every frame_stride-th frame.
+            max_open (int): readers kept open per process, 2 per sequence (raw and anno).
+            num_threads (int): threads decoding the views of a sample, 0 or 1 decodes serially.
+            cache_bytes (int): budget of the decoded image cache of every reader, 0 disables it.
+        """
+        for item in items:
+            assert item in ITEMS, f"Invalid item {item}"
+        assert frame_stride >= 1, f"Invalid frame_stride {frame_stride}"
+        self.items = list(items)
+        self.scale = scale
+        self.pool = ReaderPool(max_open, num_threads=num_threads, cache_bytes=cache_bytes)
+        # (actor_id, part, raw_file, anno_file, cameras, frame ids) of every sequence
+        self.sequences = []
+        self.starts = []
+        n = 0
+        for actor_id in actor_ids:
+            for part in find_sequences(data_root, actor_id):
+                if parts is not None and part not in parts:
+                    continue
+                raw_file, anno_file = [
+                    os.path.join(data_root, kind, actor_id, f"{actor_id}_{part}_{kind}.smc") for kind in ["raw", "anno"]
+                ]
+                seq_cameras = [str(ci) for ci in self.pool.get(anno_file).get_Calibration_array()["cameras"]]
+                if cameras is not None:
+                    missing = set(cameras) - set(seq_cameras)
+                    assert not missing, f"Cameras {sorted(missing)} not in {actor_id}_{part}"
+                    seq_cameras = list(cameras)
+                num_frame = int(self.pool.get(raw_file).get_Camera_info()["num_frame"])
+                frames = list(range(0, num_frame, frame_stride))
+                self.sequences.append((actor_id, part, raw_file, anno_file, seq_cameras, frames))
+                self.starts.append(n)
+                n += len(frames)
+        self.num_samples = n
+        # nothing stays open when DataLoader forks its workers
+        self.pool.clear()
+
+    def __len__(self):
+        return self.num_samples
+
+    def __locate__(self, index):
+        """(sequence, frame id) of a sample id."""
+        assert 0 <= index < self.num_samples, f"Invalid index {index}"
+        s = bisect.bisect_right(self.starts, index) - 1
+        return self.sequences[s], self.sequences[s][5][index - self.starts[s]]
+
+    def get_cameras(self, index):
+        """Cameras a sample can be seen from."""
+        return self.__locate__(index)[0][4]
+
+    def __getitem__(self, index):
+        """Get a sample.
+
+        Args:
+            index (int or (int, list of str)): sample id, or (sample id, Camera_ids) to select the views.
+        Returns:
+            dict:
+                'actor_id', 'performance_part' (str), 'frame_id' (int), 'cameras' (list of V Camera_id)
+                'color'                 : (V, H, W, 3) bgr uint8
+                'mask'                  : (V, H, W) uint8
+                'D', 'K', 'RT'          : (V, 5), (V, 3, 3), (V, 4, 4), from 'calibration'
+                'lmk_2d', 'lmk_2d_valid': (V, 106, 2) float32, (V,) bool, zero where a view has no landmarks
+        """
+        cameras = None
+        if isinstance(index, (tuple, list)):
+            index, cameras = index
+        (actor_id, part, raw_file, anno_file, seq_cameras, _), f_id = self.__locate__(int(index))
+        cameras = list(seq_cameras if cameras is None else cameras)
+        sample = dict(actor_id=actor_id, performance_part=part, frame_id=f_id, cameras=cameras)
+        if "color" in self.items:
+            sample["color"] = self.pool.get(raw_file).get_views(cameras, "color", f_id, scale=self.scale)
+        anno = self.pool.get(anno_file) if set(self.items) - {"color"} else None
+        if "mask" in self.items:
+            sample["mask"] = anno.get_views(cameras, "mask", f_id, scale=self.scale)
+        if "calibration" in self.items:
+            calib = anno.get_Calibration_all()
+            for mt in ["D", "K", "RT"]:
+                sample[mt] = np.stack([calib[ci][mt] for ci in cameras], axis=0)
+            if self.scale != 1:
+                sample["K"][:, :2] /= self.scale
+        if "lmk_2d" in self.items:
+            lmk2d = np.zeros((len(cameras), NUM_LMK2D, 2), dtype=np.float32)
+            valid = np.zeros(len(cameras), dtype=bool)
+            for v, ci in enumerate(cameras):
+                lmk, ok = anno.load_Keypoints2d(ci, [f_id])
+                if lmk is not None and ok[0]:
+                    lmk2d[v] = lmk[0] / self.scale
+                    valid[v] = True
+            sample["lmk_2d"] = lmk2d
+            sample["lmk_2d_valid"] = valid
+        return sample
+
+
+class CameraSubsetSampler:
+    def __init__(self, dataset, num_views, shuffle=True, seed=0):
+        """Yield every sample of a MultiViewDataset once per epoch as (sample id, Camera_ids), with num_views
+        cameras drawn without replacement from the cameras of its sequence.
+
+        Args:
+            dataset (MultiViewDataset): dataset to sample.
+            num_views (int): views of every sample, at most the cameras of a sequence.
+            shuffle (bool): visit samples in random order, else in sequence and frame order.
+            seed (int): seed of the draws, combined with the epoch set by set_epoch().
+        """
+        for seq in dataset.sequences:
+            assert 0 < num_views <= len(seq[4]), f"Invalid num_views {num_views} for {seq[0]}_{seq[1]}"
+        self.dataset = dataset
+        self.num_views = num_views
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __iter__(self):
+        rng = np.random.default_rng((self.seed, self.epoch))
+        order = rng.permutation(len(self.dataset)) if self.shuffle else range(len(self.dataset))
+        for index in order:
+            cameras = self.dataset.get_cameras(index)
+            picked = np.sort(rng.choice(len(cameras), self.num_views, replace=False))
+            yield int(index), [cameras[i] for i in picked]
@@ -0,0 +1,174 @@
+"""Export the FLAME meshes of RenderMe360 sequences.
+
+The anno .smc files store the FLAME vertices of every frame ('verts', 5023 x 3) but not the topology, which is the
+same for every frame and comes with the FLAME model, e.g. the faces of its head_template.obj. The vertices of a
+sequence are loaded with one bulk read (SMCReader.load_FLAME) and saved as either
+    npz : one file holding the faces once and the vertices of all frames, (N, 5023, 3) float32 or float16 (relative
+          to an origin stored with them)
+    ply : a binary ply per frame
+    obj : an obj per frame
+
+Usage:
+    python flame_export.py --data_root ROOT --actor_id 0026 --faces head_template.obj [--format npz] [--float16]
+"""
+
+import argparse
+import os
+from functools import partial
+from multiprocessing import Pool
+
+import numpy as np
+
+from smc_reader import SMCReader
+from utils import directory, find_sequences, write_obj, write_ply
+
+FORMATS = ["npz", "ply", "obj"]
+
+
+def load_faces(path):
+    """Triangles (F, 3) int32, 0-based, from a .npy array or the 'f' lines of an .obj (e.g. the FLAME template)."""
+    if path.endswith(".npy"):
+        faces = np.load(path)
+    else:
+        with open(path) as fp:
+            faces = [[int(v.split("/")[0]) - 1 for v in line.split()[1:4]] for line in fp if line.startswith("f ")]
+    return np.asarray(faces, dtype=np.int32).reshape(-1, 3)
+
+
+def save_sequence(path, verts, faces=None, frame_ids=None, float16=False):
+    """Save the vertices of N frames sharing one topology as one uncompressed .npz of
+    'verts' (N, V, 3) float32 or float16, 'origin' (3,) float64 they are relative to, 'faces' (F, 3) int32
+    (empty if unknown) and 'frame_ids' (N,).
+
+    float16 halves the file. FLAME vertices are in world coordinates, where float16 rounds to ~0.12 mm at 0.3 m
+    and ~0.5 mm at 1 m from the world origin, so they are stored relative to the center of their bounding box over
+    the sequence: within 0.25 m of it, the rounding error stays below 0.06 mm. float32 vertices are stored as is,
+    with a zero origin.
+    """
+    faces = np.zeros((0, 3), dtype=np.int32) if faces is None else np.asarray(faces, dtype=np.int32)
+    frame_ids = np.arange(len(verts)) if frame_ids is None else np.asarray(frame_ids)
+    verts = np.asarray(verts)
+    origin = np.zeros(3)
+    if float16 and verts.size:
+        flat = verts.reshape(-1, 3)
+        origin = (flat.min(axis=0).astype(np.float64) + flat.max(axis=0)) / 2
+        verts = verts - origin
+    np.savez(
+        path,
+        verts=verts.astype(np.float16 if float16 else np.float32, copy=False),
+        origin=origin,
+        faces=faces,
+        frame_ids=frame_ids,
+    )
+
+
+def load_sequence(path):
+    """Load a sequence saved by save_sequence, with the vertices as float32 in world coordinates."""
+    with np.load(path) as data:
+        verts = data["verts"].astype(np.float32, copy=False)
+        # files saved before the origin was stored hold world coordinates
+        if "origin" in data and data["origin"].any():
+            verts = (verts + data["origin"]).astype(np.float32)
+        return dict(verts=verts, faces=data["faces"], frame_ids=data["frame_ids"])
+
+
+def save_mesh(path_verts, faces, fmt):
+    path, verts = path_verts
+    if fmt == "ply":
+        write_ply(dict(vertex=verts, vertex_indices=faces), path, binary=True)
+    else:
+        # obj indices are 1-based
+        write_obj(path, verts, faces + 1 if len(faces) else None, log=False)
+    return path
+
+
+def save_meshes(out_dir, verts, faces=None, frame_ids=None, fmt="ply", num_workers=os.cpu_count()):
+    """Save every frame as its own mesh, <out_dir>/<frame_id:05>.<fmt>, on num_workers processes.
+
+    Returns:
+        paths of the meshes
+    """
+    assert fmt in ["ply", "obj"], f"Invalid mesh format {fmt}"
+    directory(out_dir)
+    faces = np.zeros((0, 3), dtype=np.int32) if faces is None else np.asarray(faces, dtype=np.int32)
+    frame_ids = range(len(verts)) if frame_ids is None else frame_ids
+    jobs = [(os.path.join(out_dir, "{:05}.{}".format(int(fi), fmt)), v) for fi, v in zip(frame_ids, verts)]
+    save = partial(save_mesh, faces=faces, fmt=fmt)
+    if num_workers is None or num_workers <= 1:
+        return [save(job) for job in jobs]
+    with Pool(num_workers) as pool:
+        return pool.map(save, jobs, chunksize=max(len(jobs) // (4 * num_workers), 1))
+
+
+def export_sequence(
+    anno_file, out_path, faces=None, fmt="npz", float16=False, num_frames=None, num_workers=os.cpu_count()
+):
+    """Export the FLAME meshes of an anno .smc file.
+
+    Args:
+        out_path (str): the .npz file for 'npz', the directory of the per-frame meshes for 'ply' and 'obj'.
+        faces (np.ndarray, optional): FLAME triangles (F, 3), 0-based, see load_faces(). Vertices only if None.
+        fmt (str): one of FORMATS.
+        float16 (bool): store the vertices of an npz as float16.
+        num_frames (int or None): only export the first num_frames frames, all frames if None.
+        num_workers (int): processes writing per-frame meshes.
+    Returns:
+        number of exported frames, None if the file has no FLAME
+    """
+    assert fmt in FORMATS, f"Invalid format {fmt}"
+    assert not float16 or fmt == "npz", "float16 is only supported by the npz format"
+    rd = SMCReader(anno_file)
+    try:
+        Frame_id = None
+        if num_frames is not None:
+            Frame_id = list(range(min(num_frames, int(rd.get_Camera_info()["num_frame"]))))
+        flame, valid = rd.load_FLAME(Frame_id, keys=["verts"])
+    finally:
+        # the vertices are loaded, the writes below do not need the file
+        rd.close()
+    if flame is None or "verts" not in flame:
+        return None
+    # frames without FLAME are skipped, not saved as zeros
+    frame_ids = np.flatnonzero(valid)
+    verts = flame["verts"][valid]
+    if fmt == "npz":
+        save_sequence(out_path, verts, faces, frame_ids, float16)
+    else:
+        save_meshes(out_path, verts, faces, frame_ids, fmt, num_workers)
+    return len(frame_ids)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export the FLAME meshes of RenderMe360 sequences.")
+    parser.add_argument("--data_root", required=True, help="root path of your RenderMe360 data")
+    parser.add_argument("--actor_id", required=True, help="the actor index which you want to export")
+    parser.add_argument("--out_dir", default=None, help="defaults to <data_root>/flame/<actor_id>")
+    parser.add_argument("--faces", default=None, help="FLAME topology, .obj template or (F, 3) .npy")
+    parser.add_argument("--format", default="npz", choices=FORMATS)
+    parser.add_argument("--float16", action="store_true", help="store npz vertices as float16")
+    parser.add_argument("--skip_seq", nargs="*", default=[], help="skip some sequences")
+    parser.add_argument("--num_frames", type=int, default=None, help="only export the first N frames")
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count())
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    out_dir = args.out_dir or os.path.join(args.data_root, "flame", args.actor_id)
+    directory(out_dir)
+    faces = None if args.faces is None else load_faces(args.faces)
+    for seq in find_sequences(args.data_root, args.actor_id, args.skip_seq):
+        # FLAME is only fitted on the expression parts
+        if not seq.startswith("e"):
+            continue
+        print("Processing seq '{}' ... ".format(seq))
+        n = export_sequence(
+            os.path.join(args.data_root, "anno", args.actor_id, f"{args.actor_id}_{seq}_anno.smc"),
+            os.path.join(out_dir, seq + (".npz" if args.format == "npz" else "")),
+            faces=faces,
+            fmt=args.format,
+            float16=args.float16,
+            num_frames=args.num_frames,
+            num_workers=args.num_workers,
+        )
+        print("{} frames exported".format(n))
@@ -0,0 +1,132 @@
+"""Opt-in per-stage timing of the unfold hot paths.
+
+SMCReader and unfold_data.save_general_data time their stages (read, decode, compose, encode, write, mkdir) with
+the process-wide PROFILER, which does nothing until enabled. Stats are kept per (stage, item) as count, seconds and
+bytes, and can be popped in worker processes and merged in the parent.
+
+    PROFILER.enable()
+    with PROFILER.stage("decode", "color"):
+        img = cv2.imdecode(...)
+    print(format_report(PROFILER.pop(), wall_seconds))
+"""
+
+import json
+import threading
+import time
+
+STAGES = ["read", "decode", "compose", "encode", "write", "mkdir"]
+
+
+class _Stage:
+    """Times a with block. Set nbytes inside the block when the size is only known there."""
+
+    __slots__ = ("profiler", "name", "item", "nbytes", "st")
+
+    def __init__(self, profiler, name, item, nbytes):
+        self.profiler = profiler
+        self.name = name
+        self.item = item
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        self.st = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, self.item, time.perf_counter() - self.st, self.nbytes)
+
+
+class _NullStage:
+    nbytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Profiler:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        # (stage, item) -> [count, seconds, bytes]
+        self.stats = dict()
+        # decode threads record concurrently
+        self.lock = threading.Lock()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def stage(self, name, item=None, nbytes=0):
+        """Context manager timing one operation of a stage, free when disabled."""
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name, item, nbytes)
+
+    def add(self, name, item, seconds, nbytes=0, count=1):
+        with self.lock:
+            row = self.stats.setdefault((name, item), [0, 0.0, 0])
+            row[0] += count
+            row[1] += seconds
+            row[2] += int(nbytes)
+
+    def pop(self):
+        """Return the stats recorded so far as json-able records and reset them."""
+        with self.lock:
+            records = [
+                dict(stage=name, item=item, count=count, seconds=seconds, bytes=nbytes)
+                for (name, item), (count, seconds, nbytes) in self.stats.items()
+            ]
+            self.stats = dict()
+        return records
+
+    def merge(self, records):
+        """Add records popped from another profiler, e.g. of a worker process."""
+        for r in records:
+            self.add(r["stage"], r["item"], r["seconds"], r["bytes"], r["count"])
+
+
+PROFILER = Profiler()
+
+
+def _sort_key(record):
+    stage = STAGES.index(record["stage"]) if record["stage"] in STAGES else len(STAGES)
+    return stage, str(record["item"])
+
+
+def format_report(records, wall_seconds=None):
+    """Table of records, one row per (stage, item). Seconds are summed over threads and workers, so stages can add
+    up to more than the wall time; their shares still show the bottleneck."""
+    records = sorted(records, key=_sort_key)
+    total = sum(r["seconds"] for r in records)
+    lines = [
+        "{:<8s} {:<14s} {:>9s} {:>10s} {:>9s} {:>6s} {:>10s} {:>9s}".format(
+            "stage", "item", "count", "seconds", "ms/op", "share", "MB", "MB/s"
+        )
+    ]
+    for r in records:
+        seconds = max(r["seconds"], 1e-12)
+        lines.append(
+            "{:<8s} {:<14s} {:9d} {:10.2f} {:9.3f} {:5.1f}% {:10.1f} {:9.1f}".format(
+                r["stage"],
+                str(r["item"]),
+                r["count"],
+                r["seconds"],
+                r["seconds"] * 1000 / max(r["count"], 1),
+                100 * r["seconds"] / max(total, 1e-12),
+                r["bytes"] / 2**20,
+                r["bytes"] / 2**20 / seconds,
+            )
+        )
+    if wall_seconds is not None:
+        lines.append("{:.2f} stage seconds over {:.2f} wall seconds".format(total, wall_seconds))
+    return "\n".join(lines)
+
+
+def save_report(path, records, **extra):
+    """Save records and extra fields (e.g. wall_seconds, frames) as json."""
+    with open(path, "w") as fp:
+        json.dump(dict(extra, stages=sorted(records, key=_sort_key)), fp, indent=1)
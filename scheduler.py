@@ -0,0 +1,294 @@
+"""Dataset-wide unfold scheduler.
+
+`plan` lists every (actor, sequence) under DATA_ROOT and splits them into shards of balanced .smc size, saved in a
+queue directory on a shared filesystem. Any number of `work` processes, on any number of nodes, then claim shards
+through lock files and unfold them with unfold_data.unfold_sequence. `status` aggregates their progress and
+throughput.
+
+Usage:
+    python scheduler.py plan   --data_root ROOT --queue_dir DIR --num_shards 64 [--items image mask]
+    python scheduler.py work   --queue_dir DIR [--num_workers 16]
+    python scheduler.py status --queue_dir DIR
+"""
+
+import argparse
+import heapq
+import json
+import os
+import socket
+import threading
+import time
+from multiprocessing import Pool
+
+from unfold_data import UNFOLD_LIST, add_unfold_arguments, parse_roi, unfold_kwargs, unfold_sequence
+from utils import ITEM2FORLDER, directory, find_sequences
+
+
+def list_jobs(data_root):
+    """Every sequence of every actor under data_root with both .smc files, and their total size in bytes."""
+    jobs = []
+    for actor_id in sorted(os.listdir(os.path.join(data_root, "anno"))):
+        for seq in find_sequences(data_root, actor_id):
+            raw_file = os.path.join(data_root, "raw", actor_id, f"{actor_id}_{seq}_raw.smc")
+            anno_file = os.path.join(data_root, "anno", actor_id, f"{actor_id}_{seq}_anno.smc")
+            if not os.path.exists(raw_file):
+                print(f"skip {actor_id}/{seq}: no raw file.")
+                continue
+            size = os.path.getsize(raw_file) + os.path.getsize(anno_file)
+            jobs.append(dict(actor_id=actor_id, seq=seq, raw_file=raw_file, anno_file=anno_file, size=size))
+    return jobs
+
+
+def balance(jobs, num_shards):
+    """Split jobs into num_shards lists of close total size: largest job first, into the lightest shard."""
+    heap = [(0, i, []) for i in range(num_shards)]
+    for job in sorted(jobs, key=lambda job: -job["size"]):
+        size, i, shard = heapq.heappop(heap)
+        shard.append(job)
+        heapq.heappush(heap, (size + job["size"], i, shard))
+    return [shard for _, _, shard in sorted(heap, key=lambda x: x[1]) if shard]
+
+
+class ShardQueue:
+    """Shards of a plan shared by independent workers through files in queue_dir:
+
+    plan.json              : data_root, items and the list of shards
+    shard_XXXXX.lock       : created exclusively by the worker that claimed the shard, touched as heartbeat.
+                             It holds the host, pid and claim time of that worker, which owns the shard as long
+                             as the lock is not taken over.
+    shard_XXXXX.done       : written by that worker when the shard is finished, with its stats
+    """
+
+    def __init__(self, queue_dir):
+        self.queue_dir = queue_dir
+        # lock info of the shards claimed by this process
+        self.claims = dict()
+        with open(os.path.join(queue_dir, "plan.json"), "r") as fp:
+            self.plan = json.load(fp)
+
+    @staticmethod
+    def create(queue_dir, data_root, items, num_shards):
+        directory(queue_dir)
+        shards = balance(list_jobs(data_root), num_shards)
+        plan = dict(data_root=data_root, items=items, shards=shards)
+        with open(os.path.join(queue_dir, "plan.json.tmp"), "w") as fp:
+            json.dump(plan, fp, indent=1)
+        os.replace(os.path.join(queue_dir, "plan.json.tmp"), os.path.join(queue_dir, "plan.json"))
+        return ShardQueue(queue_dir)
+
+    def _path(self, shard_id, ext):
+        return os.path.join(self.queue_dir, "shard_{:05}{}".format(shard_id, ext))
+
+    def claim(self, lock_timeout):
+        """Claim a pending shard. Locks whose heartbeat is older than lock_timeout seconds are taken over.
+
+        Returns:
+            shard id, or None if every shard is done or claimed.
+        """
+        me = dict(host=socket.gethostname(), pid=os.getpid(), time=time.time())
+        for shard_id in range(len(self.plan["shards"])):
+            if os.path.exists(self._path(shard_id, ".done")):
+                continue
+            lock = self._path(shard_id, ".lock")
+            try:
+                if time.time() - os.path.getmtime(lock) > lock_timeout:
+                    # rename is atomic, so only one worker takes a stale lock over. Another worker may have
+                    # replaced it with a fresh lock since the check: give that one back.
+                    stale = lock + ".stale.{}.{}".format(me["host"], me["pid"])
+                    os.rename(lock, stale)
+                    if time.time() - os.path.getmtime(stale) <= lock_timeout:
+                        os.rename(stale, lock)
+                        continue
+                    os.remove(stale)
+            except OSError:
+                pass
+            try:
+                fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                continue
+            with os.fdopen(fd, "w") as fp:
+                json.dump(me, fp)
+            self.claims[shard_id] = me
+            return shard_id
+        return None
+
+    def owns(self, shard_id):
+        """Whether the lock of a shard is still the one this process created when claiming it."""
+        try:
+            with open(self._path(shard_id, ".lock"), "r") as fp:
+                return json.load(fp) == self.claims.get(shard_id)
+        except (OSError, ValueError):
+            return False
+
+    def heartbeat(self, shard_id):
+        """Touch the lock of a shard this process owns.
+
+        Returns:
+            False if the lock was taken over by another worker, which then owns the shard.
+        """
+        if not self.owns(shard_id):
+            return False
+        os.utime(self._path(shard_id, ".lock"))
+        return True
+
+    def finish(self, shard_id, stats):
+        """Mark a shard this process owns as done.
+
+        Returns:
+            False, without marking it, if the lock was taken over by another worker.
+        """
+        if not self.owns(shard_id):
+            return False
+        with open(self._path(shard_id, ".done.tmp"), "w") as fp:
+            json.dump(stats, fp)
+        os.replace(self._path(shard_id, ".done.tmp"), self._path(shard_id, ".done"))
+        return True
+
+    def status(self):
+        """Per shard: (state in 'done'/'running'/'pending', stats of done shards or lock info of running ones)"""
+        rs = []
+        for shard_id in range(len(self.plan["shards"])):
+            info = None
+            if os.path.exists(self._path(shard_id, ".done")):
+                state = "done"
+                with open(self._path(shard_id, ".done"), "r") as fp:
+                    info = json.load(fp)
+            elif os.path.exists(self._path(shard_id, ".lock")):
+                state = "running"
+                try:
+                    with open(self._path(shard_id, ".lock"), "r") as fp:
+                        info = json.load(fp)
+                except (OSError, ValueError):
+                    pass
+            else:
+                state = "pending"
+            rs.append((state, info))
+        return rs
+
+
+class Heartbeat(threading.Thread):
+    """Touch the lock of a shard every interval seconds while it is unfolded, until stopped or the lock is lost."""
+
+    def __init__(self, queue, shard_id, interval):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.shard_id = shard_id
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.lost = False
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            if not self.queue.heartbeat(self.shard_id):
+                self.lost = True
+                return
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def work(queue_dir, num_workers, lock_timeout, **unfold_kwargs):
+    """Claim and unfold shards until none is left.
+
+    The lock of the running shard is touched from a background thread, so a long sequence does not let it go
+    stale. A shard whose lock was taken over anyway (e.g. the worker stalled past lock_timeout) is abandoned
+    before its next sequence and left to the new owner.
+    """
+    queue = ShardQueue(queue_dir)
+    data_root, items = queue.plan["data_root"], queue.plan["items"]
+    pool = Pool(num_workers) if num_workers > 1 else None
+    try:
+        while True:
+            shard_id = queue.claim(lock_timeout)
+            if shard_id is None:
+                break
+            st = time.time()
+            stats = dict(host=socket.gethostname(), pid=os.getpid(), start=st, frames=0, bytes=0)
+            beat = Heartbeat(queue, shard_id, lock_timeout / 10)
+            beat.start()
+            finished = False
+            try:
+                for job in queue.plan["shards"][shard_id]:
+                    if beat.lost or not queue.owns(shard_id):
+                        break
+                    print("Shard {}: processing {}/{} ... ".format(shard_id, job["actor_id"], job["seq"]))
+                    seq_out_dir = os.path.join(data_root, "preprocess", job["actor_id"], job["seq"])
+                    n_done, _ = unfold_sequence(
+                        job["raw_file"], job["anno_file"], seq_out_dir, items, pool=pool, **unfold_kwargs
+                    )
+                    stats["frames"] += int(n_done)
+                    stats["bytes"] += job["size"]
+                else:
+                    stats["end"] = time.time()
+                    finished = queue.finish(shard_id, stats)
+            finally:
+                beat.stop()
+            if not finished:
+                print("Shard {}: lock taken over by another worker, abandoned.".format(shard_id))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def print_status(queue_dir):
+    queue = ShardQueue(queue_dir)
+    status = queue.status()
+    sizes = [sum(job["size"] for job in shard) for shard in queue.plan["shards"]]
+    for state in ["done", "running", "pending"]:
+        ids = [i for i, (s, _) in enumerate(status) if s == state]
+        print("{:<8s} {:6d} shards {:10.1f} GB".format(state, len(ids), sum(sizes[i] for i in ids) / 2**30))
+
+    done = [info for s, info in status if s == "done"]
+    if len(done) == 0:
+        return
+    hosts = dict()
+    for info in done:
+        host = hosts.setdefault(info["host"], dict(shards=0, frames=0, bytes=0, seconds=0.0))
+        host["shards"] += 1
+        host["frames"] += info["frames"]
+        host["bytes"] += info["bytes"]
+        host["seconds"] += info["end"] - info["start"]
+    print("\n{:<24s} {:>6s} {:>10s} {:>10s} {:>10s}".format("host", "shards", "frames/s", "MB/s", "GB"))
+    for name, host in sorted(hosts.items()):
+        seconds = max(host["seconds"], 1e-9)
+        print(
+            "{:<24s} {:6d} {:10.1f} {:10.1f} {:10.1f}".format(
+                name, host["shards"], host["frames"] / seconds, host["bytes"] / seconds / 2**20, host["bytes"] / 2**30
+            )
+        )
+    wall = max(info["end"] for info in done) - min(info["start"] for info in done)
+    total = sum(info["bytes"] for info in done)
+    print("\naggregate: {:.1f} MB/s over {:.0f} sec".format(total / max(wall, 1e-9) / 2**20, wall))
+    pending = sum(sizes) - total
+    if total > 0 and pending > 0:
+        print("remaining: ~{:.1f} hours at this rate".format(pending / (total / max(wall, 1e-9)) / 3600))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Schedule RenderMe360 unfolds across actors, workers and nodes.")
+    parser.add_argument("command", choices=["plan", "work", "status"])
+    parser.add_argument("--queue_dir", required=True, help="directory on a filesystem shared by all workers")
+    parser.add_argument("--data_root", help="root path of your RenderMe360 data (plan)")
+    parser.add_argument("--items", nargs="+", default=UNFOLD_LIST, choices=list(ITEM2FORLDER.keys()))
+    parser.add_argument("--num_shards", type=int, default=64, help="(plan)")
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count(), help="processes of this worker (work)")
+    parser.add_argument("--lock_timeout", type=float, default=6 * 3600, help="take over older locks, in sec (work)")
+    # the options of unfold_data.py
+    add_unfold_arguments(parser.add_argument_group("unfold options (work)"))
+    args = parser.parse_args()
+    args.roi = parse_roi(args.roi)
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "plan":
+        assert args.data_root is not None, "plan needs --data_root"
+        queue = ShardQueue.create(args.queue_dir, args.data_root, args.items, args.num_shards)
+        print("{} shards planned.".format(len(queue.plan["shards"])))
+    elif args.command == "work":
+        work(args.queue_dir, args.num_workers, args.lock_timeout, **unfold_kwargs(args))
+    else:
+        print_status(args.queue_dir)
@@ -0,0 +1,148 @@
+"""Persistent metadata index of .smc files.
+
+Walking the HDF5 group tree of an .smc file (keys of 60 cameras x N frames, membership tests, attrs) is slow on
+network filesystems. The index records it once in a json sidecar, keyed by file path + size + mtime, and SMCReader
+loads it instead of probing HDF5.
+
+Usage:
+    python smc_index.py /path/to/RenderMe360 [--index_dir DIR] [--num_workers N] [--rebuild]
+"""
+
+import argparse
+import json
+import os
+from multiprocessing import Pool
+
+import h5py
+import numpy as np
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".index.json"
+
+# groups whose attrs are recorded
+ATTR_GROUPS = ["", "Camera", "Keypoints2d", "Keypoints3d", "FLAME"]
+
+
+def index_path(file_path, index_dir=None):
+    """Sidecar path of the index of file_path: next to it, or in index_dir if given."""
+    if index_dir is None:
+        return file_path + INDEX_SUFFIX
+    return os.path.join(index_dir, os.path.basename(file_path) + INDEX_SUFFIX)
+
+
+def file_key(file_path):
+    st = os.stat(file_path)
+    return dict(path=os.path.abspath(file_path), size=st.st_size, mtime_ns=st.st_mtime_ns)
+
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, bytes):
+        return value.decode()
+    return value
+
+
+def _is_encoded_image(path):
+    """Whether path is an encoded image dataset: Camera/<cid>/<color|mask>/<fid>, UV_texture/<fid> or ScanMask/<cid>"""
+    parts = path.split("/")
+    if parts[0] == "Camera":
+        return len(parts) == 4 and parts[2] in ["color", "mask"]
+    return len(parts) == 2 and parts[0] in ["UV_texture", "ScanMask"]
+
+
+def build_index(file_path, index_dir=None):
+    """Walk an .smc file and save its index.
+
+    Returns:
+        dict:
+            "version"  : INDEX_VERSION
+            "file"     : file_key() of the indexed file
+            "attrs"    : group path -> attrs, for ATTR_GROUPS ('' is the root)
+            "keys"     : group path -> list of its keys, for every group
+            "datasets" : encoded image dataset path -> [offset, size] in the file,
+                         offset is None unless the dataset is a contiguous (not chunked nor filtered) uint8 blob
+    """
+    index = dict(version=INDEX_VERSION, file=file_key(file_path), attrs=dict(), keys=dict(), datasets=dict())
+    with h5py.File(file_path, "r") as smc:
+
+        def visit(path, obj):
+            if isinstance(obj, h5py.Group):
+                index["keys"][path] = list(obj.keys())
+            elif _is_encoded_image(path):
+                raw = obj.chunks is None and obj.dtype == np.uint8 and obj.ndim == 1
+                offset = obj.id.get_offset() if raw else None
+                index["datasets"][path] = [offset, obj.id.get_storage_size()]
+
+        index["keys"][""] = list(smc.keys())
+        smc.visititems(visit)
+        for path in ATTR_GROUPS:
+            if path == "" or path in smc:
+                attrs = smc[path].attrs if path else smc.attrs
+                index["attrs"][path] = {k: _to_json(v) for k, v in attrs.items()}
+
+    out_path = index_path(file_path, index_dir)
+    try:
+        if index_dir is not None:
+            os.makedirs(index_dir, exist_ok=True)
+        # write then rename, so concurrent readers never see a partial index
+        with open(out_path + ".tmp", "w") as fp:
+            json.dump(index, fp)
+        os.replace(out_path + ".tmp", out_path)
+    except OSError as e:
+        print(f"cannot save index of {file_path}: {e}")
+    return index
+
+
+def load_index(file_path, index_dir=None):
+    """Load the index of file_path, or None if it is missing or stale (the file changed since it was built)."""
+    path = index_path(file_path, index_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r") as fp:
+            index = json.load(fp)
+    except (OSError, ValueError):
+        return None
+    if index.get("version") != INDEX_VERSION or index.get("file") != file_key(file_path):
+        return None
+    return index
+
+
+def _build_if_stale(args):
+    file_path, index_dir, rebuild = args
+    if not rebuild and load_index(file_path, index_dir) is not None:
+        return file_path, False
+    build_index(file_path, index_dir)
+    return file_path, True
+
+
+def build_index_tree(data_root, index_dir=None, num_workers=1, rebuild=False):
+    """Build the missing or stale indexes of every .smc file under data_root, ahead of time.
+
+    Returns:
+        list of the file paths whose index was (re)built.
+    """
+    files = []
+    for root, _, names in os.walk(data_root):
+        files += [os.path.join(root, name) for name in sorted(names) if name.endswith(".smc")]
+    tasks = [(file_path, index_dir, rebuild) for file_path in sorted(files)]
+    if num_workers > 1:
+        with Pool(num_workers) as pool:
+            results = pool.map(_build_if_stale, tasks)
+    else:
+        results = list(map(_build_if_stale, tasks))
+    return [file_path for file_path, built in results if built]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the metadata indexes of all .smc files under a directory.")
+    parser.add_argument("data_root", help="root path of your RenderMe360 data")
+    parser.add_argument("--index_dir", default=None, help="save indexes here instead of next to the .smc files")
+    parser.add_argument("--num_workers", type=int, default=1)
+    parser.add_argument("--rebuild", action="store_true", help="rebuild indexes that are up to date too")
+    args = parser.parse_args()
+    built = build_index_tree(args.data_root, args.index_dir, args.num_workers, args.rebuild)
+    print(f"{len(built)} indexes built.")
@@ -1,45 +1,258 @@
-import json
+import os
 import sys
+import threading
 import time
-from calendar import c
-from functools import partial
-from unittest.mock import NonCallableMagicMock
+import wave
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 
-import cv2
 import h5py
 import numpy as np
-import tqdm
-from pydub import AudioSegment
+
+from profiler import PROFILER
+from smc_index import load_index
+from utils import (
+    crop,
+    imdecode_color,
+    imdecode_mask,
+    mask_bbox,
+    pack_mask,
+    parse_selection,
+    points_bbox,
+    rle_encode_mask,
+    roi_around,
+    scaled_shape,
+)
+
+
+class FrameCache:
+    """LRU cache of decoded images within a byte budget.
+
+    Cached arrays are shared by every hit, so they are made read-only: copy them before editing.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.entries = OrderedDict()
+        # decode threads put images concurrently
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            img = self.entries.get(key)
+            if img is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return img
+
+    def put(self, key, img):
+        if img.nbytes > self.max_bytes:
+            return
+        img.flags.writeable = False
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key).nbytes
+            self.entries[key] = img
+            self.nbytes += img.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+
+    def info(self):
+        with self.lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                entries=len(self.entries),
+                nbytes=self.nbytes,
+                max_bytes=self.max_bytes,
+            )
 
 
 class SMCReader:
+    # ranges of the raw read fast path closer than this are merged into one read
+    READ_MAX_GAP = 1 << 20
+    READ_MAX_RUN = 64 << 20
+    # frame rate of the cameras when the file does not store one, to align audio samples to frames
+    DEFAULT_FPS = 30
 
-    def __init__(self, file_path):
+    def __init__(self, file_path, num_threads=0, index_dir=None, use_index=True, cache_bytes=0):
         """Read SenseMocapFile endswith ".smc".
 
         Args:
             file_path (str):
                 Path to an SMC file.
+            num_threads (int):
+                Default number of threads decoding batches of images, 0 or 1 decodes serially.
+                Encoded bytes are always read from HDF5 serially, only cv2.imdecode (which releases the GIL) runs
+                on the threads.
+            index_dir (str, optional):
+                Directory of the metadata index built by smc_index.py, next to the file if None.
+            use_index (bool):
+                Read group keys and attrs from the index when it exists and is up to date, instead of probing HDF5.
+                The index is loaded on first access.
+            cache_bytes (int):
+                Budget of the LRU cache of decoded images (color, mask, uv, scan mask), 0 disables it.
+                Images returned from the cache are read-only.
         """
         self.smc = h5py.File(file_path, "r")
+        # positionless reads of contiguous datasets, which are safe to share across threads and forks
+        self.__fd__ = os.open(file_path, os.O_RDONLY) if hasattr(os, "pread") else None
+        self.num_threads = num_threads
+        self.cache = FrameCache(cache_bytes) if cache_bytes > 0 else None
+        self.__index_args__ = (file_path, index_dir) if use_index else None
+        self.__keys_cache__ = dict()
         self.__calibration_dict__ = None
-        self.actor_id = self.smc.attrs["actor_id"]
-        self.performance_part = self.smc.attrs["performance_part"]
-        self.capture_date = self.smc.attrs["capture_date"]
-        self.actor_info = dict(
-            age=self.smc.attrs["age"],
-            color=self.smc.attrs["color"],
-            gender=self.smc.attrs["gender"],
-            height=self.smc.attrs["height"],
-            weight=self.smc.attrs["weight"],
+
+    @cached_property
+    def index(self):
+        """Metadata index of the file (see smc_index.py), None if unused, missing or stale. Loaded on first access."""
+        return None if self.__index_args__ is None else load_index(*self.__index_args__)
+
+    ###metadata, read from the attrs on first access
+    @cached_property
+    def actor_id(self):
+        return self.__attrs__("")["actor_id"]
+
+    @cached_property
+    def performance_part(self):
+        return self.__attrs__("")["performance_part"]
+
+    @cached_property
+    def capture_date(self):
+        return self.__attrs__("")["capture_date"]
+
+    @cached_property
+    def actor_info(self):
+        attrs = self.__attrs__("")
+        return dict(
+            age=attrs["age"],
+            color=attrs["color"],
+            gender=attrs["gender"],
+            height=attrs["height"],
+            weight=attrs["weight"],
         )
-        self.Camera_info = dict(
-            num_device=self.smc["Camera"].attrs["num_device"],
-            num_frame=self.smc["Camera"].attrs["num_frame"],
-            resolution=self.smc["Camera"].attrs["resolution"],
+
+    @cached_property
+    def Camera_info(self):
+        camera_attrs = self.__attrs__("Camera")
+        return dict(
+            num_device=camera_attrs["num_device"],
+            num_frame=camera_attrs["num_frame"],
+            resolution=np.asarray(camera_attrs["resolution"]),
         )
 
+    def __attrs__(self, path):
+        """Attrs of the group at path ('' is the root), from the index if loaded."""
+        if self.index is not None:
+            return self.index["attrs"][path]
+        return self.smc[path].attrs if path else self.smc.attrs
+
+    def __keys__(self, path):
+        """Keys of the group at path ('' is the root) as (list, set), from the index if loaded. Memoized."""
+        if path not in self.__keys_cache__:
+            if self.index is not None:
+                keys = self.index["keys"].get(path, [])
+            else:
+                keys = list(self.smc[path].keys()) if path else list(self.smc.keys())
+            self.__keys_cache__[path] = (keys, set(keys))
+        return self.__keys_cache__[path]
+
+    def __has__(self, path, key):
+        return key in self.__keys__(path)[1]
+
+    def __del__(self):
+        if getattr(self, "__fd__", None) is not None:
+            os.close(self.__fd__)
+            self.__fd__ = None
+
+    def close(self):
+        """Close the HDF5 file and the raw read descriptor, the reader cannot be used afterwards."""
+        self.smc.close()
+        self.__del__()
+
+    ###raw bytes
+    def __locate__(self, path):
+        """(offset, size) of an encoded image dataset in the file, or None if it cannot be read as raw bytes,
+        i.e. it is chunked, filtered, empty or not uint8. Taken from the index if loaded."""
+        if self.__fd__ is None:
+            return None
+        if self.index is not None:
+            offset, size = self.index["datasets"].get(path, [None, None])
+        else:
+            dset = self.smc[path]
+            if dset.chunks is not None or dset.dtype != np.uint8 or dset.ndim != 1:
+                return None
+            offset, size = dset.id.get_offset(), dset.id.get_storage_size()
+        if offset is None or not size:
+            return None
+        return offset, size
+
+    @staticmethod
+    def __item__(path):
+        """Item of a dataset path for the profiler: 'color'/'mask' of Camera/<cid>/<item>/<fid>, 'uv', 'scanmask'."""
+        parts = path.split("/")
+        if parts[0] == "Camera" and len(parts) > 2:
+            return parts[2]
+        return {"UV_texture": "uv", "ScanMask": "scanmask"}.get(parts[0], parts[0])
+
+    def __read_many__(self, paths):
+        """Read the encoded bytes of the datasets at paths, as uint8 arrays in the same order.
+
+        Contiguous datasets are read with os.pread in file order, merging nearby ranges into one sequential read;
+        the others fall back to h5py.
+        """
+        with PROFILER.stage("read", self.__item__(paths[0]) if paths else None) as stage:
+            rs = self.__pread_many__(paths)
+            stage.nbytes = sum(r.nbytes for r in rs)
+        return rs
+
+    def __pread_many__(self, paths):
+        rs = [None] * len(paths)
+        located = []
+        for i, path in enumerate(paths):
+            loc = self.__locate__(path)
+            if loc is None:
+                rs[i] = self.smc[path][()]
+            else:
+                located.append((loc[0], loc[1], i))
+        located.sort()
+        start = 0
+        while start < len(located):
+            run_begin = located[start][0]
+            run_end = run_begin + located[start][1]
+            stop = start + 1
+            while stop < len(located):
+                offset, size, _ = located[stop]
+                if offset - run_end > self.READ_MAX_GAP or offset + size - run_begin > self.READ_MAX_RUN:
+                    break
+                run_end = max(run_end, offset + size)
+                stop += 1
+            buf = os.pread(self.__fd__, run_end - run_begin, run_begin)
+            assert len(buf) == run_end - run_begin, f"Short read in {self.smc.filename}"
+            for offset, size, i in located[start:stop]:
+                rs[i] = np.frombuffer(buf, dtype=np.uint8, count=size, offset=offset - run_begin)
+            start = stop
+        return rs
+
+    def __read_bytes__(self, path):
+        """Encoded bytes of the dataset at path as a uint8 array."""
+        return self.__read_many__([path])[0]
+
     ###info
+    def get_cache_info(self):
+        """Counters of the decoded image cache: hits, misses, evictions, entries, nbytes, max_bytes (None if off)."""
+        return None if self.cache is None else self.cache.info()
+
     def get_actor_info(self):
         return self.actor_info
 
@@ -65,7 +278,7 @@ class SMCReader:
         if self.__calibration_dict__ is not None:
             return self.__calibration_dict__
         self.__calibration_dict__ = dict()
-        for ci in self.smc["Calibration"].keys():
+        for ci in self.__keys__("Calibration")[0]:
             self.__calibration_dict__.setdefault(ci, dict())
             for mt in ["D", "K", "RT"]:
                 self.__calibration_dict__[ci][mt] = self.smc["Calibration"][ci][mt][()]
@@ -82,18 +295,160 @@ class SMCReader:
                 ['D', 'K', 'RT']
         """
         Camera_id = str(Camera_id)
-        assert Camera_id in self.smc["Calibration"].keys(), f"Invalid Camera_id {Camera_id}"
-        rs = dict()
-        for k in ["D", "K", "RT"]:
-            rs[k] = self.smc["Calibration"][Camera_id][k][()]
+        assert self.__has__("Calibration", Camera_id), f"Invalid Camera_id {Camera_id}"
+        # copies, callers may edit them (e.g. scale K) without touching the cached calibration
+        return {k: v.copy() for k, v in self.get_Calibration_all()[Camera_id].items()}
+
+    def get_Calibration_array(self):
+        """Get calibration matrixs of all cameras stacked in camera order.
+
+        Returns:
+            dict:
+                'cameras': Camera_id (str) of every row (C,)
+                'D'      : (C, 5)
+                'K'      : (C, 3, 3)
+                'RT'     : (C, 4, 4)
+        """
+        calib = self.get_Calibration_all()
+        cameras = sorted(calib.keys(), key=int)
+        rs = dict(cameras=np.array(cameras))
+        for mt in ["D", "K", "RT"]:
+            rs[mt] = np.stack([calib[ci][mt] for ci in cameras], axis=0)
         return rs
 
     ### RGB image
-    def __read_color_from_bytes__(self, color_array):
-        """Decode an RGB image from an encoded byte array."""
-        return cv2.imdecode(color_array, cv2.IMREAD_COLOR)
+    def __read_color_from_bytes__(self, color_array, scale=1):
+        """Decode an RGB image from an encoded byte array, at 1/scale resolution."""
+        return imdecode_color(color_array, scale)
+
+    def __decode_img__(self, img_byte, Image_type, out=None, scale=1):
+        """Decode one 'color'/'mask' image at 1/scale resolution, into out if given."""
+        with PROFILER.stage("decode", Image_type, img_byte.nbytes):
+            if Image_type == "mask":
+                return imdecode_mask(img_byte, scale, out)
+            img_color = self.__read_color_from_bytes__(img_byte, scale)
+            if out is not None:
+                out[...] = img_color
+                return out
+            return img_color
 
-    def get_img(self, Camera_id, Image_type, Frame_id=None, disable_tqdm=True):
+    def __frame_list__(self, path, Frame_id):
+        """Frame ids (str) of a batch request: all keys of the group at path in time order if Frame_id is None,
+        else the given list, checked against the keys of the group once."""
+        keys_list, keys = self.__keys__(path)
+        if Frame_id is None:
+            return [str(l) for l in sorted([int(l) for l in keys_list])]
+        Frame_id_list = [str(fi) for fi in Frame_id]
+        for fi in Frame_id_list:
+            assert fi in keys, f"Invalid Frame_id {fi}"
+        return Frame_id_list
+
+    @staticmethod
+    def __check_scale__(scale):
+        assert isinstance(scale, (int, np.integer)) and scale >= 1, f"Invalid scale {scale}, need an int >= 1"
+        return int(scale)
+
+    def __load_img__(self, path, Image_type, out=None, scale=1):
+        """Read and decode the image at dataset path, through the decoded image cache if enabled."""
+        if self.cache is None:
+            return self.__decode_img__(self.__read_bytes__(path), Image_type, out, scale)
+        img = self.cache.get((path, scale))
+        if img is None:
+            img = self.__decode_img__(self.__read_bytes__(path), Image_type, scale=scale)
+            self.cache.put((path, scale), img)
+        if out is not None:
+            out[...] = img
+            return out
+        return img
+
+    def __decode_batch__(self, paths, Image_type, out, num_threads=None, disable_tqdm=True, scale=1, rois=None):
+        """Decode the images at dataset paths into out[i], in order, at 1/scale resolution, cropped to rois[i]
+        (x, y, w, h) if rois is given. rois may also be a function of the decoded image returning its window, e.g.
+        a window around the mask being decoded.
+
+        Cached images are copied from the cache. The bytes of the others are read on the calling thread, a window of
+        paths at a time (see __read_many__). With num_threads > 1, decoding runs on a thread pool and at most two
+        windows of encoded images are held in memory.
+        """
+
+        def roi_of(i, img):
+            return rois(img) if callable(rois) else rois[i]
+
+        todo = list(range(len(paths)))
+        if self.cache is not None:
+            todo = []
+            for i, path in enumerate(paths):
+                img = self.cache.get((path, scale))
+                if img is None:
+                    todo.append(i)
+                else:
+                    out[i] = img if rois is None else crop(img, roi_of(i, img))
+
+        def decode(i, img_byte):
+            if rois is None:
+                img = self.__decode_img__(img_byte, Image_type, out[i], scale)
+            else:
+                img = self.__decode_img__(img_byte, Image_type, scale=scale)
+                out[i] = crop(img, roi_of(i, img))
+            if self.cache is not None:
+                self.cache.put((paths[i], scale), img.copy() if rois is None else img)
+
+        num_threads = self.num_threads if num_threads is None else num_threads
+        window = max(2 * num_threads, 8)
+        bar = None
+        if not disable_tqdm:
+            # imported on first use, loader workers never show a bar
+            from tqdm import tqdm
+
+            bar = tqdm(total=len(todo))
+        pool = ThreadPoolExecutor(num_threads) if num_threads > 1 else None
+        pending = deque()
+        try:
+            for start in range(0, len(todo), window):
+                ids = todo[start : start + window]
+                for i, img_byte in zip(ids, self.__read_many__([paths[i] for i in ids])):
+                    if pool is None:
+                        decode(i, img_byte)
+                    else:
+                        pending.append(pool.submit(decode, i, img_byte))
+                while len(pending) > window:
+                    pending.popleft().result()
+                if bar is not None:
+                    bar.update(len(ids))
+            for future in pending:
+                future.result()
+        finally:
+            if pool is not None:
+                pool.shutdown()
+            if bar is not None:
+                bar.close()
+
+    def __alloc_batch__(self, out, n, Image_type, scale=1, size=None):
+        """Check a caller supplied batch buffer, or allocate one. out may be:
+        None (allocate in memory), a path (allocate a .npy memmap there) or an array / np.memmap.
+        Images are (w, h) = size if given, e.g. the size of their roi, else full frames at 1/scale resolution.
+        """
+        h, w = scaled_shape(*[int(x) for x in self.Camera_info["resolution"]], scale) if size is None else size[::-1]
+        shape = (n, h, w) if Image_type == "mask" else (n, h, w, 3)
+        if out is None:
+            return np.empty(shape, dtype=np.uint8)
+        if isinstance(out, str):
+            return np.lib.format.open_memmap(out, mode="w+", dtype=np.uint8, shape=shape)
+        assert out.shape == shape and out.dtype == np.uint8, f"Invalid out {out.dtype} {out.shape}, need uint8 {shape}"
+        return out
+
+    def get_img(
+        self,
+        Camera_id,
+        Image_type,
+        Frame_id=None,
+        disable_tqdm=True,
+        out=None,
+        num_threads=None,
+        scale=1,
+        roi=None,
+        roi_size=None,
+    ):
         """Get image its Camera_id, Image_type and Frame_id
 
         Args:
@@ -105,8 +460,20 @@ class SMCReader:
             Frame_id a.(int/str of a number): '0' ~ 'num_frame'-1
                      b.list of numbers (int/str)
                      c.None: get batch of all imgs in order of time sequence
+            out (np.ndarray, np.memmap or str, optional):
+                buffer the images are decoded into, with the shape and dtype of the return value.
+                For multiple imgs, a path creates a .npy memmap of the batch there.
+                Multiple imgs are always decoded into one preallocated buffer, frame by frame.
+            num_threads (int, optional): threads decoding multiple imgs, defaults to self.num_threads.
+            scale (int): decode at 1/scale resolution, H and W rounded up (e.g. 2: (1024, 1224)).
+                Jpeg is decoded reduced by the codec for 2, 4 and 8, other images are downsampled after decoding.
+            roi, roi_size: crop every image to a window, see get_roi(). For multiple imgs, roi may also be a list
+                of (x, y, w, h), one per frame of Frame_id, e.g. windows derived from the masks of the anno file
+                for color images.
+                Images are cropped right after decoding, so a batch only holds the windows. The 'mask' windows of a
+                batch of masks come from the masks being decoded, each mask is decoded once.
         Returns:
-            a single img :
+            a single img (H, W are those of the roi if given) :
                 'color': HWC(2048, 2448, 3) in bgr (uint8)
                 'mask' : HW (2048, 2448) (uint8)
             multiple imgs :
@@ -114,27 +481,247 @@ class SMCReader:
                 'mask' : NHW (N, 2048, 2448) (uint8)
         """
         Camera_id = str(Camera_id)
-        assert Camera_id in self.smc["Camera"].keys(), f"Invalid Camera_id {Camera_id}"
-        assert Image_type in self.smc["Camera"][Camera_id].keys(), f"Invalid Image_type {Image_type}"
+        assert self.__has__("Camera", Camera_id), f"Invalid Camera_id {Camera_id}"
+        assert self.__has__(f"Camera/{Camera_id}", Image_type), f"Invalid Image_type {Image_type}"
+        assert Image_type in ["color", "mask"], f"Invalid Image_type {Image_type}"
         assert isinstance(Frame_id, (list, int, str, type(None))), f"Invalid Frame_id datatype {type(Frame_id)}"
+        scale = self.__check_scale__(scale)
+        path = f"Camera/{Camera_id}/{Image_type}"
         if isinstance(Frame_id, (str, int)):
             Frame_id = str(Frame_id)
-            assert Frame_id in self.smc["Camera"][Camera_id][Image_type].keys(), f"Invalid Frame_id {Frame_id}"
-            if Image_type in ["color", "mask"]:
-                img_byte = self.smc["Camera"][Camera_id][Image_type][Frame_id][()]
-                img_color = self.__read_color_from_bytes__(img_byte)
-            if Image_type == "mask":
-                img_color = np.max(img_color, 2).astype(np.uint8)
-            return img_color
+            assert self.__has__(path, Frame_id), f"Invalid Frame_id {Frame_id}"
+            if roi is None:
+                return self.__load_img__(f"{path}/{Frame_id}", Image_type, out, scale)
+            img = self.__load_img__(f"{path}/{Frame_id}", Image_type, scale=scale)
+            mask = img if Image_type == "mask" else None
+            img = crop(img, self.get_roi(Camera_id, Frame_id, roi, roi_size, scale, mask))
+            if out is None:
+                return img.copy()
+            out[...] = img
+            return out
         else:
-            if Frame_id is None:
-                Frame_id_list = sorted([int(l) for l in self.smc["Camera"][Camera_id][Image_type].keys()])
-            elif isinstance(Frame_id, list):
-                Frame_id_list = Frame_id
-            rs = []
-            for fi in tqdm.tqdm(Frame_id_list, disable=disable_tqdm):
-                rs.append(self.get_img(Camera_id, Image_type, fi))
-            return np.stack(rs, axis=0)
+            Frame_id_list = self.__frame_list__(path, Frame_id)
+            rois, size = None, None
+            if np.ndim(roi) == 2:
+                assert len(roi) == len(Frame_id_list), f"Invalid roi, need one per frame ({len(Frame_id_list)})"
+                rois = [self.get_roi(Camera_id, fi, r, scale=scale) for fi, r in zip(Frame_id_list, roi)]
+            elif isinstance(roi, str) and roi == "mask" and Image_type == "mask":
+                assert roi_size is not None, f"Invalid roi_size, roi '{roi}' needs one"
+                shape = scaled_shape(*[int(x) for x in self.Camera_info["resolution"]], scale)
+                # checks roi_size before anything is decoded
+                roi_around(None, roi_size, shape)
+
+                def rois(mask):
+                    return roi_around(mask_bbox(mask), roi_size, shape)
+
+                size = tuple(roi_size)
+            elif roi is not None:
+                rois = [self.get_roi(Camera_id, fi, roi, roi_size, scale) for fi in Frame_id_list]
+            if isinstance(rois, list) and rois:
+                size = rois[0][2:]
+                assert all(r[2:] == size for r in rois), "Invalid roi, the windows of a batch must have one size"
+            out = self.__alloc_batch__(out, len(Frame_id_list), Image_type, scale, size)
+            self.__decode_batch__(
+                [f"{path}/{fi}" for fi in Frame_id_list], Image_type, out, num_threads, disable_tqdm, scale, rois
+            )
+            return out
+
+    def get_roi(self, Camera_id, Frame_id, roi, roi_size=None, scale=1, mask=None):
+        """Get the window (x, y, w, h) of an roi in an image of a camera at 1/scale resolution.
+
+        Args:
+            Camera_id (int/str of a number), Frame_id (int/str of a number): see get_img()
+            roi:
+                (x, y, w, h): a fixed window, checked and returned as is
+                'mask'      : a roi_size window centered on the bounding box of the mask of the frame
+                'lmk2d'     : a roi_size window centered on the bounding box of the 2d landmarks of the frame
+                Windows are shifted to fit in the image. Frames without mask pixels or landmarks get the window
+                centered on the image. Masks and landmarks are in the anno file: for the color images of the raw
+                file, pass the windows of the anno file to get_img() as a list.
+            roi_size ((w, h)): size of the windows of 'mask' and 'lmk2d', at 1/scale resolution.
+            mask (np.ndarray, optional): the mask of the frame at 1/scale resolution, if already decoded.
+        Returns:
+            (x, y, w, h), None if roi is None
+        """
+        if roi is None:
+            return None
+        scale = self.__check_scale__(scale)
+        shape = scaled_shape(*[int(x) for x in self.Camera_info["resolution"]], scale)
+        if not isinstance(roi, str):
+            x, y, w, h = [int(v) for v in roi]
+            assert w > 0 and h > 0 and x >= 0 and y >= 0, f"Invalid roi {roi}"
+            assert x + w <= shape[1] and y + h <= shape[0], f"Invalid roi {roi} for images of {shape}"
+            return x, y, w, h
+        assert roi in ["mask", "lmk2d"], f"Invalid roi {roi}"
+        assert roi_size is not None, f"Invalid roi_size, roi '{roi}' needs one"
+        if roi == "mask":
+            assert mask is not None or self.__has__(f"Camera/{Camera_id}", "mask"), (
+                f"Invalid roi 'mask', no masks of camera {Camera_id} in this file, get its windows from the anno file"
+            )
+            if mask is None:
+                mask = self.get_img(Camera_id, "mask", Frame_id, scale=scale)
+            bbox = mask_bbox(mask)
+        else:
+            assert self.__has__("", "Keypoints2d"), (
+                "Invalid roi 'lmk2d', no Keypoints2d in this file, get its windows from the anno file"
+            )
+            lmk2d, valid = self.load_Keypoints2d(Camera_id, [Frame_id])
+            bbox = points_bbox(lmk2d[0] / scale) if lmk2d is not None and valid[0] else None
+        return roi_around(bbox, roi_size, shape)
+
+    def select_cameras(self, expr=None):
+        """Camera_ids selected by an expression of utils.parse_selection over the camera indices, e.g. '18-32',
+        '0-59:2' or 'lmk2d' for the cameras with 2d landmarks (in the anno file). None selects every camera.
+
+        Returns:
+            list of Camera_id (str), in camera order
+        """
+        cameras = sorted(self.__keys__("Camera")[0], key=int)
+        named = dict()
+        if self.__has__("", "Keypoints2d"):
+            named["lmk2d"] = [int(ci) for ci in self.__keys__("Keypoints2d")[0]]
+        assert "lmk2d" not in str(expr) or named, "Invalid camera selection, no Keypoints2d in this file"
+        by_index = {int(ci): ci for ci in cameras}
+        ids = parse_selection(expr, max(by_index) + 1 if by_index else 0, named)
+        return [by_index[i] for i in ids if i in by_index]
+
+    def select_frames(self, expr=None, num_frame=None):
+        """Frame ids (int) selected by an expression of utils.parse_selection, e.g. '0-99', 'all:5' or '10-:2',
+        among the first num_frame frames (all frames if None)."""
+        n = int(self.Camera_info["num_frame"])
+        return parse_selection(expr, n if num_frame is None else min(num_frame, n))
+
+    def get_views(self, Camera_ids, Image_type, Frame_id, out=None, num_threads=None, scale=1):
+        """Get the images of several cameras at one frame, e.g. the views of a multi-view training sample.
+        The encoded images are read in one pass over the file and decoded like a batch of get_img().
+
+        Args:
+            Camera_ids (list of int/str of a number): CameraIDs (str) in {'00'...'59'}
+            Image_type, Frame_id (int/str of a number), num_threads, scale: see get_img()
+            out (np.ndarray, optional): buffer the images are decoded into, with the shape of the return value.
+        Returns:
+            'color': (V, H, W, 3) in bgr (uint8), 'mask': (V, H, W) (uint8), in the order of Camera_ids
+        """
+        assert Image_type in ["color", "mask"], f"Invalid Image_type {Image_type}"
+        scale = self.__check_scale__(scale)
+        Frame_id = str(Frame_id)
+        paths = []
+        for Camera_id in Camera_ids:
+            path = f"Camera/{Camera_id}/{Image_type}"
+            assert self.__has__("Camera", str(Camera_id)), f"Invalid Camera_id {Camera_id}"
+            assert self.__has__(f"Camera/{Camera_id}", Image_type), f"Invalid Image_type {Image_type}"
+            assert self.__has__(path, Frame_id), f"Invalid Frame_id {Frame_id} of camera {Camera_id}"
+            paths.append(f"{path}/{Frame_id}")
+        out = self.__alloc_batch__(out, len(paths), Image_type, scale)
+        self.__decode_batch__(paths, Image_type, out, num_threads, True, scale)
+        return out
+
+    def get_img_bytes(self, Camera_id, Image_type, Frame_id):
+        """Get the encoded bytes (as stored, e.g. png) of an image, without decoding it.
+
+        Args:
+            Camera_id (int/str of a number): CameraID (str) in {'00'...'59'}
+            Image_type (str): 'color' or 'mask'
+            Frame_id (int/str of a number): '0' ~ 'num_frame'-1
+        Returns:
+            encoded image: (n_bytes,) uint8, decode it with decode_img()
+        """
+        Camera_id, Frame_id = str(Camera_id), str(Frame_id)
+        path = f"Camera/{Camera_id}/{Image_type}"
+        assert self.__has__("Camera", Camera_id), f"Invalid Camera_id {Camera_id}"
+        assert self.__has__(f"Camera/{Camera_id}", Image_type), f"Invalid Image_type {Image_type}"
+        assert self.__has__(path, Frame_id), f"Invalid Frame_id {Frame_id}"
+        return self.__read_bytes__(f"{path}/{Frame_id}")
+
+    def decode_img(self, img_byte, Image_type="color", scale=1):
+        """Decode bytes from get_img_bytes()/get_uv_bytes() like get_img() does ('color' for uv maps)."""
+        return self.__decode_img__(img_byte, Image_type, scale=self.__check_scale__(scale))
+
+    def get_packed_mask(
+        self, Camera_id, Frame_id=None, packing="bits", threshold=128, scale=1, window=64, num_threads=None
+    ):
+        """Get masks binarized at threshold in a compact form, decoding window frames at a time so that only a
+        window of full-size masks is held in memory.
+
+        Args:
+            Camera_id, Frame_id, scale, num_threads: see get_img()
+            packing (str):
+                'bits': rows packed into bits by utils.pack_mask, unpack with utils.unpack_mask(bits, W)
+                'rle' : run lengths by utils.rle_encode_mask, decode with utils.rle_decode_mask(runs, (H, W))
+        Returns:
+            a single mask: 'bits' (H, ceil(W / 8)) uint8, 'rle' (n_runs,) int64
+            multiple masks: 'bits' (N, H, ceil(W / 8)) uint8, 'rle' list of N run arrays
+        """
+        assert packing in ["bits", "rle"], f"Invalid packing {packing}"
+        pack = pack_mask if packing == "bits" else rle_encode_mask
+        if isinstance(Frame_id, (str, int)):
+            return pack(self.get_img(Camera_id, "mask", Frame_id, scale=scale), threshold)
+        Camera_id = str(Camera_id)
+        assert self.__has__("Camera", Camera_id), f"Invalid Camera_id {Camera_id}"
+        assert self.__has__(f"Camera/{Camera_id}", "mask"), "Invalid Image_type mask"
+        Frame_id_list = self.__frame_list__(f"Camera/{Camera_id}/mask", Frame_id)
+        rs = []
+        for start in range(0, len(Frame_id_list), window):
+            masks = self.get_img(
+                Camera_id, "mask", Frame_id_list[start : start + window], num_threads=num_threads, scale=scale
+            )
+            if packing == "bits":
+                rs.append(pack(masks, threshold))
+            else:
+                rs.extend(pack(mask, threshold) for mask in masks)
+        return np.concatenate(rs) if packing == "bits" else rs
+
+    def iter_frames(self, cameras=None, frames=None, items=("color", "mask"), prefetch=0, num_threads=None, scale=1):
+        """Lazily yield decoded images one (frame, camera) record at a time, in time order then camera order.
+
+        Only prefetch records are decoded ahead, so iterating a whole sequence runs in constant memory.
+
+        Args:
+            cameras (list of int/str, optional): Camera_ids (ints are zero padded), all cameras if None.
+            frames (list of int/str, optional): Frame_ids, all frames if None.
+            items (tuple of str): image types to decode. Types this file does not store are skipped,
+                e.g. 'mask' on a raw file.
+            prefetch (int): number of records decoded ahead on background threads, 0 decodes on demand.
+            num_threads (int, optional): threads decoding prefetched records, defaults to self.num_threads.
+            scale (int): decode at 1/scale resolution, see get_img().
+        Yields:
+            dict(camera=Camera_id (str), frame=Frame_id (int), <item>=img for every stored item)
+        """
+        scale = self.__check_scale__(scale)
+        if cameras is None:
+            cameras = sorted(self.__keys__("Camera")[0], key=int)
+        cameras = [f"{ci:02d}" if isinstance(ci, int) else str(ci) for ci in cameras]
+        if frames is None:
+            frames = list(range(int(self.Camera_info["num_frame"])))
+        stored = set()
+        for ci in cameras:
+            assert self.__has__("Camera", ci), f"Invalid Camera_id {ci}"
+            for it in items:
+                if self.__has__(f"Camera/{ci}", it):
+                    stored.add((ci, it))
+                    self.__frame_list__(f"Camera/{ci}/{it}", frames)
+
+        def load(fi, ci):
+            record = dict(camera=ci, frame=int(fi))
+            for it in items:
+                if (ci, it) in stored:
+                    record[it] = self.__load_img__(f"Camera/{ci}/{it}/{fi}", it, scale=scale)
+            return record
+
+        keys = ((fi, ci) for fi in frames for ci in cameras)
+        if prefetch <= 0:
+            for fi, ci in keys:
+                yield load(fi, ci)
+            return
+        num_threads = self.num_threads if num_threads is None else num_threads
+        with ThreadPoolExecutor(max(num_threads, 1)) as pool:
+            pending = deque()
+            for fi, ci in keys:
+                pending.append(pool.submit(load, fi, ci))
+                if len(pending) > prefetch:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
 
     def get_audio(self):
         """
@@ -150,8 +737,101 @@ class SMCReader:
         data = self.smc["Camera"]["00"]["audio"]
         return data
 
+    def get_audio_info(self):
+        """
+        Get the layout of the audio data, without reading it.
+        Returns:
+            dict:
+                sample_rate: int
+                num_samples: int
+                channels: int
+                dtype: np.dtype of the samples
+                fps: camera frame rate used to align frames and samples, the 'fps' attr of Camera or DEFAULT_FPS
+            None if there is no audio in this file
+        """
+        data = self.get_audio()
+        if data is None:
+            return None
+        audio = data["audio"]
+        return dict(
+            sample_rate=int(data["sample_rate"][()]),
+            num_samples=audio.shape[0],
+            channels=1 if audio.ndim == 1 else audio.shape[1],
+            dtype=audio.dtype,
+            fps=float(self.__attrs__("Camera").get("fps", self.DEFAULT_FPS)),
+        )
+
+    def __sample_range__(self, info, Frame_start, Frame_stop):
+        """Samples [start, stop) played during frames [Frame_start, Frame_stop), clipped to the audio length."""
+        num_frame = int(self.Camera_info["num_frame"])
+        Frame_stop = num_frame if Frame_stop is None else Frame_stop
+        assert 0 <= Frame_start <= Frame_stop <= num_frame, f"Invalid frame range [{Frame_start}, {Frame_stop})"
+        samples_per_frame = info["sample_rate"] / info["fps"]
+        start = min(int(round(Frame_start * samples_per_frame)), info["num_samples"])
+        stop = min(int(round(Frame_stop * samples_per_frame)), info["num_samples"])
+        return start, stop
+
+    def get_audio_clip(self, Frame_start, Frame_stop=None):
+        """Get the audio samples aligned to frames [Frame_start, Frame_stop), reading only that slice.
+
+        Args:
+            Frame_start (int): first frame of the clip
+            Frame_stop (int, optional): frame after the last one of the clip, the end of the sequence if None
+        Returns:
+            (samples, sample_rate): samples (n,) or (n, channels) as stored
+            None if there is no audio in this file
+        """
+        info = self.get_audio_info()
+        if info is None:
+            return None
+        start, stop = self.__sample_range__(info, Frame_start, Frame_stop)
+        return self.get_audio()["audio"][start:stop], info["sample_rate"]
+
+    def iter_audio_chunks(self, Frame_start=0, Frame_stop=None, chunk_samples=1 << 20):
+        """Yield the audio samples of frames [Frame_start, Frame_stop) in chunks of at most chunk_samples samples,
+        so that the audio is never loaded at once. Yields nothing if there is no audio in this file."""
+        info = self.get_audio_info()
+        if info is None:
+            return
+        start, stop = self.__sample_range__(info, Frame_start, Frame_stop)
+        audio = self.get_audio()["audio"]
+        for chunk_start in range(start, stop, chunk_samples):
+            yield audio[chunk_start : min(chunk_start + chunk_samples, stop)]
+
+    def writewav(self, f, Frame_start=0, Frame_stop=None, chunk_samples=1 << 20):
+        """Stream the audio of frames [Frame_start, Frame_stop) into a PCM wav file, one chunk at a time.
+
+        Float samples (in [-1, 1)) are written as 16-bit PCM like writemp3(normalized=True), int16/int32 samples as
+        stored.
+
+        Returns:
+            number of samples written, None if there is no audio in this file
+        """
+        info = self.get_audio_info()
+        if info is None:
+            return None
+        floating = np.issubdtype(info["dtype"], np.floating)
+        assert floating or info["dtype"] in [np.int16, np.int32], f"Unsupported audio dtype {info['dtype']}"
+        sample_width = 2 if floating else info["dtype"].itemsize
+        n = 0
+        with wave.open(f, "wb") as wav:
+            wav.setnchannels(info["channels"])
+            wav.setsampwidth(sample_width)
+            wav.setframerate(info["sample_rate"])
+            for chunk in self.iter_audio_chunks(Frame_start, Frame_stop, chunk_samples):
+                if floating:
+                    chunk = np.clip(chunk * 2**15, -(2**15), 2**15 - 1).astype("<i2")
+                else:
+                    chunk = chunk.astype(chunk.dtype.newbyteorder("<"))
+                wav.writeframes(chunk.tobytes())
+                n += len(chunk)
+        return n
+
     def writemp3(self, f, sr, x, normalized=False):
         """numpy array to MP3"""
+        # optional dependency (and ffmpeg), only needed here
+        from pydub import AudioSegment
+
         channels = 2 if (x.ndim == 2 and x.shape[1] == 2) else 1
         if normalized:  # normalized array - each item should be a float in [-1, 1)
             y = np.int16(x * 2**15)
@@ -160,6 +840,97 @@ class SMCReader:
         song = AudioSegment(y.tobytes(), frame_rate=sr, sample_width=2, channels=channels)
         song.export(f, format="mp3", bitrate="320k")
 
+    ###batch loading of per-frame datasets
+    def __frame_range__(self, path, Frame_id):
+        """Frame ids (str) of a bulk load: 0 ~ num_frame-1 if Frame_id is None, else the checked list."""
+        num_frame = int(self.__attrs__(path)["num_frame"])
+        if Frame_id is None:
+            return [str(fi) for fi in range(num_frame)]
+        for fi in Frame_id:
+            assert 0 <= int(fi) < num_frame, f"Invalid frame_index {fi}"
+        return [str(int(fi)) for fi in Frame_id]
+
+    def __stack_datasets__(self, datasets, n):
+        """Read (i, dataset) pairs into one dense (n, ...) array, which stays zero where no dataset is given.
+
+        Returns:
+            (array, valid): valid (n,) bool marks the filled rows; array is None if nothing was read.
+        """
+        out, valid = None, np.zeros(n, dtype=bool)
+        for i, dset in datasets:
+            if dset.shape is None or len(dset.shape) == 0 or dset.shape[0] == 0:
+                continue
+            if out is None:
+                out = np.zeros((n,) + dset.shape, dtype=dset.dtype)
+            dset.read_direct(out[i])
+            valid[i] = True
+        return out, valid
+
+    def load_Keypoints2d(self, Camera_id, Frame_id=None):
+        """Bulk load keypoint2D of a camera into a dense array.
+        The frame index of the camera is built once, frames without detection are kept as zero rows.
+
+        Args:
+            Camera_id (int/str of a number): CameraID (str) in {18...32}
+            Frame_id (list or None): list of frame ids, all frames if None.
+        Returns:
+            (lmk2d, valid): lmk2d (N, 106, 2), valid (N,) bool
+            if no data in this camera, return (None, None)
+        """
+        Camera_id = str(Camera_id)
+        if not self.__has__("Keypoints2d", Camera_id):
+            return None, None
+        Frame_id_list = self.__frame_range__("Keypoints2d", Frame_id)
+        group = self.smc["Keypoints2d"][Camera_id]
+        keys = self.__keys__(f"Keypoints2d/{Camera_id}")[1]
+        return self.__stack_datasets__(
+            ((i, group[fi]) for i, fi in enumerate(Frame_id_list) if fi in keys), len(Frame_id_list)
+        )
+
+    def load_Keypoints3d(self, Frame_id=None):
+        """Bulk load keypoint3D into a dense array, frames without data are kept as zero rows.
+
+        Args:
+            Frame_id (list or None): list of frame ids, all frames if None.
+        Returns:
+            (lmk3d, valid): lmk3d (N, , 3), valid (N,) bool
+        """
+        group = self.smc["Keypoints3d"]
+        Frame_id_list = self.__frame_range__("Keypoints3d", Frame_id)
+        keys = self.__keys__("Keypoints3d")[1]
+        return self.__stack_datasets__(
+            ((i, group[fi]) for i, fi in enumerate(Frame_id_list) if fi in keys), len(Frame_id_list)
+        )
+
+    def load_FLAME(self, Frame_id=None, keys=None):
+        """Bulk load FLAME parameters into one dense array per parameter, frames without data are kept as zero rows.
+
+        Args:
+            Frame_id (list or None): list of frame ids, all frames if None.
+            keys (list or None): parameters to load, e.g. ['verts'], all if None.
+        Returns:
+            (flame, valid):
+                flame: dict of parameter name -> (N, ...) array, e.g. 'exp' (N, 50), 'verts' (N, 5023, 3)
+                valid: (N,) bool
+            if no FLAME in this file, return (None, None)
+        """
+        if not self.__has__("", "FLAME"):
+            print("not flame parameters, please check the performance part.")
+            return None, None
+        group = self.smc["FLAME"]
+        Frame_id_list = self.__frame_range__("FLAME", Frame_id)
+        frame_keys = self.__keys__("FLAME")[1]
+        frames = [(i, group[fi]) for i, fi in enumerate(Frame_id_list) if fi in frame_keys]
+        flame, valid = dict(), np.zeros(len(Frame_id_list), dtype=bool)
+        if len(frames) == 0:
+            return flame, valid
+        for k in self.__keys__(f"FLAME/{Frame_id_list[frames[0][0]]}")[0]:
+            if keys is not None and k not in keys:
+                continue
+            flame[k], valid_k = self.__stack_datasets__(((i, g[k]) for i, g in frames), len(Frame_id_list))
+            valid |= valid_k
+        return flame, valid
+
     ###Keypoints2d
     def get_Keypoints2d(self, Camera_id, Frame_id=None):
         """Get keypoint2D by its Camera_group, Camera_id and Frame_id
@@ -183,17 +954,17 @@ class SMCReader:
         # assert Camera_id in [f"%02d" % i for i in range(18, 33)], f"Invalid Camera_id {Camera_id}"
         assert isinstance(Frame_id, (list, int, str, type(None))), f"Invalid Frame_id datatype: {type(Frame_id)}"
 
-        if Camera_id not in self.smc["Keypoints2d"].keys():
+        if not self.__has__("Keypoints2d", Camera_id):
             print(f"not lmk2d result in camera id {Camera_id}")
             return None
         if isinstance(Frame_id, (str, int)):
             Frame_id = int(Frame_id)
-            assert (
-                Frame_id >= 0 and Frame_id < self.smc["Keypoints2d"].attrs["num_frame"]
-            ), f"Invalid frame_index {Frame_id}"
+            assert Frame_id >= 0 and Frame_id < self.__attrs__("Keypoints2d")["num_frame"], (
+                f"Invalid frame_index {Frame_id}"
+            )
             Frame_id = str(Frame_id)
             if (
-                Frame_id not in self.smc["Keypoints2d"][Camera_id].keys()
+                not self.__has__(f"Keypoints2d/{Camera_id}", Frame_id)
                 or self.smc["Keypoints2d"][Camera_id][Frame_id] is None
                 or len(self.smc["Keypoints2d"][Camera_id][Frame_id]) == 0
             ):
@@ -203,14 +974,11 @@ class SMCReader:
         else:
             if Frame_id is None:
                 return self.smc["Keypoints2d"][Camera_id]
-            elif isinstance(Frame_id, list):
-                Frame_id_list = Frame_id
-            rs = []
-            for fi in tqdm.tqdm(Frame_id_list):
-                kpt2d = self.get_Keypoints2d(Camera_id, fi)
-                if kpt2d is not None:
-                    rs.append(kpt2d)
-            return np.stack(rs, axis=0)
+            lmk2d, valid = self.load_Keypoints2d(Camera_id, Frame_id)
+            if lmk2d is None:
+                print(f"not lmk2d result in camera id {Camera_id} at frames {Frame_id}")
+                return None
+            return lmk2d[valid]
 
     ###Keypoints3d
     def get_Keypoints3d(self, Frame_id=None):
@@ -227,24 +995,21 @@ class SMCReader:
         """
         if isinstance(Frame_id, (str, int)):
             Frame_id = int(Frame_id)
-            assert (
-                Frame_id >= 0 and Frame_id < self.smc["Keypoints3d"].attrs["num_frame"]
-            ), f"Invalid frame_index {Frame_id}"
-            if str(Frame_id) not in self.smc["Keypoints3d"].keys() or len(self.smc["Keypoints3d"][str(Frame_id)]) == 0:
+            assert Frame_id >= 0 and Frame_id < self.__attrs__("Keypoints3d")["num_frame"], (
+                f"Invalid frame_index {Frame_id}"
+            )
+            if not self.__has__("Keypoints3d", str(Frame_id)) or len(self.smc["Keypoints3d"][str(Frame_id)]) == 0:
                 print(f"get_Keypoints3d: data of frame {Frame_id} do not exist.")
                 return None
             return self.smc["Keypoints3d"][str(Frame_id)]
         else:
             if Frame_id is None:
                 return self.smc["Keypoints3d"]
-            elif isinstance(Frame_id, list):
-                Frame_id_list = Frame_id
-            rs = []
-            for fi in tqdm.tqdm(Frame_id_list):
-                kpt3d = self.get_Keypoints3d(fi)
-                if kpt3d is not None:
-                    rs.append(kpt3d)
-            return np.stack(rs, axis=0)
+            lmk3d, valid = self.load_Keypoints3d(Frame_id)
+            if lmk3d is None:
+                print(f"get_Keypoints3d: data of frames {Frame_id} do not exist.")
+                return None
+            return lmk3d[valid]
 
     ###FLAME
     def get_FLAME(self, Frame_id=None):
@@ -259,7 +1024,7 @@ class SMCReader:
                 Defaults to None.
 
         Returns:
-            dict:
+            dict (for a list of N frames, every value is stacked to (N, ...)):
                 "global_pose"                   : double (3,)
                 "neck_pose"                     : double (3,)
                 "jaw_pose"                      : double (3,)
@@ -274,27 +1039,24 @@ class SMCReader:
         if "e" not in self.performance_part.split("_")[0]:
             print(f"no flame data in the performance part: {self.performance_part}")
             return None
-        if "FLAME" not in self.smc.keys():
+        if not self.__has__("", "FLAME"):
             print("not flame parameters, please check the performance part.")
             return None
         flame = self.smc["FLAME"]
         if Frame_id is None:
             return flame
         elif isinstance(Frame_id, list):
-            frame_list = [str(fi) for fi in Frame_id]
-            rs = []
-            for fi in tqdm.tqdm(frame_list):
-                rs.append(self.get_FLAME(fi))
-            return np.stack(rs, axis=0)
+            flame, valid = self.load_FLAME(Frame_id)
+            return {k: v[valid] for k, v in flame.items()}
         elif isinstance(Frame_id, (int, str)):
             Frame_id = int(Frame_id)
-            assert Frame_id >= 0 and Frame_id < self.smc["FLAME"].attrs["num_frame"], f"Invalid frame_index {Frame_id}"
+            assert Frame_id >= 0 and Frame_id < self.__attrs__("FLAME")["num_frame"], f"Invalid frame_index {Frame_id}"
             return flame[str(Frame_id)]
         else:
             raise TypeError("frame_id should be int, list or None.")
 
     ###uv texture map
-    def get_uv(self, Frame_id=None, disable_tqdm=True):
+    def get_uv(self, Frame_id=None, disable_tqdm=True, num_threads=None, scale=1):
         """Get uv map (image form) computed by flame-fitting processing pipeline.
         uv texture is only provided in expression part.
 
@@ -304,32 +1066,52 @@ class SMCReader:
                 list: a list of frame id
                 None: all frames will be returned
                 Defaults to None.
+            num_threads (int, optional): threads decoding multiple imgs, defaults to self.num_threads.
+            scale (int): decode at 1/scale resolution, see get_img().
 
         Returns:
             a single img: HWC in bgr (uint8)
+            multiple imgs: NHWC in bgr (uint8)
         """
         if "e" not in self.performance_part.split("_")[0]:
             print(f"no uv data in the performance part: {self.performance_part}")
             return None
-        if "UV_texture" not in self.smc.keys():
+        if not self.__has__("", "UV_texture"):
             print("not uv texture, please check the performance part.")
             return None
         assert isinstance(Frame_id, (list, int, str, type(None))), f"Invalid Frame_id datatype {type(Frame_id)}"
+        scale = self.__check_scale__(scale)
         if isinstance(Frame_id, (str, int)):
             Frame_id = str(Frame_id)
-            assert Frame_id in self.smc["UV_texture"].keys(), f"Invalid Frame_id {Frame_id}"
-            img_byte = self.smc["UV_texture"][Frame_id][()]
-            img_color = self.__read_color_from_bytes__(img_byte)
-            return img_color
+            assert self.__has__("UV_texture", Frame_id), f"Invalid Frame_id {Frame_id}"
+            return self.__load_img__(f"UV_texture/{Frame_id}", "color", scale=scale)
         else:
-            if Frame_id is None:
-                Frame_id_list = sorted([int(l) for l in self.smc["UV_texture"].keys()])
-            elif isinstance(Frame_id, list):
-                Frame_id_list = Frame_id
-            rs = []
-            for fi in tqdm.tqdm(Frame_id_list, disable=disable_tqdm):
-                rs.append(self.get_uv(fi))
-            return np.stack(rs, axis=0)
+            Frame_id_list = self.__frame_list__("UV_texture", Frame_id)
+            # uv maps have no resolution attribute, the first one gives the batch shape
+            first = self.__load_img__(f"UV_texture/{Frame_id_list[0]}", "color", scale=scale)
+            out = np.empty((len(Frame_id_list),) + first.shape, dtype=first.dtype)
+            out[0] = first
+            self.__decode_batch__(
+                [f"UV_texture/{fi}" for fi in Frame_id_list[1:]], "color", out[1:], num_threads, disable_tqdm, scale
+            )
+            return out
+
+    def get_uv_bytes(self, Frame_id):
+        """Get the encoded bytes (as stored, e.g. png) of a uv map, without decoding it.
+
+        Returns:
+            encoded image: (n_bytes,) uint8, decode it with decode_img()
+            None if there is no uv texture in this file
+        """
+        if "e" not in self.performance_part.split("_")[0]:
+            print(f"no uv data in the performance part: {self.performance_part}")
+            return None
+        if not self.__has__("", "UV_texture"):
+            print("not uv texture, please check the performance part.")
+            return None
+        Frame_id = str(Frame_id)
+        assert self.__has__("UV_texture", Frame_id), f"Invalid Frame_id {Frame_id}"
+        return self.__read_bytes__(f"UV_texture/{Frame_id}")
 
     ###scan mesh
     def get_scanmesh(self):
@@ -346,119 +1128,105 @@ class SMCReader:
         data = self.smc["Scan"]
         return data
 
-    def get_scanmask(self, Camera_id=None):
+    def get_scanmask(self, Camera_id=None, num_threads=None, scale=1):
         """Get image its Camera_id
 
         Args:
             Camera_id (int/str of a number):
                 CameraID (str) in
                     {'00'...'59'}
+            num_threads (int, optional): threads decoding all cameras, defaults to self.num_threads.
+            scale (int): decode at 1/scale resolution, see get_img().
         Returns:
             a single img : HW (2048, 2448) (uint8)
             multiple img: NHW (N, 2048, 2448)  (uint8)
         """
+        scale = self.__check_scale__(scale)
         if Camera_id is None:
-            rs = []
-            for i in range(60):
-                rs.append(self.get_scanmask(f"{i:02d}"))
-            return np.stack(rs, axis=0)
+            cameras = sorted(self.__keys__("ScanMask")[0], key=int)
+            out = self.__alloc_batch__(None, len(cameras), "mask", scale)
+            self.__decode_batch__([f"ScanMask/{ci}" for ci in cameras], "mask", out, num_threads, scale=scale)
+            return out
         assert isinstance(Camera_id, (str, int)), f"Invalid Camera_id type {Camera_id}"
         Camera_id = str(Camera_id)
-        assert Camera_id in self.smc["Camera"].keys(), f"Invalid Camera_id {Camera_id}"
-        img_byte = self.smc["ScanMask"][Camera_id][()]
-        img_color = self.__read_color_from_bytes__(img_byte)
-        img_color = np.max(img_color, 2).astype(np.uint8)
-        return img_color
+        assert self.__has__("Camera", Camera_id), f"Invalid Camera_id {Camera_id}"
+        return self.__load_img__(f"ScanMask/{Camera_id}", "mask", scale=scale)
 
 
 ### test func
 if __name__ == "__main__":
-    actor_part = sys.argv[1]
+    # python smc_reader.py /path/to/0026_e_0_anno.smc, or a file made by synthetic_smc.py
+    file_path = sys.argv[1]
     st = time.time()
-    print("reading smc: {}".format(actor_part))
-    rd = SMCReader(f"/mnt/lustre/share_data/pandongwei/RenFace_waic_20230718/{actor_part}.smc")
+    print("reading smc: {}".format(file_path))
+    rd = SMCReader(file_path)
     print("SMCReader done, in %f sec\n" % (time.time() - st), flush=True)
+    part = rd.performance_part.split("_")[0]
 
     # basic info
     print(rd.get_actor_info())
     print(rd.get_Camera_info())
 
     # img
-    Camera_id = "25"
+    cameras = sorted(rd.__keys__("Camera")[0], key=int)
+    Camera_id = "25" if "25" in cameras else cameras[-1]
     Frame_id = 0
+    Image_type = "color" if rd.__has__(f"Camera/{Camera_id}", "color") else "mask"
 
-    image = rd.get_img(Camera_id, "color", Frame_id)  # Load image for the specified camera and frame
-    print(f"image.shape: {image.shape}")  # (2048, 2448, 3)
-    images = rd.get_img("04", "color", disable_tqdm=False)
-    print(f"color {images.shape}, {images.dtype}")
-
-    # mask
-    mask = rd.get_img(Camera_id, "mask", Frame_id)
-    print(f"mask.shape: {mask.shape}")  # (2048, 2448)
-    l = [10, 13]
-    mask = rd.get_img(13, "mask", l, disable_tqdm=False)
-    mask = rd.get_img(13, "mask", disable_tqdm=False)
-    print(f" mask {mask.dtype} {mask.shape}")
+    image = rd.get_img(Camera_id, Image_type, Frame_id)  # Load image for the specified camera and frame
+    print(f"{Image_type}.shape: {image.shape}")  # (2048, 2448, 3) / (2048, 2448)
+    images = rd.get_img(cameras[0], Image_type, disable_tqdm=False)
+    print(f"{Image_type} {images.shape}, {images.dtype}")
+    images = rd.get_img(Camera_id, Image_type, [0, 1], scale=4)
+    print(f"{Image_type} 1/4 {images.shape}")
 
     # camera
-    cameras = rd.get_Calibration_all()
-    print(f"all_calib 30 RT: {cameras['30']['RT']}")
-    camera = rd.get_Calibration(15)
-    print(" split_calib ", camera)
+    if rd.__has__("", "Calibration"):
+        cameras = rd.get_Calibration_all()
+        print(f"all_calib {Camera_id} RT: {cameras[Camera_id]['RT']}")
+        camera = rd.get_Calibration(Camera_id)
+        print(" split_calib ", camera)
 
     # audio
-    if "_s" in actor_part:
+    if "s" in part and rd.__has__("Camera/00", "audio"):
         audio = rd.get_audio()
         print("audio", audio["audio"].shape, "sample_rate", np.array(audio["sample_rate"]))
-        sr = int(np.array(audio["sample_rate"]))
-        arr = np.array(audio["audio"])
-        rd.writemp3(f="./test.mp3", sr=sr, x=arr, normalized=True)
 
     # landmark
-    lmk2d = rd.get_Keypoints2d("25", 4)
-    print("kepoint2d", lmk2d.shape)
-    lmk2ds = rd.get_Keypoints2d("26", [1, 2, 3, 4, 5])
-    print(f"lmk2ds.shape: {lmk2ds.shape}")
-    lmk3d = rd.get_Keypoints3d(4)
-    print(f"kepoint3d shape: {lmk3d.shape}")
-    lmk3d = rd.get_Keypoints3d([1, 2, 3, 4, 5])
-    print(f"kepoint3d shape: {lmk3d.shape}")
+    if rd.__has__("", "Keypoints2d"):
+        lmk_cameras = sorted(rd.__keys__("Keypoints2d")[0], key=int)
+        if lmk_cameras:
+            lmk2ds = rd.get_Keypoints2d(lmk_cameras[0], [0, 1])
+            print(f"lmk2ds.shape: {lmk2ds.shape}")
+        lmk3d = rd.get_Keypoints3d([0, 1])
+        print(f"kepoint3d shape: {lmk3d.shape}")
 
     # flame
-    if "_e" in actor_part:
-        flame = rd.get_FLAME(56)
+    if "e" in part and rd.__has__("", "FLAME"):
+        flame = rd.get_FLAME(Frame_id)
         print(f"keys: {flame.keys()}")
-        print(f"global_pose: {flame['global_pose'].shape}")
-        print(f"neck_pose: {flame['neck_pose'].shape}")
-        print(f"jaw_pose: {flame['jaw_pose'].shape}")
-        print(f"left_eye_pose: {flame['left_eye_pose'].shape}")
-        print(f"right_eye_pose: {flame['right_eye_pose'].shape}")
-        print(f"trans: {flame['trans'].shape}")
-        print(f"shape: {flame['shape'].shape}")
         print(f"exp: {flame['exp'].shape}")
         print(f"verts: {flame['verts'].shape}")
-        print(f"albedos: {flame['albedos'].shape}")
-        flame = rd.get_FLAME()
-        print(f"keys: {flame.keys()}")
+        flame = rd.get_FLAME(list(range(2)))
+        print(f"verts batch: {flame['verts'].shape}")
 
     # uv texture
-    if "_e" in actor_part:
+    if "e" in part and rd.__has__("", "UV_texture"):
         uv = rd.get_uv(Frame_id)
         print(f"uv shape: {uv.shape}")
         uv = rd.get_uv()
         print(f"uv shape: {uv.shape}")
 
     # scan mesh
-    if "_e" in actor_part:
+    if "e" in part and rd.__has__("", "Scan"):
         scan = rd.get_scanmesh()
         print(f"keys: {scan.keys()}")
         print(f"vertex: {scan['vertex'].shape}")
         print(f"vertex_indices: {scan['vertex_indices'].shape}")
-        rd.write_ply(scan, "./test_scan.ply")
 
     # scan mask
-    if "_e" in actor_part:
-        scanmask = rd.get_scanmask("03")
+    if "e" in part and rd.__has__("", "ScanMask"):
+        scanmask = rd.get_scanmask(Camera_id)
         print(f"scanmask.shape: {scanmask.shape}")
         scanmask = rd.get_scanmask()
         print(f"scanmask.shape all: {scanmask.shape}")
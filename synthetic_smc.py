@@ -0,0 +1,175 @@
+"""Small synthetic .smc files with the schema of RenderMe360, for benchmarks and offline checks.
+
+Files are laid out like the dataset, so data_root works with unfold_data.py, scheduler.py and tensor_store.py:
+    <data_root>/raw/<actor_id>/<actor_id>_<part>_raw.smc
+    <data_root>/anno/<actor_id>/<actor_id>_<part>_anno.smc
+
+Expression parts ('e_*') hold FLAME, UV_texture, Scan and ScanMask, speech parts ('s_*') hold audio.
+
+Usage:
+    python synthetic_smc.py /tmp/renderme_synthetic [--parts e_0 s_1] [--num_cameras 24] [--num_frames 20]
+"""
+
+import argparse
+import os
+
+import cv2
+import h5py
+import numpy as np
+
+from utils import directory
+
+ACTOR_ATTRS = dict(capture_date="20230101", age=25, color="yellow", gender="female", height=170, weight=60)
+# cameras with 2d landmarks in the real data
+LMK2D_CAMERAS = range(18, 33)
+NUM_LMK2D = 106
+NUM_LMK3D = 73
+NUM_FLAME_VERTS = 5023
+FLAME_PARAMS = dict(
+    global_pose=(3,),
+    neck_pose=(3,),
+    jaw_pose=(3,),
+    left_eye_pose=(3,),
+    right_eye_pose=(3,),
+    trans=(3,),
+    shape=(100,),
+    exp=(50,),
+    verts=(NUM_FLAME_VERTS, 3),
+    albedos=(3, 8, 8),
+)
+
+
+def _encode(img):
+    return cv2.imencode(".png", img)[1].ravel()
+
+
+def _mask(h, w, f_id, c_id):
+    """Foreground ellipse drifting with the frame and camera."""
+    mask = np.zeros((h, w), dtype=np.uint8)
+    center = (w // 2 + (f_id + 3 * c_id) % (w // 8 + 1), h // 2)
+    cv2.ellipse(mask, center, (w // 4, h // 3), 0, 0, 360, 255, -1)
+    return mask
+
+
+def _color(h, w, rng):
+    """Smooth gradient plus noise, so png sizes are closer to real photos than pure noise or flat color."""
+    y, x = np.mgrid[0:h, 0:w]
+    base = np.stack([x * 255 // max(w - 1, 1), y * 255 // max(h - 1, 1), (x + y) * 255 // max(h + w - 2, 1)], -1)
+    return np.clip(base + rng.integers(-8, 9, (h, w, 3)), 0, 255).astype(np.uint8)
+
+
+def _write_attrs(smc, actor_id, part):
+    smc.attrs["actor_id"] = actor_id
+    smc.attrs["performance_part"] = part
+    for k, v in ACTOR_ATTRS.items():
+        smc.attrs[k] = v
+
+
+def _write_camera_group(smc, num_cameras, num_frames, h, w):
+    group = smc.create_group("Camera")
+    group.attrs["num_device"] = num_cameras
+    group.attrs["num_frame"] = num_frames
+    group.attrs["resolution"] = np.array([h, w])
+    return group
+
+
+def make_raw(path, actor_id, part, num_cameras, num_frames, h, w, seed=0):
+    rng = np.random.default_rng(seed)
+    with h5py.File(path, "w") as smc:
+        _write_attrs(smc, actor_id, part)
+        camera = _write_camera_group(smc, num_cameras, num_frames, h, w)
+        for c_id in range(num_cameras):
+            color = camera.create_group("{:02}/color".format(c_id))
+            for f_id in range(num_frames):
+                color.create_dataset(str(f_id), data=_encode(_color(h, w, rng)))
+        if part.startswith("s"):
+            sample_rate = 48000
+            audio = camera.create_group("00/audio")
+            n_samples = sample_rate * num_frames // 30
+            audio.create_dataset("audio", data=(rng.random((n_samples, 2)) - 0.5).astype(np.float32))
+            audio.create_dataset("sample_rate", data=sample_rate)
+
+
+def make_anno(path, actor_id, part, num_cameras, num_frames, h, w, seed=0, uv_size=256):
+    rng = np.random.default_rng(seed + 1)
+    with h5py.File(path, "w") as smc:
+        _write_attrs(smc, actor_id, part)
+        camera = _write_camera_group(smc, num_cameras, num_frames, h, w)
+        calibration = smc.create_group("Calibration")
+        for c_id in range(num_cameras):
+            mask = camera.create_group("{:02}/mask".format(c_id))
+            for f_id in range(num_frames):
+                mask.create_dataset(str(f_id), data=_encode(_mask(h, w, f_id, c_id)))
+            calib = calibration.create_group("{:02}".format(c_id))
+            calib["D"] = rng.normal(0, 0.01, 5)
+            calib["K"] = np.array([[2 * w, 0, w / 2], [0, 2 * w, h / 2], [0, 0, 1]], dtype=np.float64)
+            calib["RT"] = np.eye(4)
+
+        # not every camera/frame has landmarks, like the real data
+        lmk2d = smc.create_group("Keypoints2d")
+        lmk2d.attrs["num_frame"] = num_frames
+        for c_id in [c_id for c_id in LMK2D_CAMERAS if c_id < num_cameras]:
+            group = lmk2d.create_group("{:02}".format(c_id))
+            for f_id in range(num_frames - 1):
+                group[str(f_id)] = rng.random((NUM_LMK2D, 2)) * [w, h]
+        lmk3d = smc.create_group("Keypoints3d")
+        lmk3d.attrs["num_frame"] = num_frames
+        for f_id in range(num_frames):
+            if f_id % 7 != 2:
+                lmk3d[str(f_id)] = rng.random((NUM_LMK3D, 3))
+
+        if part.startswith("e"):
+            flame = smc.create_group("FLAME")
+            flame.attrs["num_frame"] = num_frames
+            for f_id in range(num_frames):
+                group = flame.create_group(str(f_id))
+                for k, shape in FLAME_PARAMS.items():
+                    group[k] = rng.random(shape).astype(np.float32)
+            uv = smc.create_group("UV_texture")
+            for f_id in range(num_frames):
+                uv.create_dataset(str(f_id), data=_encode(_color(uv_size, uv_size, rng)))
+            scan = smc.create_group("Scan")
+            n_verts = 2000
+            scan["vertex"] = rng.random((n_verts, 3)).astype(np.float32)
+            scan["vertex_indices"] = rng.integers(0, n_verts, (2 * n_verts, 3)).astype(np.int32)
+            scanmask = smc.create_group("ScanMask")
+            for c_id in range(num_cameras):
+                scanmask.create_dataset("{:02}".format(c_id), data=_encode(_mask(h, w, 0, c_id)))
+
+
+def make_dataset(
+    data_root, actor_id="0026", parts=("e_0", "s_1"), num_cameras=24, num_frames=20, height=256, width=306, seed=0
+):
+    """Write a raw/anno pair of every part under data_root.
+
+    Returns:
+        list of (raw_file, anno_file)
+    """
+    pairs = []
+    for i, part in enumerate(parts):
+        files = []
+        for kind, make in [("raw", make_raw), ("anno", make_anno)]:
+            directory(os.path.join(data_root, kind, actor_id))
+            path = os.path.join(data_root, kind, actor_id, f"{actor_id}_{part}_{kind}.smc")
+            make(path, actor_id, part, num_cameras, num_frames, height, width, seed=seed + i)
+            files.append(path)
+        pairs.append(tuple(files))
+    return pairs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic RenderMe360 .smc files.")
+    parser.add_argument("data_root", help="output root, laid out like the dataset")
+    parser.add_argument("--actor_id", default="0026")
+    parser.add_argument("--parts", nargs="+", default=["e_0", "s_1"], help="performance parts, e.g. e_0 s_1")
+    parser.add_argument("--num_cameras", type=int, default=24)
+    parser.add_argument("--num_frames", type=int, default=20)
+    parser.add_argument("--height", type=int, default=256)
+    parser.add_argument("--width", type=int, default=306)
+    args = parser.parse_args()
+    pairs = make_dataset(
+        args.data_root, args.actor_id, args.parts, args.num_cameras, args.num_frames, args.height, args.width
+    )
+    for raw_file, anno_file in pairs:
+        print(raw_file)
+        print(anno_file)
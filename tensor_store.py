@@ -0,0 +1,302 @@
+"""Training-ready tensor store of RenderMe360 sequences.
+
+`convert` turns a raw/anno .smc pair into one HDF5 file of decoded frames, chunked by (frame, camera) so that any
+frame of any camera, or any crop of it, is a single chunk read with no png decode. Every image can be stored at
+several downsampled resolutions, and chunks are lightly deflate-compressed (or not at all).
+
+Layout of a store:
+    attrs                  : actor_id, performance_part, capture_date, num_frame, cameras, resolution, source files
+    color/x<s>             : (F, C, H/s, W/s, 3) uint8 bgr, one chunk per (frame, camera)
+    mask/x<s>              : (F, C, H/s, W/s) uint8, one chunk per (frame, camera)
+    uv/x<s>                : (F, h/s, w/s, 3) uint8 bgr, one chunk per frame
+    lmk_2d, lmk_2d_valid   : (F, C, 106, 2), (F, C) bool
+    lmk_3d, lmk_3d_valid   : (F, N, 3), (F,) bool
+    calibration/<D|K|RT>   : (C, ...) in camera order
+
+Usage:
+    python tensor_store.py --data_root ROOT --actor_id 0026 [--items color mask] [--scales 1 2 4]
+"""
+
+import argparse
+import json
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import h5py
+import numpy as np
+from tqdm import tqdm
+
+from smc_index import file_key
+from smc_reader import SMCReader
+from utils import find_sequences, resize, scaled_shape
+
+STORE_VERSION = 1
+STORE_ITEMS = ["color", "mask", "uv", "lmk_2d", "lmk_3d"]
+
+
+class _ChunkWriter:
+    """Write whole chunks of (F, C, ...) datasets, deflating them on threads (zlib releases the GIL).
+
+    Chunks go to HDF5 as-is with write_direct_chunk, so the single-threaded HDF5 filter pipeline is skipped.
+    """
+
+    def __init__(self, h5, compression_level, num_threads):
+        self.h5 = h5
+        self.level = compression_level
+        self.pool = ThreadPoolExecutor(num_threads) if num_threads > 1 else None
+
+    def create(self, name, shape, chunk_ndim):
+        """Create a uint8 dataset whose chunks are its last chunk_ndim axes."""
+        chunks = (1,) * (len(shape) - chunk_ndim) + tuple(shape[-chunk_ndim:])
+        kwargs = dict(compression="gzip", compression_opts=self.level) if self.level > 0 else dict()
+        return self.h5.create_dataset(name, shape, dtype=np.uint8, chunks=chunks, **kwargs)
+
+    def _encode(self, img):
+        data = np.ascontiguousarray(img).tobytes()
+        return zlib.compress(data, self.level) if self.level > 0 else data
+
+    def write(self, chunks):
+        """Write a list of (dataset, leading index, img) chunks."""
+        imgs = [img for _, _, img in chunks]
+        encoded = map(self._encode, imgs) if self.pool is None else self.pool.map(self._encode, imgs)
+        for (dset, index, img), data in zip(chunks, encoded):
+            dset.id.write_direct_chunk(tuple(index) + (0,) * img.ndim, data)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+def convert(
+    raw_file,
+    anno_file,
+    out_file,
+    items=("color", "mask"),
+    scales=(1,),
+    compression_level=1,
+    num_frames=None,
+    num_threads=os.cpu_count(),
+):
+    """Convert a raw/anno .smc pair into a tensor store at out_file.
+
+    Args:
+        items (list of str): any of STORE_ITEMS, items the files do not hold are skipped.
+        scales (list of int): downsampling factors of the stored images, 1 is the full resolution.
+        compression_level (int): deflate level of the image chunks, 0 stores them uncompressed.
+        num_frames (int or None): only convert the first num_frames frames, all frames if None.
+        num_threads (int): threads decoding, resizing and compressing frames.
+    Returns:
+        path of the store
+    """
+    for item in items:
+        assert item in STORE_ITEMS, f"Unknown item {item}"
+    raw_reader = SMCReader(raw_file, num_threads=num_threads)
+    anno_reader = SMCReader(anno_file, num_threads=num_threads)
+    try:
+        cam_info = raw_reader.get_Camera_info()
+        n_frame = int(cam_info["num_frame"]) if num_frames is None else min(num_frames, int(cam_info["num_frame"]))
+        cameras = ["{:02}".format(i) for i in range(int(cam_info["num_device"]))]
+        img_h, img_w = (int(x) for x in cam_info["resolution"])
+        frames = list(range(n_frame))
+
+        image_sources = [(raw_reader, "color"), (anno_reader, "mask")]
+        image_sources = [(reader, it) for reader, it in image_sources if it in items]
+        if "uv" in items and anno_reader.get_uv_bytes(0) is None:
+            items = [it for it in items if it != "uv"]
+
+        # write then rename, so an interrupted conversion never leaves a partial store behind
+        h5 = h5py.File(out_file + ".tmp", "w")
+        writer = _ChunkWriter(h5, compression_level, num_threads)
+        try:
+            h5.attrs["version"] = STORE_VERSION
+            h5.attrs["actor_id"] = raw_reader.actor_id
+            h5.attrs["performance_part"] = raw_reader.performance_part
+            h5.attrs["capture_date"] = raw_reader.capture_date
+            h5.attrs["num_frame"] = n_frame
+            h5.attrs["cameras"] = json.dumps(cameras)
+            h5.attrs["resolution"] = [img_h, img_w]
+            h5.attrs["scales"] = list(scales)
+            h5.attrs["sources"] = json.dumps(dict(raw=file_key(raw_file), anno=file_key(anno_file)))
+
+            calib = anno_reader.get_Calibration_array()
+            calib_index = [list(calib["cameras"]).index(c) for c in cameras]
+            for mt in ["D", "K", "RT"]:
+                h5.create_dataset(f"calibration/{mt}", data=calib[mt][calib_index])
+
+            dsets = dict()
+            for _, it in image_sources:
+                channels = (3,) if it == "color" else ()
+                for s in scales:
+                    shape = (n_frame, len(cameras)) + scaled_shape(img_h, img_w, s) + channels
+                    dsets[it, s] = writer.create(f"{it}/x{s}", shape, len(shape) - 2)
+
+            if "uv" in items:
+                uv_shape = anno_reader.decode_img(anno_reader.get_uv_bytes(0), "color").shape
+                for s in scales:
+                    shape = (n_frame,) + scaled_shape(uv_shape[0], uv_shape[1], s) + (3,)
+                    dsets["uv", s] = writer.create(f"uv/x{s}", shape, 3)
+
+            iters = [
+                reader.iter_frames(cameras, frames, items=(it,), prefetch=2 * len(cameras), num_threads=num_threads)
+                for reader, it in image_sources
+            ]
+            for fi in tqdm(frames, desc="Convert {}".format(os.path.basename(out_file)), unit="frame"):
+                chunks = []
+                for (_, it), it_frames in zip(image_sources, iters):
+                    for ci in range(len(cameras)):
+                        img = next(it_frames).get(it)
+                        if img is None:
+                            continue
+                        chunks += [(dsets[it, s], (fi, ci), resize(img, s)) for s in scales]
+                if "uv" in items:
+                    uv_bytes = anno_reader.get_uv_bytes(fi)
+                    if uv_bytes is not None:
+                        uv = anno_reader.decode_img(uv_bytes, "color")
+                        chunks += [(dsets["uv", s], (fi,), resize(uv, s)) for s in scales]
+                writer.write(chunks)
+
+            if "lmk_2d" in items:
+                for ci, c_id in enumerate(cameras):
+                    lmk2d, valid = anno_reader.load_Keypoints2d(c_id, frames)
+                    if lmk2d is None or not valid.any():
+                        continue
+                    if "lmk_2d" not in h5:
+                        h5.create_dataset("lmk_2d", (n_frame, len(cameras)) + lmk2d.shape[1:], dtype=lmk2d.dtype)
+                        h5.create_dataset("lmk_2d_valid", (n_frame, len(cameras)), dtype=bool)
+                    h5["lmk_2d"][:, ci] = lmk2d
+                    h5["lmk_2d_valid"][:, ci] = valid
+
+            if "lmk_3d" in items:
+                lmk3d, valid = anno_reader.load_Keypoints3d(frames)
+                if lmk3d is not None:
+                    h5.create_dataset("lmk_3d", data=lmk3d)
+                    h5.create_dataset("lmk_3d_valid", data=valid)
+        finally:
+            writer.close()
+            h5.close()
+        os.replace(out_file + ".tmp", out_file)
+    finally:
+        raw_reader.close()
+        anno_reader.close()
+    return out_file
+
+
+class TensorStore:
+    def __init__(self, file_path):
+        """Read a tensor store written by convert().
+
+        Every get_* call reads one chunk per (frame, camera), crops included.
+        """
+        self.file_path = file_path
+        self.h5 = h5py.File(file_path, "r")
+        self.actor_id = self.h5.attrs["actor_id"]
+        self.performance_part = self.h5.attrs["performance_part"]
+        self.capture_date = self.h5.attrs["capture_date"]
+        self.num_frame = int(self.h5.attrs["num_frame"])
+        self.cameras = json.loads(self.h5.attrs["cameras"])
+        self.resolution = np.asarray(self.h5.attrs["resolution"])
+        self.__camera_index__ = {c_id: ci for ci, c_id in enumerate(self.cameras)}
+
+    def __camera__(self, Camera_id):
+        Camera_id = "{:02}".format(Camera_id) if isinstance(Camera_id, int) else str(Camera_id)
+        assert Camera_id in self.__camera_index__, f"Invalid Camera_id {Camera_id}"
+        return self.__camera_index__[Camera_id]
+
+    def __frame__(self, Frame_id):
+        Frame_id = int(Frame_id)
+        assert 0 <= Frame_id < self.num_frame, f"Invalid Frame_id {Frame_id}"
+        return Frame_id
+
+    def __dataset__(self, item, scale):
+        assert f"{item}/x{scale}" in self.h5, f"No {item} at scale 1/{scale} in {self.file_path}"
+        return self.h5[f"{item}/x{scale}"]
+
+    @staticmethod
+    def __crop__(index, roi):
+        """Append the rows/cols slices of roi (x, y, w, h) to index."""
+        if roi is None:
+            return index
+        x, y, w, h = roi
+        return index + (slice(y, y + h), slice(x, x + w))
+
+    def get_scales(self, Image_type):
+        """Downsampling factors stored for Image_type ('color', 'mask' or 'uv')."""
+        if Image_type not in self.h5:
+            return []
+        return sorted(int(k[1:]) for k in self.h5[Image_type].keys())
+
+    def get_img(self, Camera_id, Image_type, Frame_id, scale=1, roi=None):
+        """Get an image, or a crop of it, of one camera and frame.
+
+        Args:
+            Camera_id (int/str): CameraID in {'00'...'59'}
+            Image_type (str): 'color' or 'mask'
+            Frame_id (int/str): frame id
+            scale (int): one of get_scales(Image_type), 1 is the full resolution
+            roi (tuple, optional): crop (x, y, w, h) in the pixels of that scale
+        Returns:
+            color: HWC in bgr (uint8), mask: HW (uint8)
+        """
+        dset = self.__dataset__(Image_type, scale)
+        return dset[self.__crop__((self.__frame__(Frame_id), self.__camera__(Camera_id)), roi)]
+
+    def get_uv(self, Frame_id, scale=1, roi=None):
+        """Get the uv map, or a crop of it, of one frame: HWC in bgr (uint8)."""
+        dset = self.__dataset__("uv", scale)
+        return dset[self.__crop__((self.__frame__(Frame_id),), roi)]
+
+    def get_Keypoints2d(self, Camera_id, Frame_id):
+        """Get keypoint2D (106, 2) of one camera and frame, None if there is no detection."""
+        if "lmk_2d" not in self.h5:
+            return None
+        index = (self.__frame__(Frame_id), self.__camera__(Camera_id))
+        if not self.h5["lmk_2d_valid"][index]:
+            return None
+        return self.h5["lmk_2d"][index]
+
+    def get_Keypoints3d(self, Frame_id):
+        """Get keypoint3D (N, 3) of one frame, None if there is no data."""
+        if "lmk_3d" not in self.h5:
+            return None
+        Frame_id = self.__frame__(Frame_id)
+        if not self.h5["lmk_3d_valid"][Frame_id]:
+            return None
+        return self.h5["lmk_3d"][Frame_id]
+
+    def get_Calibration(self, Camera_id):
+        """Get calibration matrixs of a camera: dict of 'D', 'K', 'RT'."""
+        ci = self.__camera__(Camera_id)
+        return {mt: self.h5["calibration"][mt][ci] for mt in ["D", "K", "RT"]}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Convert RenderMe360 .smc files of one actor into tensor stores.")
+    parser.add_argument("--data_root", required=True, help="root path of your RenderMe360 data")
+    parser.add_argument("--actor_id", required=True, help="the actor index which you want to convert")
+    parser.add_argument("--out_dir", default=None, help="defaults to <data_root>/tensor_store/<actor_id>")
+    parser.add_argument("--items", nargs="+", default=["color", "mask"], choices=STORE_ITEMS)
+    parser.add_argument("--scales", nargs="+", type=int, default=[1], help="downsampling factors, e.g. 1 2 4")
+    parser.add_argument("--compression_level", type=int, default=1, help="deflate level 0-9, 0 to store raw")
+    parser.add_argument("--skip_seq", nargs="*", default=[], help="skip some sequences")
+    parser.add_argument("--num_frames", type=int, default=None, help="only convert the first N frames")
+    parser.add_argument("--num_threads", type=int, default=os.cpu_count())
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    out_dir = args.out_dir or os.path.join(args.data_root, "tensor_store", args.actor_id)
+    os.makedirs(out_dir, exist_ok=True)
+    for seq in find_sequences(args.data_root, args.actor_id, args.skip_seq):
+        print("Processing seq '{}' ... ".format(seq))
+        convert(
+            os.path.join(args.data_root, "raw", args.actor_id, f"{args.actor_id}_{seq}_raw.smc"),
+            os.path.join(args.data_root, "anno", args.actor_id, f"{args.actor_id}_{seq}_anno.smc"),
+            os.path.join(out_dir, f"{seq}.h5"),
+            items=args.items,
+            scales=args.scales,
+            compression_level=args.compression_level,
+            num_frames=args.num_frames,
+            num_threads=args.num_threads,
+        )
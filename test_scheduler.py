@@ -0,0 +1,86 @@
+"""Lock-file takeover of scheduler.ShardQueue, on a plan of synthetic .smc files.
+
+Usage:
+    python -m pytest test_scheduler.py
+"""
+
+import json
+import multiprocessing
+import os
+import time
+
+from scheduler import Heartbeat, ShardQueue
+from synthetic_smc import make_dataset
+
+LOCK_TIMEOUT = 60
+
+
+def make_queue(tmp_path):
+    """A plan of a single shard whose lock was left behind by a dead worker, older than LOCK_TIMEOUT."""
+    data_root = str(tmp_path / "data")
+    make_dataset(data_root, parts=("e_0",), num_cameras=1, num_frames=1, height=16, width=16)
+    queue = ShardQueue.create(str(tmp_path / "queue"), data_root, ["image"], 1)
+    lock = queue._path(0, ".lock")
+    with open(lock, "w") as fp:
+        json.dump(dict(host="dead", pid=0, time=0), fp)
+    old = time.time() - 10 * LOCK_TIMEOUT
+    os.utime(lock, (old, old))
+    return queue
+
+
+def _claim_and_finish(queue_dir, barrier, results):
+    queue = ShardQueue(queue_dir)
+    barrier.wait()
+    shard_id = queue.claim(LOCK_TIMEOUT)
+    # both workers have claimed before either checks its lock
+    barrier.wait()
+    owns = shard_id is not None and queue.owns(shard_id)
+    finished = queue.finish(0, dict(pid=os.getpid()))
+    results.put((os.getpid(), shard_id, owns, finished))
+
+
+def test_concurrent_takeover(tmp_path):
+    queue = make_queue(tmp_path)
+    ctx = multiprocessing.get_context("fork")
+    barrier, results = ctx.Barrier(2), ctx.Queue()
+    workers = [ctx.Process(target=_claim_and_finish, args=(queue.queue_dir, barrier, results)) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    rs = [results.get(timeout=60) for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    winners = [r for r in rs if r[1] == 0]
+    losers = [r for r in rs if r[1] != 0]
+    assert len(winners) == 1 and len(losers) == 1
+    assert winners[0][2] and winners[0][3]
+    assert losers[0][1] is None and not losers[0][2] and not losers[0][3]
+    with open(queue._path(0, ".done"), "r") as fp:
+        assert json.load(fp) == dict(pid=winners[0][0])
+    # the stale lock of the dead worker is gone, only the lock of the winner is left
+    assert sorted(os.listdir(queue.queue_dir)) == ["plan.json", "shard_00000.done", "shard_00000.lock"]
+
+
+def test_takeover_of_a_stalled_worker(tmp_path):
+    make_queue(tmp_path)
+    queue_dir = str(tmp_path / "queue")
+    stalled, other = ShardQueue(queue_dir), ShardQueue(queue_dir)
+    assert stalled.claim(LOCK_TIMEOUT) == 0
+    assert other.claim(LOCK_TIMEOUT) is None
+
+    # the worker stalls: its lock goes stale and is taken over
+    old = time.time() - 10 * LOCK_TIMEOUT
+    os.utime(stalled._path(0, ".lock"), (old, old))
+    assert other.claim(LOCK_TIMEOUT) == 0
+    assert other.owns(0) and not stalled.owns(0)
+
+    beat = Heartbeat(stalled, 0, 0.01)
+    beat.start()
+    beat.join(timeout=10)
+    assert beat.lost
+    assert not stalled.finish(0, dict(worker="stalled"))
+    assert not os.path.exists(stalled._path(0, ".done"))
+    assert other.finish(0, dict(worker="other"))
+    with open(other._path(0, ".done"), "r") as fp:
+        assert json.load(fp) == dict(worker="other")
+    assert not [name for name in os.listdir(queue_dir) if ".stale." in name]
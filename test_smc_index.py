@@ -0,0 +1,21 @@
+"""Index sidecars of smc_index.py next to synthetic .smc files.
+
+Usage:
+    python -m pytest test_smc_index.py
+"""
+
+import os
+
+from smc_index import build_index, index_path
+from synthetic_smc import make_dataset
+from utils import find_sequences
+
+
+def test_find_sequences_ignores_index_sidecars(tmp_path):
+    data_root = str(tmp_path)
+    pairs = make_dataset(data_root, parts=("e_0", "s_1"), num_cameras=1, num_frames=1, height=16, width=16)
+    for raw_file, anno_file in pairs:
+        build_index(anno_file)
+        assert os.path.exists(index_path(anno_file))
+    assert find_sequences(data_root, "0026") == ["e_0", "s_1"]
+    assert find_sequences(data_root, "0026", skip_seq=["s_1"]) == ["e_0"]
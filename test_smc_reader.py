@@ -0,0 +1,79 @@
+"""Camera selection and roi windows of SMCReader, on a synthetic anno file.
+
+Usage:
+    python -m pytest test_smc_reader.py
+"""
+
+import cv2
+import h5py
+import numpy as np
+import pytest
+
+from smc_reader import SMCReader
+from synthetic_smc import make_dataset
+
+H, W = 48, 64
+# the only camera with 2d landmarks among the first 19, see synthetic_smc.LMK2D_CAMERAS
+LMK2D_CAMERA = "18"
+
+
+@pytest.fixture
+def anno_reader(tmp_path):
+    """Anno file of 19 cameras x 2 frames. Camera 18: at frame 0 a mask in the top right corner and landmarks in
+    the box (10, 20, 20, 30), at frame 1 an empty mask and no landmarks."""
+    ((_, anno_file),) = make_dataset(str(tmp_path), parts=("e_0",), num_cameras=19, num_frames=2, height=H, width=W)
+    corner = np.zeros((H, W), dtype=np.uint8)
+    corner[0:10, 56:64] = 255
+    with h5py.File(anno_file, "a") as smc:
+        masks = smc[f"Camera/{LMK2D_CAMERA}/mask"]
+        for f_id, mask in [("0", corner), ("1", np.zeros((H, W), dtype=np.uint8))]:
+            del masks[f_id]
+            masks.create_dataset(f_id, data=cv2.imencode(".png", mask)[1].ravel())
+        lmk2d = smc[f"Keypoints2d/{LMK2D_CAMERA}"]
+        points = np.linspace([10, 20], [20, 30], len(lmk2d["0"]))
+        del lmk2d["0"]
+        lmk2d["0"] = points
+        assert "1" not in lmk2d
+    rd = SMCReader(anno_file)
+    yield rd
+    rd.close()
+
+
+def test_select_cameras(anno_reader):
+    assert anno_reader.select_cameras() == ["{:02}".format(i) for i in range(19)]
+    assert anno_reader.select_cameras("lmk2d") == [LMK2D_CAMERA]
+    assert anno_reader.select_cameras("0-4:2,lmk2d") == ["00", "02", "04", LMK2D_CAMERA]
+    assert anno_reader.select_cameras("15-") == ["15", "16", "17", "18"]
+
+
+def test_fixed_roi(anno_reader):
+    assert anno_reader.get_roi(LMK2D_CAMERA, 0, None) is None
+    assert anno_reader.get_roi(LMK2D_CAMERA, 0, [2, 3, 10, 12]) == (2, 3, 10, 12)
+    assert anno_reader.get_roi(LMK2D_CAMERA, 0, [0, 0, W, H]) == (0, 0, W, H)
+    for roi in [[60, 0, 8, 8], [0, 44, 8, 8], [0, 0, 0, 8]]:
+        with pytest.raises(AssertionError):
+            anno_reader.get_roi(LMK2D_CAMERA, 0, roi)
+
+
+def test_mask_roi(anno_reader):
+    # centered on (60, 5), shifted left and down to fit in the image
+    assert anno_reader.get_roi(LMK2D_CAMERA, 0, "mask", (16, 16)) == (W - 16, 0, 16, 16)
+    # an empty mask falls back to the center of the image
+    assert anno_reader.get_roi(LMK2D_CAMERA, 1, "mask", (16, 16)) == ((W - 16) // 2, (H - 16) // 2, 16, 16)
+    # the window as large as the image
+    assert anno_reader.get_roi(LMK2D_CAMERA, 0, "mask", (W, H)) == (0, 0, W, H)
+    with pytest.raises(AssertionError):
+        anno_reader.get_roi(LMK2D_CAMERA, 0, "mask")
+    with pytest.raises(AssertionError):
+        anno_reader.get_roi(LMK2D_CAMERA, 0, "mask", (W + 1, 16))
+
+
+def test_lmk2d_roi(anno_reader):
+    # centered on (15, 25)
+    assert anno_reader.get_roi(LMK2D_CAMERA, 0, "lmk2d", (16, 16)) == (7, 17, 16, 16)
+    # shifted right to fit in the image
+    assert anno_reader.get_roi(LMK2D_CAMERA, 0, "lmk2d", (40, 16)) == (0, 17, 40, 16)
+    # frames without landmarks fall back to the center of the image
+    assert anno_reader.get_roi(LMK2D_CAMERA, 1, "lmk2d", (16, 16)) == ((W - 16) // 2, (H - 16) // 2, 16, 16)
+    # at 1/2 resolution, landmarks are scaled to (5, 10, 10, 15)
+    assert anno_reader.get_roi(LMK2D_CAMERA, 0, "lmk2d", (8, 8), scale=2) == (4, 8, 8, 8)
@@ -0,0 +1,127 @@
+"""Resumable unfolds of unfold_data.unfold_sequence and its UnfoldJournal, on synthetic .smc files.
+
+Usage:
+    python -m pytest test_unfold_data.py
+"""
+
+import os
+import time
+import wave
+
+from synthetic_smc import make_dataset
+from unfold_data import UnfoldJournal, unfold_sequence
+
+ITEMS = ["image", "mask"]
+
+
+def make_sequence(tmp_path, part="e_0"):
+    (pair,) = make_dataset(str(tmp_path / "data"), parts=(part,), num_cameras=2, num_frames=3, height=16, width=16)
+    return pair, str(tmp_path / "out")
+
+
+def unfold(pair, out_dir, items=ITEMS, **kwargs):
+    n_done, _ = unfold_sequence(*pair, out_dir, items, write_threads=0, **kwargs)
+    return n_done
+
+
+def age_outputs(out_dir):
+    """Set the mtime of every output in the past, to tell the rewritten ones apart."""
+    old = time.time() - 3600
+    for folder in ["images", "masks", "audios"]:
+        if os.path.isdir(os.path.join(out_dir, folder)):
+            for name in os.listdir(os.path.join(out_dir, folder)):
+                os.utime(os.path.join(out_dir, folder, name), (old, old))
+    return old
+
+
+def rewritten(out_dir, folder, old):
+    return sorted(
+        name
+        for name in os.listdir(os.path.join(out_dir, folder))
+        if os.path.getmtime(os.path.join(out_dir, folder, name)) > old + 1
+    )
+
+
+def test_resume_skips_done_outputs(tmp_path):
+    pair, out_dir = make_sequence(tmp_path)
+    assert unfold(pair, out_dir) == 6
+    old = age_outputs(out_dir)
+    assert unfold(pair, out_dir) == 0
+    assert rewritten(out_dir, "images", old) == [] and rewritten(out_dir, "masks", old) == []
+
+
+def test_torn_journal_line_is_ignored(tmp_path):
+    pair, out_dir = make_sequence(tmp_path)
+    unfold(pair, out_dir)
+    with open(os.path.join(out_dir, UnfoldJournal.FILENAME), "a") as fp:
+        fp.write('["mask", 2, 1, 12')
+    assert unfold(pair, out_dir) == 0
+
+
+def test_deleted_or_truncated_output_is_redone(tmp_path):
+    pair, out_dir = make_sequence(tmp_path)
+    unfold(pair, out_dir, frames_per_shard=1)
+    old = age_outputs(out_dir)
+    os.remove(os.path.join(out_dir, "masks", "00001_00.png"))
+    with open(os.path.join(out_dir, "images", "00002_01.png"), "r+b") as fp:
+        fp.truncate(10)
+    # one shard per (frame, camera): only the two shards of the broken outputs run again
+    assert unfold(pair, out_dir, frames_per_shard=1) == 2
+    assert rewritten(out_dir, "masks", old) == ["00001_00.png"]
+    assert rewritten(out_dir, "images", old) == ["00002_01.png"]
+
+
+def test_checksum_detects_corrupted_output(tmp_path):
+    pair, out_dir = make_sequence(tmp_path)
+    unfold(pair, out_dir, checksum=True)
+    path = os.path.join(out_dir, "images", "00000_00.png")
+    with open(path, "r+b") as fp:
+        fp.seek(os.path.getsize(path) - 1)
+        fp.write(b"\xff" if fp.read(1) != b"\xff" else b"\x00")
+    old = age_outputs(out_dir)
+    unfold(pair, out_dir, checksum=True)
+    assert rewritten(out_dir, "images", old) == ["00000_00.png"]
+
+
+def test_changed_anno_file_redoes_anno_items_only(tmp_path):
+    pair, out_dir = make_sequence(tmp_path)
+    unfold(pair, out_dir)
+    old = age_outputs(out_dir)
+    os.utime(pair[1], (time.time() + 10, time.time() + 10))
+    assert unfold(pair, out_dir) == 6
+    assert rewritten(out_dir, "images", old) == []
+    assert len(rewritten(out_dir, "masks", old)) == 6
+
+
+def test_restart_discards_the_journal(tmp_path):
+    pair, out_dir = make_sequence(tmp_path)
+    unfold(pair, out_dir)
+    old = age_outputs(out_dir)
+    assert unfold(pair, out_dir, restart=True) == 6
+    assert len(rewritten(out_dir, "images", old)) == 6 and len(rewritten(out_dir, "masks", old)) == 6
+
+
+def test_changed_roi_redoes_everything(tmp_path):
+    pair, out_dir = make_sequence(tmp_path)
+    unfold(pair, out_dir, roi=[0, 0, 8, 8])
+    assert unfold(pair, out_dir, roi=[0, 0, 8, 8]) == 0
+    assert unfold(pair, out_dir, roi=[4, 4, 8, 8]) == 6
+
+
+def test_audio_follows_the_frame_range(tmp_path):
+    pair, out_dir = make_sequence(tmp_path, part="s_1")
+    path = os.path.join(out_dir, "audios", "audio.wav")
+
+    def num_samples():
+        with wave.open(path, "rb") as wav:
+            return wav.getnframes()
+
+    unfold(pair, out_dir, items=["audio"], num_frames=1)
+    one_frame = num_samples()
+    assert one_frame > 0
+    unfold(pair, out_dir, items=["audio"], num_frames=3)
+    assert num_samples() == 3 * one_frame
+    old = age_outputs(out_dir)
+    unfold(pair, out_dir, items=["audio"], frames="1-2")
+    assert num_samples() == 2 * one_frame
+    assert rewritten(out_dir, "audios", old) == ["audio.wav"]
@@ -0,0 +1,59 @@
+"""Selection expressions of utils.parse_selection.
+
+Usage:
+    python -m pytest test_utils.py
+"""
+
+import pytest
+
+from utils import parse_selection
+
+LMK2D = [32, 18, 25]
+
+
+@pytest.mark.parametrize(
+    "expr, n, expected",
+    [
+        (None, 4, [0, 1, 2, 3]),
+        ("all", 5, [0, 1, 2, 3, 4]),
+        ("7", 60, [7]),
+        ("0", 1, [0]),
+        ("59", 60, [59]),
+        ("18-32", 60, list(range(18, 33))),
+        ("5-5", 60, [5]),
+        ("100-", 120, list(range(100, 120))),
+        ("0-59:2", 60, list(range(0, 60, 2))),
+        ("1-10:3", 60, [1, 4, 7, 10]),
+        ("10-:3", 20, [10, 13, 16, 19]),
+        ("all:5", 20, [0, 5, 10, 15]),
+        ("7:4", 60, [7]),
+        ("0-2,1-3", 60, [0, 1, 2, 3]),
+        ("40-, 0-1", 42, [0, 1, 40, 41]),
+        ("lmk2d", 60, [18, 25, 32]),
+        ("lmk2d:2", 60, [18, 32]),
+        ("lmk2d,0", 60, [0, 18, 25, 32]),
+    ],
+)
+def test_parse_selection(expr, n, expected):
+    assert parse_selection(expr, n, named=dict(lmk2d=LMK2D)) == expected
+
+
+@pytest.mark.parametrize(
+    "expr, n",
+    [
+        ("60", 60),
+        ("0-60", 60),
+        ("5-3", 60),
+        ("60-", 60),
+        ("0-59:0", 60),
+        ("all:-1", 60),
+        ("all:x", 60),
+        ("-3", 60),
+        ("1-2-3", 60),
+        ("x", 60),
+        ("lmk2d", 60),
+    ],
+)
+def test_parse_selection_rejects(expr, n):
+    with pytest.raises(AssertionError):
+        parse_selection(expr, n)
@@ -1,13 +1,31 @@
+import argparse
 import json
 import os
-import re
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from multiprocessing import Pool
 
 import cv2
 import numpy as np
 from tqdm import tqdm
 
+from profiler import PROFILER, Profiler, format_report, save_report
+from smc_index import file_key
 from smc_reader import SMCReader
-from utils import ITEM2EXT, ITEM2FORLDER, directory, write_ply
+from utils import (
+    ITEM2EXT,
+    ITEM2FORLDER,
+    can_passthrough,
+    crop,
+    directory,
+    find_sequences,
+    scaled_shape,
+    write_bytes,
+    write_ply,
+)
 
 
 class NpEncoder(json.JSONEncoder):
@@ -21,35 +39,218 @@ class NpEncoder(json.JSONEncoder):
         return super(NpEncoder, self).default(obj)
 
 
-def save_general_data(savepath, raw_smc, anno_smc, item, f_id, c_id):
+class FrameRecord:
+    """Data of one (frame, camera) pair.
+
+    Every source (color, mask, uv, ...) is fetched and decoded at most once and then shared by
+    all the items unfolded from it, e.g. "image", "masked_image" and "mask" decode color and mask
+    only once. Sources that do not depend on the camera live in frame_cache, which can be shared
+    by the records of all the cameras of a frame. Images are fetched as encoded bytes ("color_bytes",
+    "mask_bytes", "uv_bytes") and only decoded when an item needs the pixels.
+    With scale > 1, images are decoded at 1/scale resolution and 2d landmarks are scaled to match.
+    With an roi (see SMCReader.get_roi), color and mask are cropped to its window right after decoding and 2d
+    landmarks are shifted to match; "roi" is the (x, y, w, h) window.
+    """
+
+    FRAME_KEYS = ("uv_bytes", "uv", "scan", "lmk_3d")
+
+    def __init__(self, raw_smc, anno_smc, f_id, c_id, frame_cache=None, scale=1, roi=None, roi_size=None):
+        self.raw_smc = raw_smc
+        self.anno_smc = anno_smc
+        self.f_id = f_id
+        self.c_id = c_id
+        self.scale = scale
+        self.roi = roi
+        self.roi_size = roi_size
+        self.frame_cache = dict() if frame_cache is None else frame_cache
+        self.camera_cache = dict()
+
+    def __getitem__(self, key):
+        cache = self.frame_cache if key in self.FRAME_KEYS else self.camera_cache
+        if key not in cache:
+            cache[key] = self._load(key)
+        return cache[key]
+
+    def _load(self, key):
+        if key == "color_bytes":
+            return self.raw_smc.get_img_bytes(self.c_id, "color", self.f_id)
+        elif key == "color":
+            return self.__crop__(self.raw_smc.decode_img(self["color_bytes"], "color", self.scale))
+        elif key == "mask_bytes":
+            return self.anno_smc.get_img_bytes(self.c_id, "mask", self.f_id)
+        elif key == "full_mask":
+            return self.anno_smc.decode_img(self["mask_bytes"], "mask", self.scale)
+        elif key == "mask":
+            return self.__crop__(self["full_mask"])
+        elif key == "roi":
+            mask = self["full_mask"] if self.roi == "mask" else None
+            return self.anno_smc.get_roi(self.c_id, self.f_id, self.roi, self.roi_size, self.scale, mask)
+        elif key == "uv_bytes":
+            return self.anno_smc.get_uv_bytes(self.f_id)
+        elif key == "uv":
+            uv_bytes = self["uv_bytes"]
+            return None if uv_bytes is None else self.anno_smc.decode_img(uv_bytes, "color", self.scale)
+        elif key == "scan":
+            return self.anno_smc.get_scanmesh()
+        elif key == "lmk_2d":
+            lmk2d = self.anno_smc.get_Keypoints2d(self.c_id, self.f_id)
+            if lmk2d is None or (self.scale == 1 and self.roi is None):
+                return lmk2d
+            lmk2d = lmk2d[()] / self.scale
+            return lmk2d if self.roi is None else lmk2d - np.array(self["roi"][:2])
+        elif key == "lmk_3d":
+            return self.anno_smc.get_Keypoints3d(self.f_id)
+        raise KeyError(key)
+
+    def __crop__(self, img):
+        return img if self.roi is None else np.ascontiguousarray(crop(img, self["roi"]))
+
+
+def save_encoded(savepath, img_byte, item):
+    with PROFILER.stage("write", item, len(img_byte)):
+        write_bytes(savepath, img_byte)
+
+
+def imwrite(savepath, img, item):
+    """cv2.imwrite, as an encode then a write so that both stages are profiled."""
+    with PROFILER.stage("encode", item):
+        ok, img_byte = cv2.imencode(os.path.splitext(savepath)[1], img)
+    assert ok, f"Cannot encode {savepath}"
+    save_encoded(savepath, img_byte, item)
+
+
+def save_masked_image(savepath, color, mask, item):
+    with PROFILER.stage("compose", item):
+        masked = color * (mask / 255.0)[..., None]
+    imwrite(savepath, masked, item)
+
+
+def save_array(savepath, arr, item):
+    with PROFILER.stage("write", item, arr.nbytes):
+        np.save(savepath, arr)
+
+
+def save_scan(savepath, scan, item):
+    with PROFILER.stage("write", item) as stage:
+        write_ply(scan, savepath)
+        stage.nbytes = os.path.getsize(savepath)
+
+
+def image_job(savepath, record, key, channels, passthrough, item):
+    """Job saving record[key], writing the stored bytes as-is when they already are what cv2.imwrite would produce."""
+    img_byte = record[key + "_bytes"]
+    if img_byte is None:
+        return None
+    # uv maps are never cropped
+    as_stored = record.scale == 1 and (record.roi is None or key == "uv")
+    if passthrough and as_stored and can_passthrough(img_byte, os.path.splitext(savepath)[1], channels):
+        return partial(save_encoded, savepath, img_byte, item)
+    return partial(imwrite, savepath, record[key], item)
+
+
+def output_job(savepath, record, item, passthrough=True):
+    """Fetch and decode what item needs from record, and return the job encoding and writing it to savepath,
+    or None if there is nothing to save. Jobs only hold their inputs, so they can run on another thread."""
     if item == "image":
-        image = raw_smc.get_img(c_id, "color", f_id)
-        cv2.imwrite(savepath, image)
+        return image_job(savepath, record, "color", 3, passthrough, item)
     elif item == "masked_image":
-        image = raw_smc.get_img(c_id, "color", f_id)
-        mask = anno_smc.get_img(c_id, "mask", f_id)
-        cv2.imwrite(savepath, image * (mask / 255.0)[..., None])
+        return partial(save_masked_image, savepath, record["color"], record["mask"], item)
     elif item == "mask":
-        mask = anno_smc.get_img(c_id, "mask", f_id)
-        cv2.imwrite(savepath, mask)
+        return image_job(savepath, record, "mask", 1, passthrough, item)
     elif item == "uv":
-        uv = anno_smc.get_uv(f_id)
-        if uv is not None:
-            cv2.imwrite(savepath, uv)
+        return image_job(savepath, record, "uv", 3, passthrough, item)
     elif item == "scan":
-        scan = anno_smc.get_scanmesh()
-        if scan is not None:
-            write_ply(scan, savepath)
+        scan = record["scan"]
+        return None if scan is None else partial(save_scan, savepath, scan, item)
     elif item == "lmk_2d":
-        lmk2d = anno_smc.get_Keypoints2d(c_id, f_id)
-        if lmk2d is not None:
-            np.save(savepath, lmk2d)
+        lmk2d = record["lmk_2d"]
+        return None if lmk2d is None else partial(save_array, savepath, lmk2d, item)
     elif item == "lmk_3d":
-        lmk3d = anno_smc.get_Keypoints3d(f_id)
-        if lmk3d is not None:
-            np.save(savepath, lmk3d)
+        lmk3d = record["lmk_3d"]
+        return None if lmk3d is None else partial(save_array, savepath, lmk3d, item)
     else:
         print("item {} has not been implemented.".format(item))
+        return None
+
+
+def save_general_data(savepath, record, item, passthrough=True, writer=None):
+    """Save item of record to savepath, now or on the background threads of writer if given."""
+    job = output_job(savepath, record, item, passthrough)
+    if job is None:
+        return
+    if writer is None:
+        job()
+    else:
+        writer.submit(savepath, job)
+
+
+def fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class WriteBehind:
+    """Encode and write outputs on background threads while the caller reads and decodes the next ones.
+
+    At most max_pending jobs are queued or running: submit() blocks when the writers fall behind, which bounds the
+    memory held by decoded images waiting to be written.
+
+    fsync policy:
+        'none'  : leave flushing to the OS (fastest, what cv2.imwrite does)
+        'file'  : fsync every file right after writing it
+        'shard' : fsync the files written since the last flush(), and their directories, in flush()
+    """
+
+    FSYNC = ["none", "file", "shard"]
+
+    def __init__(self, num_threads=2, max_pending=64, fsync="none"):
+        assert fsync in self.FSYNC, f"Invalid fsync policy {fsync}"
+        self.fsync = fsync
+        self.pool = ThreadPoolExecutor(num_threads) if num_threads > 0 else None
+        self.slots = threading.BoundedSemaphore(max(max_pending, 1))
+        self.futures = []
+        self.written = []
+
+    def _run(self, savepath, job):
+        try:
+            job()
+            if self.fsync == "file" and os.path.exists(savepath):
+                fsync_path(savepath)
+        finally:
+            if self.pool is not None:
+                self.slots.release()
+
+    def submit(self, savepath, job):
+        """Run job, which writes savepath, in the background (or right away with num_threads=0)."""
+        self.written.append(savepath)
+        if self.pool is None:
+            self._run(savepath, job)
+            return
+        self.slots.acquire()
+        self.futures.append(self.pool.submit(self._run, savepath, job))
+
+    def flush(self):
+        """Wait for every submitted job, re-raising the first error."""
+        futures, self.futures = self.futures, []
+        for future in futures:
+            future.result()
+        written, self.written = self.written, []
+        if self.fsync == "shard":
+            written = [path for path in written if os.path.exists(path)]
+            for path in written:
+                fsync_path(path)
+            for path in set(os.path.dirname(path) for path in written):
+                fsync_path(path)
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown()
 
 
 DATA_ROOT = "/path/to/RenderMe360/OpenXDLab___RenderMe-360/"
@@ -66,50 +267,250 @@ UNFOLD_LIST = [
 ]  # Choose from these items: "image", "mask", "uv", "scan", "lmk_2d", "lmk_3d", "audio"
 SKIP_SEQ = []
 
-out_dir = os.path.join(DATA_ROOT, "preprocess", ACTOR_ID)
-directory(out_dir)
+# SMCReaders of the (raw_file, anno_file) pair the current process unfolds.
+# h5py handles cannot be shared across forked processes, so every worker opens its own.
+_READERS = None
+_READERS_PID = None
 
-anno_dir = os.path.join(DATA_ROOT, "anno", ACTOR_ID)
-seqs = []
-for file in os.listdir(anno_dir):
-    if "anno" not in file:
-        continue
 
-    pattern = r"{}_(.*)_anno.smc".format(ACTOR_ID)
-    seq = re.findall(pattern, file)[0]
-    seqs.append(seq)
-seqs.sort()  # Get all sequences
+def get_readers(raw_file, anno_file):
+    """Return the SMCReaders of a raw/anno pair owned by the current process.
 
-for seq in seqs:
-    if seq in SKIP_SEQ:
-        continue
+    Only the pair of the sequence being unfolded stays open: a pool worker goes through hundreds of sequences,
+    so the readers of the previous pair (2 fds each, plus their index) are closed when the pair changes.
+    """
+    global _READERS, _READERS_PID
+    if _READERS_PID != os.getpid():
+        # handles inherited from the parent process, left to it
+        _READERS = None
+        _READERS_PID = os.getpid()
+    if _READERS is None or _READERS[0] != (raw_file, anno_file):
+        if _READERS is not None:
+            for rd in _READERS[1]:
+                rd.close()
+        _READERS = ((raw_file, anno_file), (SMCReader(raw_file), SMCReader(anno_file)))
+    return _READERS[1]
 
-    raw_file = os.path.join(DATA_ROOT, "raw", ACTOR_ID, f"{ACTOR_ID}_{seq}_raw.smc")
-    anno_file = os.path.join(DATA_ROOT, "anno", ACTOR_ID, f"{ACTOR_ID}_{seq}_anno.smc")
-    raw_reader = SMCReader(raw_file)
-    anno_reader = SMCReader(anno_file)
 
-    cam_info = raw_reader.get_Camera_info()
-    actor_info = raw_reader.get_actor_info()
-    n_frame = cam_info["num_frame"]
-    n_frame = 1  # For test: only see frame 0
-    n_cam = cam_info["num_device"]
+def close_readers():
+    """Close the readers get_readers() opened in the current process, e.g. after an unfold without a pool."""
+    global _READERS
+    if _READERS is not None and _READERS_PID == os.getpid():
+        for rd in _READERS[1]:
+            rd.close()
+    _READERS = None
+
+
+# items saved once per sequence rather than per (frame, camera), journaled as (item, first frame, stop frame) of
+# the frames they cover: a sequence has a single entry of each, replaced when the frame range changes
+SEQUENCE_ITEMS = ["audio"]
+
+
+def output_path(seq_out_dir, item, f_id, c_id):
+    if item in SEQUENCE_ITEMS:
+        return os.path.join(seq_out_dir, ITEM2FORLDER[item], item + ITEM2EXT[item])
+    return os.path.join(seq_out_dir, ITEM2FORLDER[item], "{:05}_{:02}{}".format(f_id, c_id, ITEM2EXT[item]))
+
+
+def make_output_dirs(seq_out_dir, items):
+    """Create the output folders of items at once: list seq_out_dir a single time and only create the missing
+    folders, instead of probing every folder (a round trip each on network filesystems)."""
+    os.makedirs(seq_out_dir, exist_ok=True)
+    existing = set(entry.name for entry in os.scandir(seq_out_dir) if entry.is_dir())
+    for folder in sorted(set(ITEM2FORLDER[item] for item in items) - existing):
+        os.makedirs(os.path.join(seq_out_dir, folder), exist_ok=True)
+
+
+def file_crc32(path):
+    crc = 0
+    with open(path, "rb") as fp:
+        for block in iter(lambda: fp.read(1 << 20), b""):
+            crc = zlib.crc32(block, crc)
+    return crc
+
 
-    print("Processing seq '{}' ... ".format(seq))
-    for item in UNFOLD_LIST:
-        seq_dir = os.path.join(out_dir, seq, ITEM2FORLDER[item])
-        directory(seq_dir)
+# .smc files every item is unfolded from, the others only read the anno file
+ITEM_SOURCES = {"image": ("raw",), "masked_image": ("raw", "anno"), "audio": ("raw",)}
+# items cropped to the roi, which also depend on the anno file when their window is derived from its masks or lmk2d
+ROI_ITEMS = ["image", "masked_image", "mask", "lmk_2d"]
 
-        bar = tqdm(range(n_frame * n_cam))
-        bar.set_description("Unfold {}".format(item))
 
-        for f_id in range(n_frame):
-            for c_id in range(n_cam):
-                savepath = os.path.join(seq_dir, "{:05}_{:02}{}".format(f_id, c_id, ITEM2EXT[item]))
-                save_general_data(savepath, raw_reader, anno_reader, item, f_id, "{:02}".format(c_id))
-                bar.update()
+class UnfoldJournal:
+    """Append-only journal of the completed outputs of a sequence, to resume an interrupted unfold.
+
+    The first line records the raw/anno files (path, size, mtime) the outputs were unfolded from, their scale and
+    roi. When a source file changed since, only the outputs of the items read from it are dropped and redone; when
+    the scale or roi changed, every output is. With a 'mask' or 'lmk2d' roi, the windows of the cropped items come
+    from the anno file, so a changed anno file redoes them all.
+    Every other line is one output: [item, f_id, c_id, size, crc32], size is -1 when the item had nothing to save
+    (e.g. no lmk2d in this frame), crc32 is None unless checksums are on. Sequence items (audio) are journaled as
+    [item, first frame, stop frame, size, crc32], so that they are redone when the unfolded frame range changes.
+    """
+
+    FILENAME = ".unfold_journal.jsonl"
+
+    def __init__(self, seq_out_dir, raw_file, anno_file, restart=False, scale=1, roi=None):
+        self.seq_out_dir = seq_out_dir
+        self.path = os.path.join(seq_out_dir, self.FILENAME)
+        self.sources = dict(raw=file_key(raw_file), anno=file_key(anno_file))
+        self.scale = scale
+        # as read back from json
+        self.roi = json.loads(json.dumps(roi))
+        self.entries = dict()
+        if not restart:
+            self._load()
+        # compact the journal: drop stale and duplicated lines
+        with open(self.path + ".tmp", "w") as fp:
+            fp.write(json.dumps(dict(self.sources, scale=self.scale, roi=self.roi)) + "\n")
+            for key, (size, crc) in self.entries.items():
+                fp.write(json.dumps([*key, size, crc]) + "\n")
+        os.replace(self.path + ".tmp", self.path)
+        self.fp = open(self.path, "a")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r") as fp:
+            lines = fp.read().splitlines()
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, ValueError):
+            return
+        if header.get("scale", 1) != self.scale or header.get("roi") != self.roi:
+            return
+        changed = [k for k in self.sources if header.get(k) != self.sources[k]]
+        for line in lines[1:]:
+            try:
+                item, f_id, c_id, size, crc = json.loads(line)
+            except ValueError:
+                continue  # torn last line of a crashed run
+            if any(src in changed for src in self.sources_of(item)):
+                continue
+            self._set(item, f_id, c_id, size, crc)
+
+    def sources_of(self, item):
+        """Keys of the source files ('raw', 'anno') an item is unfolded from."""
+        sources = ITEM_SOURCES.get(item, ("anno",))
+        if self.roi is not None and isinstance(self.roi[0], str) and item in ROI_ITEMS and "anno" not in sources:
+            sources = sources + ("anno",)
+        return sources
+
+    def is_done(self, item, f_id, c_id, verify=False):
+        """Whether the output is journaled and still on disk with the journaled size (and crc32 if verify)."""
+        if (item, f_id, c_id) not in self.entries:
+            return False
+        size, crc = self.entries[item, f_id, c_id]
+        path = output_path(self.seq_out_dir, item, f_id, c_id)
+        if size < 0:
+            return not os.path.exists(path)
+        if not os.path.exists(path) or os.path.getsize(path) != size:
+            return False
+        return not verify or crc is None or file_crc32(path) == crc
+
+    def _set(self, item, f_id, c_id, size, crc):
+        if item in SEQUENCE_ITEMS:
+            # the output of a previous frame range was overwritten
+            for key in [key for key in self.entries if key[0] == item]:
+                del self.entries[key]
+        self.entries[item, f_id, c_id] = (size, crc)
+
+    def append(self, entries):
+        for item, f_id, c_id, size, crc in entries:
+            self._set(item, f_id, c_id, size, crc)
+            self.fp.write(json.dumps([item, f_id, c_id, size, crc]) + "\n")
+        self.fp.flush()
+
+    def close(self):
+        self.fp.close()
+
+
+def make_shards(f_ids, c_ids, frames_per_shard, cams_per_shard):
+    """Split the grid of the selected frame and camera ids into (frame ids, camera ids) blocks."""
+    shards = []
+    for c_start in range(0, len(c_ids), cams_per_shard):
+        for f_start in range(0, len(f_ids), frames_per_shard):
+            shards.append((f_ids[f_start : f_start + frames_per_shard], c_ids[c_start : c_start + cams_per_shard]))
+    return shards
+
+
+def unfold_shard(task):
+    """Unfold every item of one block of frames and cameras. Runs inside a worker process.
+
+    Outputs (item, f_id, c_id) in skip are already done and not redone.
+
+    Returns:
+        (number of (frame, camera) pairs in the block, journal entries of the saved outputs,
+         profiler records of the block if options["profile"] else [],
+         the roi window of every "<f_id>_<c_id>" pair whose images were cropped)
+    """
+    raw_file, anno_file, seq_out_dir, items, f_ids, c_ids, options, skip = task
+    PROFILER.enable(options["profile"])
+    raw_reader, anno_reader = get_readers(raw_file, anno_file)
+    writer = WriteBehind(options["write_threads"], options["max_pending_writes"], options["fsync"])
+    done = []
+    rois = dict()
+    try:
+        for f_id in f_ids:
+            frame_cache = dict()
+            for c_id in c_ids:
+                c_name = "{:02}".format(c_id)
+                record = FrameRecord(
+                    raw_reader, anno_reader, f_id, c_name, frame_cache, options["scale"], *options["roi"]
+                )
+                for item in items:
+                    if (item, f_id, c_id) in skip:
+                        continue
+                    savepath = output_path(seq_out_dir, item, f_id, c_id)
+                    save_general_data(savepath, record, item, options["passthrough"], writer)
+                    done.append((item, f_id, c_id))
+                if "roi" in record.camera_cache:
+                    rois["{:05}_{:02}".format(f_id, c_id)] = record.camera_cache["roi"]
+    finally:
+        writer.close()
+
+    # journal outputs once they are all written
+    entries = []
+    for item, f_id, c_id in done:
+        savepath = output_path(seq_out_dir, item, f_id, c_id)
+        if not os.path.exists(savepath):
+            entries.append((item, f_id, c_id, -1, None))
+        else:
+            crc = file_crc32(savepath) if options["checksum"] else None
+            entries.append((item, f_id, c_id, os.path.getsize(savepath), crc))
+    return len(f_ids) * len(c_ids), entries, PROFILER.pop() if options["profile"] else [], rois
+
+
+def save_audio(seq_out_dir, raw_reader, f_start, f_stop, checksum=False):
+    """Stream the audio of frames [f_start, f_stop) into audios/audio.wav, chunk by chunk.
+
+    Returns:
+        the journal entry of the output
+    """
+    savepath = output_path(seq_out_dir, "audio", f_start, f_stop)
+    with PROFILER.stage("write", "audio") as stage:
+        n_samples = raw_reader.writewav(savepath + ".tmp", f_start, f_stop)
+        if n_samples is not None:
+            os.replace(savepath + ".tmp", savepath)
+            stage.nbytes = os.path.getsize(savepath)
+    if n_samples is None:
+        return ("audio", f_start, f_stop, -1, None)
+    return ("audio", f_start, f_stop, os.path.getsize(savepath), file_crc32(savepath) if checksum else None)
+
+
+def save_calibration(seq_out_dir, raw_reader, anno_reader, n_frame, scale=1, roi=None, roi_size=None):
+    """Save calib.npz, the (C, ...) calibration arrays of all cameras, and calib.json, the actor/camera info with
+    the intrinsics and transform of every camera once. The calibration is the same for every frame.
+    With scale > 1, image size and intrinsics are those of the images downsampled by scale.
+    With an roi, images are cropped to the window (x, y, w, h) of every output saved in rois.json: the principal
+    point of an output is (cx - x, cy - y)."""
+    cam_info = raw_reader.get_Camera_info()
+    actor_info = raw_reader.get_actor_info()
+    calib = anno_reader.get_Calibration_array()
+    img_h, img_w = scaled_shape(*[int(x) for x in cam_info["resolution"]], scale)
+    if scale != 1:
+        calib["K"][:, :2] /= scale
+    np.savez(os.path.join(seq_out_dir, "calib.npz"), **calib)
 
-    # Construct cam file
     json_contents = {
         "actor_id": raw_reader.actor_id,
         "performance_part": raw_reader.performance_part,
@@ -119,28 +520,272 @@ for seq in seqs:
         "gender": actor_info["gender"],
         "height": actor_info["height"],
         "weight": actor_info["weight"],
-        "img_h": cam_info["resolution"][0],
-        "img_w": cam_info["resolution"][1],
+        "img_h": img_h,
+        "img_w": img_w,
         "n_frames": cam_info["num_frame"],
         "n_cams": cam_info["num_device"],
-        "frames": [],
+        "n_unfolded_frames": n_frame,
+        "scale": scale,
+        "roi": roi,
+        "roi_size": roi_size,
+        "rois_file": None if roi is None else "rois.json",
+        "calib_file": "calib.npz",
+        "cameras": [],
     }
-    for f_id in range(n_frame):
-        for c_id in range(n_cam):
-            calib = anno_reader.get_Calibration("{:02}".format(c_id))
-            frame = {
-                "timestep_index": f_id,
-                "camera_index": c_id,
-                "cx": calib["K"][0, 2],
-                "cy": calib["K"][1, 2],
-                "fx": calib["K"][0, 0],
-                "fy": calib["K"][1, 1],
-                "img_h": cam_info["resolution"][0],
-                "img_w": cam_info["resolution"][1],
-                "transform_matrix": calib["RT"],
+    for i, c_id in enumerate(calib["cameras"]):
+        K = calib["K"][i]
+        json_contents["cameras"].append(
+            {
+                "camera_index": int(c_id),
+                "cx": K[0, 2],
+                "cy": K[1, 2],
+                "fx": K[0, 0],
+                "fy": K[1, 1],
+                "transform_matrix": calib["RT"][i],
             }
-            json_contents["frames"].append(frame)
+        )
 
-    cam_path = os.path.join(out_dir, seq, "calib.json")
+    cam_path = os.path.join(seq_out_dir, "calib.json")
     with open(cam_path, "w") as fp:
-        json.dump(json_contents, fp, cls=NpEncoder, indent=4)
+        json.dump(json_contents, fp, cls=NpEncoder, separators=(",", ":"))
+
+
+def unfold_sequence(
+    raw_file,
+    anno_file,
+    seq_out_dir,
+    items,
+    pool=None,
+    num_frames=None,
+    frames_per_shard=50,
+    cams_per_shard=1,
+    passthrough=True,
+    restart=False,
+    checksum=False,
+    scale=1,
+    profile=False,
+    write_threads=2,
+    max_pending_writes=64,
+    fsync="none",
+    frames=None,
+    cameras=None,
+    roi=None,
+    roi_size=None,
+):
+    """Unfold one raw/anno .smc pair into seq_out_dir.
+
+    Args:
+        pool (multiprocessing.Pool or None): worker pool, shards run in this process if None.
+        num_frames (int or None): only unfold the first num_frames frames, all frames if None.
+        frames (str or None): frames to unfold among them, a selection like '0-99:2', see utils.parse_selection.
+            The audio covers the span from the first to the last selected frame, whatever the step.
+        cameras (str or None): cameras to unfold, a selection like '18-32' or 'lmk2d', all if None.
+        roi, roi_size: crop images (image, masked_image, mask) to a fixed (x, y, w, h) window, or to a roi_size
+            (w, h) window around the mask ('mask') or the 2d landmarks ('lmk2d') of every output, see
+            SMCReader.get_roi. 2d landmarks are shifted to match and the windows saved to rois.json.
+        passthrough (bool): write stored png bytes as-is when no decode/re-encode is needed.
+        restart (bool): ignore the journal of a previous run and redo every output.
+        checksum (bool): journal the crc32 of every output and check it before skipping an output on resume.
+        scale (int): save images (and 2d landmarks, intrinsics) at 1/scale resolution, decoded reduced.
+        profile (bool): time the read/decode/encode/write/mkdir stages of every item, print a summary table and
+            save it to <seq_out_dir>/unfold_profile.json.
+        write_threads (int): threads per worker encoding and writing outputs behind reads and decodes, 0 to write
+            them inline.
+        max_pending_writes (int): outputs per worker queued for writing before reading blocks.
+        fsync (str): 'none', 'file' or 'shard', see WriteBehind.
+
+    Returns:
+        (number of (frame, camera) pairs, seconds)
+    """
+    st = time.time()
+    PROFILER.enable(profile)
+    PROFILER.pop()
+    raw_reader = SMCReader(raw_file)
+    anno_reader = SMCReader(anno_file)
+    try:
+        cam_info = raw_reader.get_Camera_info()
+        n_frame = cam_info["num_frame"] if num_frames is None else min(num_frames, cam_info["num_frame"])
+        f_ids = raw_reader.select_frames(frames, n_frame)
+        # the anno file knows which cameras have 2d landmarks
+        c_ids = [int(c_id) for c_id in anno_reader.select_cameras(cameras)]
+
+        with PROFILER.stage("mkdir", "folders"):
+            make_output_dirs(seq_out_dir, items)
+
+        roi_key = None if roi is None else [roi, roi_size]
+        journal = UnfoldJournal(seq_out_dir, raw_file, anno_file, restart, scale, roi_key)
+        options = dict(
+            passthrough=passthrough,
+            checksum=checksum,
+            scale=scale,
+            profile=profile,
+            write_threads=write_threads,
+            max_pending_writes=max_pending_writes,
+            fsync=fsync,
+            roi=(roi, roi_size),
+        )
+        frame_items = [item for item in items if item not in SEQUENCE_ITEMS]
+        tasks = []
+        n_skip = 0
+        for f_block, c_block in make_shards(f_ids, c_ids, frames_per_shard, cams_per_shard):
+            skip = frozenset(
+                (item, f_id, c_id)
+                for item in frame_items
+                for f_id in f_block
+                for c_id in c_block
+                if journal.is_done(item, f_id, c_id, verify=checksum)
+            )
+            n_skip += len(skip)
+            if frame_items and len(skip) < len(frame_items) * len(f_block) * len(c_block):
+                tasks.append((raw_file, anno_file, seq_out_dir, frame_items, f_block, c_block, options, skip))
+        if n_skip > 0:
+            print("Resume: {} outputs already done.".format(n_skip))
+        results = map(unfold_shard, tasks) if pool is None else pool.imap_unordered(unfold_shard, tasks)
+
+        n_done = 0
+        records = []
+        rois = dict()
+        rois_path = os.path.join(seq_out_dir, "rois.json")
+        if roi is not None and journal.entries and os.path.exists(rois_path):
+            # windows of the outputs a previous run did and the journal kept, the others are redone
+            kept = {"{:05}_{:02}".format(f_id, c_id) for item, f_id, c_id in journal.entries if item in ROI_ITEMS}
+            with open(rois_path, "r") as fp:
+                rois = {k: v for k, v in json.load(fp).items() if k in kept}
+        bar = tqdm(total=sum(len(t[4]) * len(t[5]) for t in tasks), unit="frame")
+        bar.set_description("Unfold {}".format(os.path.basename(seq_out_dir)))
+        try:
+            # while the pool unfolds the frames
+            # the audio is continuous: it spans the selected frames, skipped ones included
+            audio_range = (f_ids[0], f_ids[-1] + 1) if f_ids else (0, 0)
+            if "audio" in items and not journal.is_done("audio", *audio_range, verify=checksum):
+                journal.append([save_audio(seq_out_dir, raw_reader, *audio_range, checksum)])
+            for n, entries, shard_records, shard_rois in results:
+                journal.append(entries)
+                records += shard_records
+                rois.update(shard_rois)
+                n_done += n
+                bar.update(n)
+        finally:
+            bar.close()
+            journal.close()
+
+        if roi is not None:
+            with open(rois_path, "w") as fp:
+                json.dump(rois, fp, sort_keys=True, separators=(",", ":"))
+        save_calibration(seq_out_dir, raw_reader, anno_reader, len(f_ids), scale, roi, roi_size)
+    finally:
+        raw_reader.close()
+        anno_reader.close()
+        # the shards of an unfold without a pool ran here, on readers of their own
+        close_readers()
+    seconds = time.time() - st
+    if profile:
+        stats = Profiler(enabled=True)
+        stats.merge(records)
+        stats.merge(PROFILER.pop())
+        records = stats.pop()
+        print(format_report(records, seconds))
+        save_report(
+            os.path.join(seq_out_dir, "unfold_profile.json"),
+            records,
+            wall_seconds=seconds,
+            frames=int(n_done),
+            items=items,
+        )
+        PROFILER.enable(False)
+    return n_done, seconds
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Unfold RenderMe360 .smc files of one actor.")
+    parser.add_argument("--data_root", default=DATA_ROOT, help="root path of your RenderMe360 data")
+    parser.add_argument("--actor_id", default=ACTOR_ID, help="the actor index which you want to unfold")
+    parser.add_argument("--items", nargs="+", default=UNFOLD_LIST, choices=list(ITEM2FORLDER.keys()))
+    parser.add_argument("--skip_seq", nargs="*", default=SKIP_SEQ, help="skip some sequences")
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count(), help="0 to run in the main process")
+    add_unfold_arguments(parser)
+    args = parser.parse_args()
+    args.roi = parse_roi(args.roi)
+    return args
+
+
+def add_unfold_arguments(parser):
+    """Options of unfold_sequence, shared with scheduler.py. See unfold_kwargs."""
+    parser.add_argument("--num_frames", type=int, default=None, help="only unfold the first N frames")
+    parser.add_argument("--frames_per_shard", type=int, default=50)
+    parser.add_argument("--cams_per_shard", type=int, default=1)
+    parser.add_argument(
+        "--no_passthrough", action="store_true", help="always decode and re-encode images, even if stored as png"
+    )
+    parser.add_argument("--restart", action="store_true", help="ignore the journal of a previous run, redo everything")
+    parser.add_argument("--checksum", action="store_true", help="journal and verify crc32 of every output")
+    parser.add_argument("--scale", type=int, default=1, help="save images downsampled by this factor, e.g. 2, 4, 8")
+    parser.add_argument("--profile", action="store_true", help="report the time spent in every stage of every item")
+    parser.add_argument("--write_threads", type=int, default=2, help="threads per worker writing outputs, 0 inline")
+    parser.add_argument("--max_pending_writes", type=int, default=64, help="outputs per worker waiting to be written")
+    parser.add_argument("--fsync", default="none", choices=WriteBehind.FSYNC, help="when written outputs are fsynced")
+    parser.add_argument("--frames", default=None, help="frames to unfold, e.g. 0-99, all:5 or 0-99,200-299")
+    parser.add_argument("--cameras", default=None, help="cameras to unfold, e.g. 18-32, 0-59:2 or lmk2d")
+    parser.add_argument("--roi", nargs="+", default=None, help="crop images to X Y W H, or around 'mask' or 'lmk2d'")
+    parser.add_argument("--roi_size", nargs=2, type=int, default=None, help="W H of the mask and lmk2d rois")
+
+
+def unfold_kwargs(args):
+    """Keyword arguments of unfold_sequence from the options of add_unfold_arguments."""
+    return dict(
+        num_frames=args.num_frames,
+        frames_per_shard=args.frames_per_shard,
+        cams_per_shard=args.cams_per_shard,
+        passthrough=not args.no_passthrough,
+        restart=args.restart,
+        checksum=args.checksum,
+        scale=args.scale,
+        profile=args.profile,
+        write_threads=args.write_threads,
+        max_pending_writes=args.max_pending_writes,
+        fsync=args.fsync,
+        frames=args.frames,
+        cameras=args.cameras,
+        roi=args.roi,
+        roi_size=args.roi_size,
+    )
+
+
+def parse_roi(values):
+    """roi of the command line: None, 'mask', 'lmk2d' or the 4 numbers of an (x, y, w, h) window."""
+    if values is None or len(values) == 1 and values[0] in ["mask", "lmk2d"]:
+        return None if values is None else values[0]
+    assert len(values) == 4 and all(v.isdigit() for v in values), f"Invalid roi {' '.join(values)}"
+    return [int(v) for v in values]
+
+
+def main():
+    args = parse_args()
+    out_dir = os.path.join(args.data_root, "preprocess", args.actor_id)
+    directory(out_dir)
+
+    seqs = find_sequences(args.data_root, args.actor_id, args.skip_seq)
+    pool = Pool(args.num_workers) if args.num_workers > 1 else None
+    try:
+        for seq in seqs:
+            raw_file = os.path.join(args.data_root, "raw", args.actor_id, f"{args.actor_id}_{seq}_raw.smc")
+            anno_file = os.path.join(args.data_root, "anno", args.actor_id, f"{args.actor_id}_{seq}_anno.smc")
+
+            print("Processing seq '{}' ... ".format(seq))
+            n_done, seconds = unfold_sequence(
+                raw_file,
+                anno_file,
+                os.path.join(out_dir, seq),
+                args.items,
+                pool=pool,
+                **unfold_kwargs(args),
+            )
+            print("{} frames in {:.1f} sec ({:.1f} frames/sec)".format(n_done, seconds, n_done / max(seconds, 1e-9)))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+if __name__ == "__main__":
+    main()
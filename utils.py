@@ -1,8 +1,9 @@
+import io
 import os
+import re
 
 import cv2
 import numpy as np
-from plyfile import PlyData, PlyElement
 
 ITEM2FORLDER = {
     "image": "images",
@@ -35,6 +36,200 @@ def directory(path):
             print(path + " exists. (multiprocess conflict)")
 
 
+def find_sequences(data_root, actor_id, skip_seq=()):
+    """List the sequences of an actor that have an anno file, in sorted order."""
+    anno_dir = os.path.join(data_root, "anno", actor_id)
+    seqs = set()
+    for file in os.listdir(anno_dir):
+        # only the .smc files, not their sidecars such as the .smc.index.json of smc_index.py
+        match = re.fullmatch(r"{}_(.*)_anno\.smc".format(re.escape(actor_id)), file)
+        if match is None:
+            continue
+        if match.group(1) not in skip_seq:
+            seqs.add(match.group(1))
+    return sorted(seqs)
+
+
+def encoded_ext(img_byte):
+    """Extension of an encoded image from its magic bytes: '.png', '.jpg' or None if unknown."""
+    head = bytes(img_byte[:8])
+    if head == b"\x89PNG\r\n\x1a\n":
+        return ".png"
+    if head[:3] == b"\xff\xd8\xff":
+        return ".jpg"
+    return None
+
+
+def can_passthrough(img_byte, ext, channels=3):
+    """Whether saving the encoded bytes as-is gives the same image as decoding them with cv2.IMREAD_COLOR
+    (reduced to one channel for masks) and encoding the result to ext with cv2.imwrite.
+
+    Only 8-bit png is passed through: bgr (png color type 2) for channels=3, gray (type 0) for channels=1.
+    """
+    if encoded_ext(img_byte) != ext or ext != ".png" or bytes(img_byte[12:16]) != b"IHDR":
+        return False
+    bit_depth, color_type = int(img_byte[24]), int(img_byte[25])
+    return bit_depth == 8 and color_type == (2 if channels == 3 else 0)
+
+
+def write_bytes(path, data):
+    with open(path, "wb") as fp:
+        fp.write(data)
+
+
+# cv2.imread flags decoding at 1/scale, which jpeg does in the DCT domain
+REDUCED_COLOR_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+
+def scaled_shape(h, w, scale):
+    """(h, w) of an image downsampled by scale, rounded up like cv2.IMREAD_REDUCED_*."""
+    return (h + scale - 1) // scale, (w + scale - 1) // scale
+
+
+def resize(img, scale):
+    """Downsample img by an integer scale with area interpolation."""
+    if scale == 1:
+        return img
+    h, w = scaled_shape(img.shape[0], img.shape[1], scale)
+    return cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA)
+
+
+def parse_selection(expr, n, named=None):
+    """Sorted ids in [0, n) selected by expr, a comma separated list of terms:
+        'all'     : every id
+        '7'       : one id
+        '18-32'   : an inclusive range, '100-' runs to the last id
+        ':2'      : any term followed by a stride, e.g. '0-59:2' or 'all:5'
+        a name of named, e.g. 'lmk2d' for named={'lmk2d': cameras with 2d landmarks}
+    None selects every id.
+    """
+    if expr is None:
+        return list(range(n))
+    named = dict() if named is None else named
+    ids = set()
+    for term in str(expr).replace(" ", "").split(","):
+        term, _, stride = term.partition(":")
+        assert stride == "" or (stride.isdigit() and int(stride) > 0), f"Invalid stride in selection {expr}"
+        stride = int(stride) if stride else 1
+        if term in named:
+            selected = sorted(named[term])[::stride]
+        elif term == "all":
+            selected = range(0, n, stride)
+        else:
+            match = re.fullmatch(r"(\d+)(-(\d*))?", term)
+            assert match is not None, f"Invalid term {term} in selection {expr}"
+            start = int(match.group(1))
+            stop = start if match.group(2) is None else (int(match.group(3)) if match.group(3) else n - 1)
+            assert 0 <= start <= stop < n, f"Invalid range {term} in selection {expr}, ids are 0 ~ {n - 1}"
+            selected = range(start, stop + 1, stride)
+        ids.update(int(i) for i in selected)
+    return sorted(ids)
+
+
+def mask_bbox(mask):
+    """(x0, y0, x1, y1) bounds of the nonzero pixels of a mask, exclusive at x1/y1, or None if it is empty."""
+    rows = np.flatnonzero(mask.any(axis=1))
+    if len(rows) == 0:
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+
+
+def points_bbox(points):
+    """(x0, y0, x1, y1) bounds of (N, 2) points, or None if there are none."""
+    if points is None or len(points) == 0:
+        return None
+    x0, y0 = np.floor(np.min(points, axis=0)).astype(int)
+    x1, y1 = np.ceil(np.max(points, axis=0)).astype(int)
+    return int(x0), int(y0), int(x1), int(y1)
+
+
+def roi_around(bbox, size, shape):
+    """(x, y, w, h) of a size (w, h) window centered on bbox (x0, y0, x1, y1) and shifted to fit in an image of
+    shape (H, W, ...). Centered on the image if bbox is None."""
+    w, h = size
+    assert 0 < w <= shape[1] and 0 < h <= shape[0], f"Invalid roi size {size} for images of {shape[:2]}"
+    if bbox is None:
+        cx, cy = shape[1] / 2, shape[0] / 2
+    else:
+        cx, cy = (bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2
+    x = min(max(int(round(cx - w / 2)), 0), shape[1] - w)
+    y = min(max(int(round(cy - h / 2)), 0), shape[0] - h)
+    return x, y, w, h
+
+
+def crop(img, roi):
+    """View of img inside roi (x, y, w, h), None keeps the whole image."""
+    if roi is None:
+        return img
+    x, y, w, h = roi
+    assert x >= 0 and y >= 0 and x + w <= img.shape[1] and y + h <= img.shape[0], f"Invalid roi {roi}"
+    return img[y : y + h, x : x + w]
+
+
+def imdecode_color(img_byte, scale=1):
+    """Decode a bgr image at 1/scale resolution.
+
+    Jpeg is decoded reduced by the codec itself for scales 2, 4 and 8. Other codecs (png) decode at full resolution
+    anyway, so they are downsampled after decoding with area interpolation, which aliases less than cv2's own
+    reduced png decode.
+    """
+    if scale in REDUCED_COLOR_FLAGS and encoded_ext(img_byte) == ".jpg":
+        return cv2.imdecode(img_byte, REDUCED_COLOR_FLAGS[scale])
+    return resize(cv2.imdecode(img_byte, cv2.IMREAD_COLOR), scale)
+
+
+def imdecode_mask(img_byte, scale=1, out=None):
+    """Decode a mask at 1/scale resolution, equal to the max over the channels of imdecode_color(img_byte, scale).
+
+    Png masks are decoded as stored (IMREAD_UNCHANGED): a gray png needs no 3-channel decode nor channel reduction.
+    Other codecs, and 16-bit png, take the imdecode_color path.
+    """
+    img = cv2.imdecode(img_byte, cv2.IMREAD_UNCHANGED) if encoded_ext(img_byte) == ".png" else None
+    if img is None or img.dtype != np.uint8:
+        img = imdecode_color(img_byte, scale)
+    else:
+        # IMREAD_COLOR drops the alpha channel
+        img = resize(img[..., :3] if img.ndim == 3 else img, scale)
+    if img.ndim == 3:
+        # channel by channel, several times faster than the strided reduction of np.max(img, 2)
+        out = np.maximum(img[..., 0], img[..., 1], out=out)
+        return np.maximum(out, img[..., 2], out=out)
+    if out is not None:
+        out[...] = img
+        return out
+    return img
+
+
+def pack_mask(mask, threshold=128):
+    """Binarize a (..., H, W) uint8 mask at threshold and pack every row into bits: (..., H, ceil(W / 8)) uint8."""
+    return np.packbits(mask >= threshold, axis=-1)
+
+
+def unpack_mask(bits, width):
+    """Inverse of pack_mask: (..., H, width) uint8 mask of 0/255."""
+    return np.unpackbits(bits, axis=-1, count=width) * np.uint8(255)
+
+
+def rle_encode_mask(mask, threshold=128):
+    """Run-length encode a HW mask binarized at threshold, in row-major order.
+
+    Returns:
+        (n_runs,) int64 lengths of alternating runs of 0 and 1, starting with 0 (the first run may be empty)
+    """
+    flat = (mask >= threshold).ravel()
+    edges = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    bounds = np.concatenate([[0], edges, [flat.size]])
+    runs = np.diff(bounds)
+    return np.concatenate([[0], runs]) if flat.size and flat[0] else runs
+
+
+def rle_decode_mask(runs, shape):
+    """Inverse of rle_encode_mask: mask of the given (H, W) shape, 0/255 uint8."""
+    values = (np.arange(len(runs)) % 2).astype(np.uint8) * np.uint8(255)
+    return np.repeat(values, runs).reshape(shape)
+
+
 def vislmks(filename, lmks_2d, img_h, img_w, bg_img=None):
     if bg_img is None:
         bg_img = np.zeros((img_h, img_w, 3))
@@ -44,6 +239,13 @@ def vislmks(filename, lmks_2d, img_h, img_w, bg_img=None):
     cv2.imwrite(filename, bg_img)
 
 
+def _write_rows(fw, row_fmt, rows, chunk_size=100000):
+    """Write rows of an (N, K) array with one %-format per chunk instead of one f-string per row."""
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start : start + chunk_size]
+        fw.write((row_fmt * len(chunk)) % tuple(chunk.ravel().tolist()))
+
+
 def write_obj(filepath, verts, tris=None, log=True):
     """将mesh顶点与三角面片存储为.obj文件,方便查看
 
@@ -51,33 +253,68 @@ def write_obj(filepath, verts, tris=None, log=True):
         verts:      Vx3, vertices coordinates
         tris:       n_facex3, faces consisting of vertices id
     """
-    fw = open(filepath, "w")
-    # vertices
-    for vert in verts:
-        fw.write(f"v {vert[0]} {vert[1]} {vert[2]}\n")
-
-    if not tris is None:
-        for tri in tris:
-            fw.write(f"f {tri[0]} {tri[1]} {tri[2]}\n")
-    fw.close()
+    verts = np.asarray(verts)
+    # the significant digits that round-trip the vertices exactly: 9 for float32 (and float16), 17 for float64
+    if np.issubdtype(verts.dtype, np.floating) and verts.dtype.itemsize <= 4:
+        verts, row_fmt = verts.astype(np.float32), "v %.9g %.9g %.9g\n"
+    else:
+        verts, row_fmt = verts.astype(np.float64), "v %.17g %.17g %.17g\n"
+    with open(filepath, "w") as fw:
+        _write_rows(fw, row_fmt, verts)
+
+        if not tris is None:
+            _write_rows(fw, "f %d %d %d\n", np.asarray(tris, dtype=np.int64))
     if log:
         print(f"mesh has been saved in {filepath}.")
 
 
-def write_ply(scan, outpath):
-    vertex = np.empty(len(scan["vertex"]), dtype=[("x", "f4"), ("y", "f4"), ("z", "f4")])
-    for i in range(len(scan["vertex"])):
-        vertex[i] = np.array(
-            [(scan["vertex"][i, 0], scan["vertex"][i, 1], scan["vertex"][i, 2])],
-            dtype=[("x", "f4"), ("y", "f4"), ("z", "f4")],
-        )
-    triangles = scan["vertex_indices"]
+def write_ply(scan, outpath, binary=False):
+    """Save a scan mesh as .ply.
+
+    Args:
+        scan: dict-like with 'vertex' (n, 3) and 'vertex_indices' (m, 3).
+        binary: write a binary little-endian ply instead of ascii.
+    """
+    verts = np.asarray(scan["vertex"])
+    vertex = np.empty(len(verts), dtype=[("x", "<f4"), ("y", "<f4"), ("z", "<f4")])
+    vertex["x"] = verts[:, 0]
+    vertex["y"] = verts[:, 1]
+    vertex["z"] = verts[:, 2]
+    triangles = np.asarray(scan["vertex_indices"])
+    # Same layout as a ply face record: list length, 3 vertex indices, rgb.
     face = np.empty(
-        len(triangles), dtype=[("vertex_indices", "i4", (3,)), ("red", "u1"), ("green", "u1"), ("blue", "u1")]
+        len(triangles),
+        dtype=[("n", "u1"), ("vertex_indices", "<i4", (3,)), ("red", "u1"), ("green", "u1"), ("blue", "u1")],
+    )
+    face["n"] = 3
+    face["vertex_indices"] = triangles
+    face["red"] = 255
+    face["green"] = 255
+    face["blue"] = 255
+
+    header = "\n".join(
+        [
+            "ply",
+            "format {} 1.0".format("binary_little_endian" if binary else "ascii"),
+            "element vertex {}".format(len(vertex)),
+            "property float x",
+            "property float y",
+            "property float z",
+            "element face {}".format(len(face)),
+            "property list uchar int vertex_indices",
+            "property uchar red",
+            "property uchar green",
+            "property uchar blue",
+            "end_header",
+        ]
     )
-    for i in range(len(triangles)):
-        face[i] = np.array(
-            [([triangles[i, 0], triangles[i, 1], triangles[i, 2]], 255, 255, 255)],
-            dtype=[("vertex_indices", "i4", (3,)), ("red", "u1"), ("green", "u1"), ("blue", "u1")],
-        )
-    PlyData([PlyElement.describe(vertex, "vertex"), PlyElement.describe(face, "face")], text=True).write(outpath)
+    with open(outpath, "wb") as fw:
+        fw.write(header.encode("ascii") + b"\n")
+        if binary:
+            fw.write(vertex.tobytes())
+            fw.write(face.tobytes())
+        else:
+            body = io.StringIO()
+            _write_rows(body, "%.18g %.18g %.18g\n", verts.astype(np.float32))
+            _write_rows(body, "3 %d %d %d 255 255 255\n", triangles.astype(np.int32))
+            fw.write(body.getvalue().encode("ascii"))